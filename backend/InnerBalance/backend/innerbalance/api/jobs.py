@@ -0,0 +1,138 @@
+"""
+Report workers for the ReportJob queue (`manage.py run_report_workers`).
+
+A worker claims one job at a time, keeps its lease alive from a heartbeat
+thread while the report is generated, and then marks the job done, or
+requeues it with backoff. Generation is idempotent per assessment: an
+attempt that crashed after storing its report is completed from the
+stored copy without calling the LLM again.
+
+Stored reports are final, so a rule-based fallback (the LLM failed or is
+not loaded) is never stored: the attempt fails and is retried. Workers do
+not claim jobs while the engine cannot generate.
+"""
+import os
+import socket
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from api.models import ReportJob
+from api.session_cache import clear_session, report_state
+from questionnaires.models import AssessmentReport
+from rag.engine import get_engine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_CONFIG = {
+    'WORKERS': 1,
+    'VISIBILITY_TIMEOUT': 600,
+    'MAX_ATTEMPTS': 3,
+    'RETRY_BACKOFF_SECONDS': 15,
+    'POLL_INTERVAL': 1.0,
+    'STARVATION_SECONDS': 300,
+}
+
+
+def job_config() -> Dict[str, Any]:
+    return {**DEFAULT_JOB_CONFIG, **(settings.RAG_ENGINE.get('REPORT_JOBS') or {})}
+
+
+def generate_job_report(job: ReportJob, engine) -> Dict[str, Any]:
+    """Generate and store the report for a job, or reuse the stored one"""
+    assessment = job.assessment
+    stored = AssessmentReport.objects.filter(assessment=assessment).first()
+    if stored is None:
+        follow_up_responses = job.payload.get('follow_up_responses', {})
+        initial_answers = {int(k): v for k, v in job.payload.get('initial_answers', {}).items()}
+        report = engine.generate_comprehensive_report(
+            initial_answers or assessment.initial_answers(), follow_up_responses,
+            priority=job.priority_class, admission=False, **report_state(assessment)
+        )
+        if report.get('generated_by') == 'rules':
+            raise RuntimeError("LLM report generation failed; not storing the rule-based report")
+        stored = AssessmentReport.store(assessment, report, follow_up_responses)
+        clear_session(assessment)
+    return stored.content
+
+
+class ReportWorker:
+    """Single-threaded consumer of the ReportJob queue"""
+
+    def __init__(self, name: Optional[str] = None, config: Optional[Dict[str, Any]] = None):
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.config = config or job_config()
+        self.stopping = threading.Event()
+        self._engine_down = False
+
+    def stop(self):
+        """Finish the current job, then exit"""
+        self.stopping.set()
+
+    def run(self, max_jobs: Optional[int] = None) -> int:
+        engine = get_engine()
+        engine.wait_until_ready()
+
+        processed = 0
+        while not self.stopping.is_set():
+            if not self._engine_ready(engine):
+                # Leave the jobs queued rather than spend their attempts
+                self.stopping.wait(self.config['POLL_INTERVAL'])
+                continue
+
+            close_old_connections()
+            ReportJob.fail_exhausted()
+            job = ReportJob.claim(self.name, self.config['VISIBILITY_TIMEOUT'],
+                                  self.config['STARVATION_SECONDS'])
+            if job is None:
+                self.stopping.wait(self.config['POLL_INTERVAL'])
+                continue
+
+            self.process(job, engine)
+            processed += 1
+            if max_jobs and processed >= max_jobs:
+                break
+        return processed
+
+    def _engine_ready(self, engine) -> bool:
+        """Whether the models are loaded; acquire() retries a failed warm-up"""
+        ready = engine.acquire() is not None and engine.state == engine.READY
+        if ready == self._engine_down:
+            self._engine_down = not ready
+            if ready:
+                logger.info(f"Worker {self.name}: RAG engine ready, claiming jobs")
+            else:
+                logger.warning(f"Worker {self.name}: RAG engine {engine.state}, not claiming jobs")
+        return ready
+
+    def process(self, job: ReportJob, engine):
+        logger.info(f"Worker {self.name} running {job.priority_class} job {job.id} "
+                    f"(attempt {job.attempts}/{job.max_attempts})")
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, done), daemon=True)
+        heartbeat.start()
+        try:
+            result = generate_job_report(job, engine)
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            job.retry_or_fail(str(e), self.config['RETRY_BACKOFF_SECONDS'])
+        else:
+            if not job.succeed(result):
+                logger.warning(f"Job {job.id} lost its lease before finishing")
+        finally:
+            done.set()
+            heartbeat.join()
+
+    def _heartbeat(self, job: ReportJob, done: threading.Event):
+        """Extend the lease every third of the visibility timeout"""
+        timeout = self.config['VISIBILITY_TIMEOUT']
+        try:
+            while not done.wait(timeout / 3):
+                if not job.extend_lease(timeout):
+                    logger.warning(f"Job {job.id} lease was taken over")
+                    return
+        finally:
+            connection.close()
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='reportjob',
+            name='api_reportj_status_4ea2a5_idx',
+        ),
+        migrations.AddField(
+            model_name='reportjob',
+            name='priority',
+            field=models.IntegerField(choices=[(0, 'crisis'), (1, 'high'), (2, 'moderate'), (3, 'routine')], default=3),
+        ),
+        migrations.AddIndex(
+            model_name='reportjob',
+            index=models.Index(fields=['status', 'priority', 'available_at'], name='api_reportj_status_78a1bb_idx'),
+        ),
+    ]
@@ -1,3 +1,173 @@
-from django.db import models
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 
 # Create your models here.
+
+from questionnaires.models import Assessment
+from rag.scheduler import PRIORITIES, RANKS
+
+class ReportJob(models.Model):
+    """
+    A queued report generation, consumed by `manage.py run_report_workers`.
+
+    Workers claim jobs with a conditional UPDATE (no row locks needed, so it
+    works on SQLite too) and hold them for a visibility timeout. A worker that
+    crashes simply lets its lease expire and the job becomes claimable again.
+    Likewise a conditional unique constraint, not a lock, keeps an assessment
+    to one queued, running or succeeded job.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+    # Statuses of the job an enqueue hands back instead of creating another
+    ACTIVE_STATUSES = [QUEUED, RUNNING, SUCCEEDED]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    assessment = models.ForeignKey(Assessment, on_delete=models.CASCADE, related_name='report_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    # Clinical priority rank (0 = crisis), claimed lowest first
+    priority = models.IntegerField(choices=list(enumerate(PRIORITIES)), default=RANKS['routine'])
+    # Request body the report is generated from
+    payload = models.JSONField(default=dict)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    # Not claimable before this time (retry backoff)
+    available_at = models.DateTimeField(default=timezone.now)
+    # Current claim: a running job whose lease has expired is claimable again
+    lease = models.UUIDField(null=True, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'priority', 'available_at']),
+            models.Index(fields=['status', 'locked_until']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['assessment'],
+                condition=Q(status__in=['queued', 'running', 'succeeded']),
+                name='one_active_report_job',
+            ),
+        ]
+
+    def __str__(self):
+        return f"ReportJob {self.id} ({self.status})"
+
+    @property
+    def priority_class(self):
+        return PRIORITIES[self.priority]
+
+    @classmethod
+    def enqueue(cls, assessment, payload, priority='routine', max_attempts=3):
+        """
+        Queue a report for an assessment; a refresh or retry gets the job
+        already queued, running or done for it instead of a new one
+        """
+        existing = cls._active(assessment)
+        if existing is not None:
+            return existing, False
+        try:
+            # Savepoint, so a caller's transaction survives losing the race
+            with transaction.atomic():
+                return cls.objects.create(
+                    assessment=assessment, payload=payload, priority=RANKS[priority], max_attempts=max_attempts
+                ), True
+        except IntegrityError:
+            # A concurrent enqueue for the same assessment created it first
+            return cls._active(assessment), False
+
+    @classmethod
+    def _active(cls, assessment):
+        return cls.objects.filter(assessment=assessment, status__in=cls.ACTIVE_STATUSES).first()
+
+    @classmethod
+    def _claimable(cls, now):
+        ready = Q(status=cls.QUEUED, available_at__lte=now)
+        expired = Q(status=cls.RUNNING, locked_until__lt=now)
+        return (ready | expired) & Q(attempts__lt=F('max_attempts'))
+
+    @classmethod
+    def claim(cls, worker, visibility_timeout, starvation_seconds=None):
+        """
+        Lease the most urgent claimable job to `worker`, or return None. A job
+        that has waited `starvation_seconds` goes first whatever its priority.
+        """
+        now = timezone.now()
+        claimable = cls.objects.filter(cls._claimable(now))
+        candidates = list(claimable.order_by('priority', 'created_at').values_list('id', flat=True)[:10])
+        if starvation_seconds:
+            starved = (claimable.filter(created_at__lt=now - timedelta(seconds=starvation_seconds))
+                       .order_by('created_at').values_list('id', flat=True)[:1])
+            candidates = list(starved) + candidates
+        for job_id in candidates:
+            lease = uuid.uuid4()
+            claimed = cls.objects.filter(cls._claimable(now), pk=job_id).update(
+                status=cls.RUNNING,
+                lease=lease,
+                locked_until=now + timedelta(seconds=visibility_timeout),
+                worker=worker,
+                attempts=F('attempts') + 1,
+                started_at=now,
+            )
+            # Zero rows means another worker won this one
+            if claimed:
+                return cls.objects.get(pk=job_id)
+        return None
+
+    @classmethod
+    def fail_exhausted(cls):
+        """Fail running jobs whose lease expired on their last attempt"""
+        now = timezone.now()
+        return cls.objects.filter(
+            status=cls.RUNNING, locked_until__lt=now, attempts__gte=F('max_attempts')
+        ).update(status=cls.FAILED, lease=None, finished_at=now,
+                 error='Worker lease expired on the final attempt')
+
+    def _owned(self):
+        return ReportJob.objects.filter(pk=self.pk, status=self.RUNNING, lease=self.lease)
+
+    def extend_lease(self, visibility_timeout):
+        """Heartbeat; False once the job is no longer ours"""
+        return bool(self._owned().update(
+            locked_until=timezone.now() + timedelta(seconds=visibility_timeout)
+        ))
+
+    def succeed(self, result):
+        return bool(self._owned().update(
+            status=self.SUCCEEDED, result=result, error='', lease=None,
+            locked_until=None, finished_at=timezone.now()
+        ))
+
+    def retry_or_fail(self, error, backoff_seconds):
+        """Requeue with exponential backoff, or fail after the last attempt"""
+        now = timezone.now()
+        if self.attempts >= self.max_attempts:
+            return bool(self._owned().update(
+                status=self.FAILED, error=error, lease=None, locked_until=None, finished_at=now
+            ))
+        delay = backoff_seconds * 2 ** (self.attempts - 1)
+        return bool(self._owned().update(
+            status=self.QUEUED, error=error, lease=None, locked_until=None,
+            available_at=now + timedelta(seconds=delay)
+        ))
@@ -2,46 +2,127 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 from django.views.decorators.csrf import csrf_exempt
+from django.http import StreamingHttpResponse, JsonResponse
+from django.conf import settings
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.middleware.csrf import CsrfViewMiddleware
+from asgiref.sync import sync_to_async
+from functools import wraps
+import asyncio
 import json
 import logging
+import time
 
-from rag.meditron_rag import MeditronRAGSystem
+from api.jobs import job_config
+from api.models import ReportJob
+from api.session_cache import cached_follow_up, clear_session, report_state, save_session
+from questionnaires.models import Assessment, AssessmentReport
+from rag.engine import get_engine
+from rag.executor import get_executor
+from rag.scheduler import priority_for
 
-# Initialize RAG system
-rag_system = MeditronRAGSystem()
+# Process-wide RAG engine; models load lazily in the background
+rag_engine = get_engine()
 
 logger = logging.getLogger(__name__)
 
+def _process_answers(answers):
+    """Convert string keys/values from JSON to integers, dropping invalid ones"""
+    processed = {}
+    for key, value in answers.items():
+        try:
+            processed[int(key)] = int(value)
+        except (ValueError, TypeError):
+            continue
+    return processed
+
+def _save_submission(request, assessment_id, processed_answers):
+    """
+    Persist posted initial answers on the client's assessment. Its running
+    totals then cover these and any answers sent to /api/assessments/answer/.
+    """
+    assessment = Assessment.for_external_id(assessment_id, request.user)
+    if processed_answers:
+        assessment.record_answers(processed_answers)
+    return assessment
+
+def _invalid_answers(error):
+    return {'error': 'Invalid answers', 'details': error.messages}
+
+def _stored_report(assessment):
+    return AssessmentReport.objects.filter(assessment=assessment).first()
+
+def _store_report(assessment, report, follow_up_responses):
+    """
+    Store a generated report and return its content. Rule-based stand-ins
+    (models still loading, or load shed) and reports salvaged from a
+    generation cut off by its deadline are returned unstored so that a retry
+    can still get the complete generated report.
+    """
+    if report.get('generated_by') in ('rules', 'partial'):
+        return report
+    stored = AssessmentReport.store(assessment, report, follow_up_responses)
+    clear_session(assessment)
+    return stored.content
+
+def _follow_up_for(assessment, scores, analysis, deadline):
+    """Questions from the assessment's session cache, or generated and remembered"""
+    follow_up = cached_follow_up(assessment, scores)
+    if follow_up is None:
+        follow_up = rag_engine.generate_follow_up(analysis, deadline=deadline)
+        save_session(assessment, scores, analysis, follow_up)
+    return follow_up
+
+def _generation_deadline():
+    """Wall-clock time at which generation for this request stops and salvages its output"""
+    seconds = settings.RAG_ENGINE.get('GENERATION_DEADLINE_SECONDS')
+    return time.time() + seconds if seconds else None
+
+def _sse_response(events):
+    """Wrap an iterator of {'event', 'data'} dicts in a text/event-stream response"""
+    def stream():
+        try:
+            for event in events:
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+        except Exception as e:
+            logger.error(f"Error while streaming: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+    
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
+
 @api_view(['POST'])
 def analyze_initial_assessment(request):
     """
     Analyze first 10 answers and generate personalized follow-up questions
     """
+    deadline = _generation_deadline()
     try:
         data = request.data
         assessment_id = data.get('assessment_id')
         answers = data.get('answers', {})
         
         # Convert string keys to integers if needed
-        processed_answers = {}
-        for key, value in answers.items():
-            try:
-                processed_answers[int(key)] = int(value)
-            except (ValueError, TypeError):
-                continue
+        processed_answers = _process_answers(answers)
         
         logger.info(f"Analyzing assessment {assessment_id} with answers: {processed_answers}")
         
-        # Analyze answers
-        analysis = rag_system.analyze_initial_answers(processed_answers)
+        # Persist the answers, then analyze their stored totals
+        assessment = _save_submission(request, assessment_id, processed_answers)
+        assessment_id = assessment.external_id
+        scores = assessment.scores()
+        analysis = rag_engine.analysis_from_scores(scores)
         
-        # Generate follow-up questions
-        follow_up_questions = rag_system.generate_follow_up_questions(analysis)
+        # Generate follow-up questions (a resubmission reuses them)
+        follow_up = _follow_up_for(assessment, scores, analysis, deadline)
         
         response_data = {
             'assessment_id': assessment_id,
             'analysis': analysis,
-            'follow_up_questions': follow_up_questions,
+            'follow_up_questions': follow_up['questions'],
+            'generated_by': follow_up['generated_by'],
             'risk_level': analysis['suicide_risk'],
             'status': 'success'
         }
@@ -52,6 +133,10 @@ def analyze_initial_assessment(request):
         
         return Response(response_data, status=status.HTTP_200_OK)
         
+    except PermissionDenied as e:
+        return Response({'error': str(e)}, status=status.HTTP_403_FORBIDDEN)
+    except ValidationError as e:
+        return Response(_invalid_answers(e), status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         logger.error(f"Error in analyze_initial_assessment: {str(e)}")
         return Response({
@@ -64,6 +149,7 @@ def generate_clinical_report(request):
     """
     Generate comprehensive clinical report from all answers
     """
+    deadline = _generation_deadline()
     try:
         data = request.data
         assessment_id = data.get('assessment_id')
@@ -71,20 +157,29 @@ def generate_clinical_report(request):
         follow_up_responses = data.get('follow_up_responses', {})
         
         # Process answers
-        processed_initial = {}
-        for key, value in initial_answers.items():
-            try:
-                processed_initial[int(key)] = int(value)
-            except (ValueError, TypeError):
-                continue
+        processed_initial = _process_answers(initial_answers)
         
-        logger.info(f"Generating report for assessment {assessment_id}")
+        assessment = Assessment.for_external_id(assessment_id, request.user)
+        assessment_id = assessment.external_id
         
-        # Generate comprehensive report
-        report = rag_system.generate_comprehensive_report(
-            processed_initial, 
-            follow_up_responses
-        )
+        # A refresh or retry returns the stored report instead of regenerating it
+        stored = _stored_report(assessment)
+        if stored is None:
+            logger.info(f"Generating report for assessment {assessment_id}")
+            if processed_initial:
+                assessment.record_answers(processed_initial)
+            
+            # Generate comprehensive report
+            report = rag_engine.generate_comprehensive_report(
+                processed_initial or assessment.initial_answers(), 
+                follow_up_responses,
+                deadline=deadline,
+                **report_state(assessment)
+            )
+            report = _store_report(assessment, report, follow_up_responses)
+        else:
+            logger.info(f"Returning stored report for assessment {assessment_id}")
+            report = stored.content
         
         response_data = {
             'assessment_id': assessment_id,
@@ -95,6 +190,10 @@ def generate_clinical_report(request):
         
         return Response(response_data, status=status.HTTP_200_OK)
         
+    except PermissionDenied as e:
+        return Response({'error': str(e)}, status=status.HTTP_403_FORBIDDEN)
+    except ValidationError as e:
+        return Response(_invalid_answers(e), status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         logger.error(f"Error in generate_clinical_report: {str(e)}")
         return Response({
@@ -102,17 +201,331 @@ def generate_clinical_report(request):
             'details': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['POST'])
+def analyze_initial_assessment_stream(request):
+    """
+    Streaming variant of analyze-initial: sends the analysis, then tokens and
+    each follow-up question as soon as it is complete, over server-sent events
+    """
+    deadline = _generation_deadline()
+    data = request.data
+    assessment_id = data.get('assessment_id')
+    processed_answers = _process_answers(data.get('answers', {}))
+    
+    logger.info(f"Streaming analysis for assessment {assessment_id}")
+    try:
+        assessment = _save_submission(request, assessment_id, processed_answers)
+    except ValidationError as e:
+        return Response(_invalid_answers(e), status=status.HTTP_400_BAD_REQUEST)
+    assessment_id = assessment.external_id
+    scores = assessment.scores()
+    analysis = rag_engine.analysis_from_scores(scores)
+    
+    if analysis['suicide_risk'] == 'high':
+        logger.warning(f"HIGH RISK detected in assessment {assessment_id}")
+    
+    def events():
+        yield {'event': 'analysis', 'data': {
+            'assessment_id': assessment_id,
+            'analysis': analysis,
+            'risk_level': analysis['suicide_risk'],
+        }}
+        cached = cached_follow_up(assessment, scores)
+        if cached is not None:
+            for question in cached['questions']:
+                yield {'event': 'question', 'data': question}
+            yield {'event': 'done', 'data': {
+                'follow_up_questions': cached['questions'],
+                'generated_by': cached['generated_by'],
+            }}
+            return
+        for event in rag_engine.stream_follow_up_questions(analysis, deadline=deadline):
+            if event['event'] == 'done':
+                # Retrieved documents stay server-side, for the report step
+                data = dict(event['data'])
+                documents = data.pop('context_documents', None)
+                save_session(assessment, scores, analysis, {
+                    'questions': data['follow_up_questions'],
+                    'generated_by': data.get('generated_by', 'llm'),
+                    'context_documents': documents,
+                })
+                event = {'event': 'done', 'data': data}
+            yield event
+    
+    return _sse_response(events())
+
+@api_view(['POST'])
+def generate_clinical_report_stream(request):
+    """
+    Streaming variant of generate-report: sends tokens as they are generated
+    and the parsed report in the final `done` event
+    """
+    deadline = _generation_deadline()
+    data = request.data
+    assessment_id = data.get('assessment_id')
+    processed_initial = _process_answers(data.get('initial_answers', {}))
+    follow_up_responses = data.get('follow_up_responses', {})
+    
+    assessment = Assessment.for_external_id(assessment_id, request.user)
+    
+    stored = _stored_report(assessment)
+    if stored is not None:
+        logger.info(f"Returning stored report for assessment {assessment.external_id}")
+        return _sse_response(iter([{'event': 'done', 'data': {'report': stored.content}}]))
+    
+    logger.info(f"Streaming report for assessment {assessment.external_id}")
+    if processed_initial:
+        try:
+            assessment.record_answers(processed_initial)
+        except ValidationError as e:
+            return Response(_invalid_answers(e), status=status.HTTP_400_BAD_REQUEST)
+    state = report_state(assessment)
+    
+    def events():
+        for event in rag_engine.stream_comprehensive_report(
+            processed_initial or assessment.initial_answers(), follow_up_responses, deadline=deadline,
+            **state
+        ):
+            if event['event'] == 'done':
+                report = _store_report(assessment, event['data']['report'], follow_up_responses)
+                event = {'event': 'done', 'data': {'report': report}}
+            yield event
+    
+    return _sse_response(events())
+
+def _job_data(job):
+    data = {
+        'job_id': str(job.id),
+        'assessment_id': job.assessment.external_id,
+        'status': job.status,
+        'priority': job.priority_class,
+        'attempts': job.attempts,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
+    if job.status == ReportJob.SUCCEEDED:
+        data['report'] = job.result
+    elif job.error:
+        data['error'] = job.error
+    return data
+
+@api_view(['POST'])
+def enqueue_report_job(request):
+    """
+    Queue report generation for `manage.py run_report_workers`; poll the
+    returned job for the report
+    """
+    try:
+        data = request.data
+        processed_initial = _process_answers(data.get('initial_answers', {}))
+        follow_up_responses = data.get('follow_up_responses', {})
+        
+        assessment = _save_submission(request, data.get('assessment_id'), processed_initial)
+        priority = priority_for(rag_engine.analysis_from_scores(assessment.scores()))
+        job, created = ReportJob.enqueue(assessment, {
+            'initial_answers': processed_initial,
+            'follow_up_responses': follow_up_responses,
+        }, priority=priority, max_attempts=job_config()['MAX_ATTEMPTS'])
+        
+        if created:
+            logger.info(f"Queued report job {job.id} for assessment {assessment.external_id}")
+        
+        response_data = _job_data(job)
+        response_data['status_url'] = f"/api/report-jobs/{job.id}/"
+        return Response(response_data, status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
+        
+    except PermissionDenied as e:
+        return Response({'error': str(e)}, status=status.HTTP_403_FORBIDDEN)
+    except ValidationError as e:
+        return Response(_invalid_answers(e), status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.error(f"Error in enqueue_report_job: {str(e)}")
+        return Response({
+            'error': 'Failed to queue clinical report',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+def report_job_status(request, job_id):
+    """
+    Status of a report job, with the report once it has succeeded
+    """
+    job = ReportJob.objects.select_related('assessment').filter(pk=job_id).first()
+    if job is None:
+        return Response({'error': 'Unknown report job'}, status=status.HTTP_404_NOT_FOUND)
+    job.assessment.check_access(request.user)
+    return Response(_job_data(job), status=status.HTTP_200_OK)
+
 @api_view(['GET'])
 def system_status(request):
     """
     Check RAG system status and capabilities
     """
-    status_info = {
-        'llm_loaded': rag_system.llm is not None,
-        'vector_store_ready': True,  # We'll check this
-        'knowledge_base_items': rag_system.vector_store._collection.count() if hasattr(rag_system.vector_store, '_collection') else 0,
+    status_info = rag_engine.status()
+    status_info.update({
         'system': 'Meditron-RAG Mental Health Assessment',
         'version': '1.0'
-    }
+    })
+    
+    return Response(status_info, status=status.HTTP_200_OK)
+
+# ---------------------------------------------------------------------------
+# Async variants for ASGI deployments: the event loop holds the connections
+# while RAG engine calls run on the bounded inference executor
+# ---------------------------------------------------------------------------
+
+def _request_deadline():
+    return settings.RAG_ENGINE.get('REQUEST_DEADLINE_SECONDS') or None
+
+def _check_session_csrf(request):
+    """DRF's rule: CSRF is enforced for session-authenticated users only"""
+    if request.user.is_authenticated:
+        return CsrfViewMiddleware(lambda r: None).process_view(request, None, (), {})
+    return None
+
+def async_api_view(methods):
+    """
+    @api_view for async views (DRF 3.14 has no async support): method check,
+    session CSRF rule, and the JSON body parsed into request.data
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return JsonResponse({'detail': f'Method "{request.method}" not allowed.'},
+                                    status=status.HTTP_405_METHOD_NOT_ALLOWED)
+            rejected = await sync_to_async(_check_session_csrf)(request)
+            if rejected is not None:
+                return rejected
+            try:
+                request.data = json.loads(request.body or b'{}')
+            except ValueError:
+                return JsonResponse({'detail': 'JSON parse error'}, status=status.HTTP_400_BAD_REQUEST)
+            return await view(request, *args, **kwargs)
+        
+        # CSRF is checked above, after authentication, as DRF does
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+@async_api_view(['POST'])
+async def analyze_initial_assessment_async(request):
+    """
+    Async analyze-initial; rule-based questions if generation misses the
+    request deadline
+    """
+    deadline = _generation_deadline()
+    try:
+        data = request.data
+        processed_answers = _process_answers(data.get('answers', {}))
+        assessment = await sync_to_async(_save_submission)(request, data.get('assessment_id'), processed_answers)
+        assessment_id = assessment.external_id
+        scores = assessment.scores()
+        analysis = rag_engine.analysis_from_scores(scores)
+        
+        deadline_exceeded = False
+        try:
+            follow_up = await get_executor().run(
+                _follow_up_for, assessment, scores, analysis, deadline, timeout=_request_deadline()
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Follow-up generation for assessment {assessment_id} missed its deadline")
+            follow_up = {'questions': rag_engine.fallback_follow_up_questions(analysis), 'generated_by': 'rules'}
+            deadline_exceeded = True
+        
+        if analysis['suicide_risk'] == 'high':
+            logger.warning(f"HIGH RISK detected in assessment {assessment_id}")
+        
+        return JsonResponse({
+            'assessment_id': assessment_id,
+            'analysis': analysis,
+            'follow_up_questions': follow_up['questions'],
+            'generated_by': follow_up['generated_by'],
+            'risk_level': analysis['suicide_risk'],
+            'status': 'success',
+            'deadline_exceeded': deadline_exceeded,
+        }, status=status.HTTP_200_OK)
+        
+    except PermissionDenied as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_403_FORBIDDEN)
+    except ValidationError as e:
+        return JsonResponse(_invalid_answers(e), status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.error(f"Error in analyze_initial_assessment_async: {str(e)}")
+        return JsonResponse({
+            'error': 'Failed to analyze assessment',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@async_api_view(['POST'])
+async def generate_clinical_report_async(request):
+    """
+    Async generate-report; a report that misses the request deadline is
+    replaced by the rule-based one and not stored, so a retry can still
+    get the generated report
+    """
+    deadline = _generation_deadline()
+    try:
+        data = request.data
+        processed_initial = _process_answers(data.get('initial_answers', {}))
+        follow_up_responses = data.get('follow_up_responses', {})
+        
+        assessment = await sync_to_async(Assessment.for_external_id)(data.get('assessment_id'), request.user)
+        assessment_id = assessment.external_id
+        
+        deadline_exceeded = False
+        stored = await sync_to_async(_stored_report)(assessment)
+        if stored is not None:
+            logger.info(f"Returning stored report for assessment {assessment_id}")
+            report = stored.content
+        else:
+            logger.info(f"Generating report for assessment {assessment_id}")
+            if processed_initial:
+                await sync_to_async(assessment.record_answers)(processed_initial)
+            initial_answers = processed_initial or await sync_to_async(assessment.initial_answers)()
+            state = await sync_to_async(report_state)(assessment)
+            try:
+                report = await get_executor().run(
+                    rag_engine.generate_comprehensive_report, initial_answers, follow_up_responses,
+                    deadline=deadline, timeout=_request_deadline(), **state
+                )
+                report = await sync_to_async(_store_report)(assessment, report, follow_up_responses)
+            except asyncio.TimeoutError:
+                logger.warning(f"Report for assessment {assessment_id} missed its deadline")
+                report = rag_engine.fallback_report(initial_answers, follow_up_responses)
+                deadline_exceeded = True
+        
+        return JsonResponse({
+            'assessment_id': assessment_id,
+            'report': report,
+            'status': 'success',
+            'assessment_complete': True,
+            'deadline_exceeded': deadline_exceeded,
+        }, status=status.HTTP_200_OK)
+        
+    except PermissionDenied as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_403_FORBIDDEN)
+    except ValidationError as e:
+        return JsonResponse(_invalid_answers(e), status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.error(f"Error in generate_clinical_report_async: {str(e)}")
+        return JsonResponse({
+            'error': 'Failed to generate clinical report',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@async_api_view(['GET'])
+async def system_status_async(request):
+    """
+    Async system-status; answered off the inference executor so it never
+    queues behind generation
+    """
+    status_info = await sync_to_async(rag_engine.status, thread_sensitive=False)()
+    status_info.update({
+        'system': 'Meditron-RAG Mental Health Assessment',
+        'version': '1.0',
+        'inference_executor': get_executor().stats(),
+    })
     
-    return Response(status_info, status=status.HTTP_200_OK)
\ No newline at end of file
+    return JsonResponse(status_info, status=status.HTTP_200_OK)
@@ -0,0 +1,86 @@
+"""
+Per-assessment RAG state shared between analyze-initial and generate-report.
+
+analyze-initial stores the analysis, the clinical documents retrieved for its
+prompt and the follow-up questions under the assessment's id. The report
+step reuses the analysis and documents instead of recomputing and
+retrieving them, and a repeated analyze-initial returns the same questions.
+An entry is only used while the assessment's scores still match the ones it
+was computed from. The cache alias should be shared between processes (the
+default is file-based) so report workers see it too.
+"""
+import logging
+from typing import Dict, Any, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_CONFIG = {
+    'CACHE_ALIAS': 'rag_sessions',
+    'TTL_SECONDS': 3600,
+}
+
+
+def session_config() -> Dict[str, Any]:
+    return {**DEFAULT_SESSION_CONFIG, **(settings.RAG_ENGINE.get('SESSION_CACHE') or {})}
+
+
+def _cache():
+    return caches[session_config()['CACHE_ALIAS']]
+
+
+def _key(assessment) -> str:
+    return f"rag-session:{assessment.external_id}"
+
+
+def save_session(assessment, scores: Dict[str, int], analysis: Dict[str, Any],
+                 follow_up: Dict[str, Any]):
+    """Remember analyze-initial's work; `follow_up` is generate_follow_up's result"""
+    entry = {
+        'scores': scores,
+        'analysis': analysis,
+        'context_documents': follow_up.get('context_documents'),
+        'follow_up_questions': follow_up['questions'],
+        'generated_by': follow_up['generated_by'],
+    }
+    try:
+        _cache().set(_key(assessment), entry, session_config()['TTL_SECONDS'])
+    except Exception as e:
+        logger.warning(f"Could not cache session for assessment {assessment.external_id}: {e}")
+
+
+def load_session(assessment, scores: Dict[str, int]) -> Optional[Dict[str, Any]]:
+    """The stored entry if it was computed from these scores"""
+    try:
+        entry = _cache().get(_key(assessment))
+    except Exception as e:
+        logger.warning(f"Could not read session for assessment {assessment.external_id}: {e}")
+        return None
+    if entry is None or entry['scores'] != scores:
+        return None
+    return entry
+
+
+def cached_follow_up(assessment, scores: Dict[str, int]) -> Optional[Dict[str, Any]]:
+    """Questions from an earlier analyze-initial, unless they were a fallback or cut short"""
+    entry = load_session(assessment, scores)
+    if entry is None or entry['generated_by'] in ('rules', 'partial'):
+        return None
+    return {'questions': entry['follow_up_questions'], 'generated_by': entry['generated_by']}
+
+
+def report_state(assessment) -> Dict[str, Any]:
+    """generate_comprehensive_report kwargs reusing the follow-up step's work"""
+    entry = load_session(assessment, assessment.scores())
+    if entry is None:
+        return {}
+    return {'analysis': entry['analysis'], 'context_documents': entry['context_documents']}
+
+
+def clear_session(assessment):
+    try:
+        _cache().delete(_key(assessment))
+    except Exception as e:
+        logger.warning(f"Could not clear session for assessment {assessment.external_id}: {e}")
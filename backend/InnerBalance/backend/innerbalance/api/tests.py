@@ -1,3 +1,1451 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import importlib
+import importlib.util
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import types
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+import numpy as np
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
 
 # Create your tests here.
+
+from api.jobs import ReportWorker, generate_job_report
+from api import rag_views
+from api.session_cache import cached_follow_up, save_session
+from api.models import ReportJob
+from questionnaires.models import Assessment, AssessmentReport, Question
+from rag.admission import AdmissionController
+from rag.clinical_rules import REPORT_FIELDS
+from rag.context_packer import ContextPacker, split_sentences
+from rag.context_table import ContextTable, vector_store_version
+from rag.engine import RAGEngine
+from rag.executor import InferenceExecutor, cancel_event
+from rag.model_server import ModelServer, ModelServerError, RemoteRAGSystem
+from rag.question_cache import QuestionCache, analysis_fingerprint
+from rag.routing import SeverityRouter, severity_tier
+from rag.scheduler import InferenceScheduler
+from rag.streaming import QuestionStreamParser
+
+# The decoding helpers need torch and transformers; their tests are skipped without them
+HAS_TORCH = all(importlib.util.find_spec(name) for name in ('torch', 'transformers'))
+if HAS_TORCH:
+    import torch
+    from transformers import LogitsProcessor, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+    from rag.batching import BatchingPipeline, RowLogitsProcessor, RowStoppingCriteria, _Row
+    from rag.deadlines import GenerationCancelled, GenerationDeadline, with_deadline
+    from rag.structured import JsonPrefixValidator, repair_json
+
+    from rag.prefix_cache import PrefixKVCache, static_prefix
+
+
+def tiny_causal_lm(seed=0):
+    """A random-weight GPT-2 with a character tokenizer, built without downloads"""
+    import string
+    from tokenizers import Tokenizer, decoders, models
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+    vocab = {'<eos>': 0}
+    for char in string.printable:
+        vocab.setdefault(char, len(vocab))
+    backend = Tokenizer(models.BPE(vocab=vocab, merges=[], unk_token=None))
+    backend.decoder = decoders.Fuse()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, eos_token='<eos>', pad_token='<eos>')
+    torch.manual_seed(seed)
+    model = GPT2LMHeadModel(GPT2Config(vocab_size=len(vocab), n_positions=512, n_embd=32, n_layer=2, n_head=2,
+                                       eos_token_id=0, bos_token_id=0, pad_token_id=0)).eval()
+    return model, tokenizer
+
+
+# Ingestion and the vector stores need langchain; the generation engine needs both stacks
+HAS_LANGCHAIN = all(importlib.util.find_spec(name) for name in ('langchain', 'langchain_community'))
+if HAS_LANGCHAIN:
+    from rag.ingestion import KnowledgeBaseIngestor, read_manifest
+    from rag.numpy_store import NumpyVectorStore
+HAS_RAG = HAS_TORCH and HAS_LANGCHAIN
+if HAS_RAG:
+    from rag.deadlines import DeadlineStats
+    from rag.meditron_rag import MeditronRAGSystem
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not reached")
+        time.sleep(0.005)
+
+
+@skipUnless(HAS_TORCH, "needs torch and transformers")
+class JsonPrefixValidatorTests(SimpleTestCase):
+    def questions(self):
+        return JsonPrefixValidator('array', item_type='string', min_items=2, max_items=3)
+
+    def report(self):
+        return JsonPrefixValidator('object', required_keys=REPORT_FIELDS)
+
+    def test_question_array(self):
+        self.assertTrue(self.questions().accepts('[ "How are you \\"really\\"?", "Why'))
+        self.assertFalse(self.questions().accepts('{'))
+        self.assertFalse(self.questions().accepts('["a", 1'))
+        # Too few items to close, too many to continue
+        self.assertFalse(self.questions().accepts('["a"]'))
+        self.assertFalse(self.questions().accepts('["a", "b", "c", "d"'))
+
+        validator = self.questions()
+        self.assertTrue(validator.commit('["a", "b", "c"'))
+        self.assertTrue(validator.finished)
+        self.assertFalse(validator.done)
+        self.assertTrue(validator.commit(']'))
+        self.assertTrue(validator.done)
+        self.assertFalse(validator.accepts(' x'))
+
+    def test_accepts_does_not_consume(self):
+        validator = self.questions()
+        validator.commit('["a"')
+        self.assertTrue(validator.accepts(', "b"]'))
+        self.assertFalse(validator.accepts(']'))
+        self.assertTrue(validator.commit(', "b"]'))
+
+    def test_report_keys(self):
+        report = {key: ["item"] for key in REPORT_FIELDS}
+        report['symptom_severity'] = {"depression": "moderate", "nested": {"any": [1, 2.5e3, True, None]}}
+        validator = self.report()
+        self.assertTrue(validator.commit(json.dumps(report)))
+        self.assertTrue(validator.done)
+
+        self.assertTrue(self.report().accepts('{"risk_le'))
+        self.assertFalse(self.report().accepts('{"primary_concerns"'))
+        self.assertFalse(self.report().accepts('{"risk_levels"'))
+        self.assertFalse(self.report().accepts('{"risk_level": "low", "risk_level"'))
+        self.assertFalse(self.report().accepts('{"risk_level": "low"}'))
+        self.assertFalse(self.report().accepts('{}'))
+
+        complete = self.report()
+        complete.commit(json.dumps(report)[:-1])
+        self.assertFalse(complete.accepts(', "extra"'))
+        self.assertTrue(complete.accepts('}'))
+
+    def test_repair(self):
+        self.assertEqual(json.loads(repair_json('Sure: ["a", "b", "c', root='array')), ["a", "b"])
+        self.assertEqual(json.loads(repair_json('{"risk_level": "high", "recommendations": ["x", "y',
+                                                root='object')), {"risk_level": "high", "recommendations": ["x"]})
+        self.assertIsNone(repair_json('no json here'))
+
+
+class InferenceSchedulerTests(SimpleTestCase):
+    def admission_order(self, scheduler, priorities, held, pause=0.0):
+        """Queue `priorities` in order behind `held`, then release it"""
+        order = []
+        threads = []
+        for count, priority in enumerate(priorities, 1):
+            def run(priority=priority):
+                with scheduler.slot(priority):
+                    order.append(priority)
+            thread = threading.Thread(target=run)
+            thread.start()
+            threads.append(thread)
+            wait_for(lambda: scheduler.waiting() == count)
+            time.sleep(pause)
+        scheduler.release(held)
+        for thread in threads:
+            thread.join(2.0)
+        return order
+
+    def test_priority_order(self):
+        scheduler = InferenceScheduler(slots=1, reserved_crisis_slots=0, aging_seconds=60.0)
+        held = scheduler.acquire('routine')
+        order = self.admission_order(scheduler, ['routine', 'moderate', 'high', 'crisis'], held)
+        self.assertEqual(order, ['crisis', 'high', 'moderate', 'routine'])
+
+    def test_aging(self):
+        scheduler = InferenceScheduler(slots=1, reserved_crisis_slots=0, aging_seconds=0.05)
+        held = scheduler.acquire('routine')
+        # The routine call has aged past crisis by the time the crisis call arrives
+        order = self.admission_order(scheduler, ['routine', 'crisis'], held, pause=0.3)
+        self.assertEqual(order, ['routine', 'crisis'])
+
+    def test_reserved_crisis_slot(self):
+        scheduler = InferenceScheduler(slots=1, reserved_crisis_slots=1)
+        held = scheduler.acquire('routine')
+        self.assertIs(held, False)
+        self.assertIsNone(scheduler.acquire('high', timeout=0.05))
+        crisis = scheduler.acquire('crisis', timeout=0.05)
+        self.assertIs(crisis, True)
+        # Both kinds of slot are taken now
+        self.assertIsNone(scheduler.acquire('crisis', timeout=0.05))
+        scheduler.release(held)
+        self.assertIs(scheduler.acquire('crisis', timeout=0.05), False)
+        stats = scheduler.stats()
+        self.assertEqual((stats['running'], stats['running_reserved']), (1, 1))
+        self.assertEqual(stats['queue_wait']['high']['timed_out'], 1)
+        self.assertEqual(stats['queue_wait']['crisis']['admitted'], 2)
+
+    def test_slot_timeout(self):
+        scheduler = InferenceScheduler(slots=1, reserved_crisis_slots=0)
+        with scheduler.slot('routine') as held:
+            self.assertTrue(held)
+            with scheduler.slot('routine', timeout=0.02) as second:
+                self.assertFalse(second)
+        self.assertEqual(scheduler.stats()['running'], 0)
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.waiting = 0
+        scheduler = types.SimpleNamespace(slots=1, waiting=lambda: self.waiting)
+        self.controller = AdmissionController(scheduler, slo_seconds=1.0, recover_ratio=0.5,
+                                              hold_seconds=10.0, window_seconds=30.0, min_samples=3)
+        clock = types.SimpleNamespace(monotonic=lambda: self.now)
+        patcher = mock.patch('rag.admission.time', clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def record(self, seconds, count=3):
+        for _ in range(count):
+            self.controller.record(seconds)
+
+    def test_idle_model_is_not_shed(self):
+        self.record(5.0)
+        self.assertTrue(self.controller.admit('routine'))
+        self.assertFalse(self.controller.degraded)
+
+    def test_hysteresis(self):
+        self.record(2.0)
+        self.waiting = 1
+        # Predicted 2s * (1 + 1 waiting) breaches the 1s SLO
+        self.assertFalse(self.controller.admit('routine'))
+        self.assertTrue(self.controller.admit('crisis'))
+        self.assertTrue(self.controller.degraded)
+
+        # The queue drained, but the hold time has not passed
+        self.now, self.waiting = 5.0, 0
+        self.assertFalse(self.controller.admit('routine'))
+
+        # Back under the SLO (0.8s) but not under the recovery threshold (0.5s)
+        self.now, self.waiting = 40.0, 1
+        self.record(0.4)
+        self.assertFalse(self.controller.admit('routine'))
+
+        self.now = 80.0
+        self.record(0.2)
+        self.assertTrue(self.controller.admit('routine'))
+        self.assertFalse(self.controller.degraded)
+
+        # Between the thresholds again, now from the admitting side
+        self.now = 120.0
+        self.record(0.4)
+        self.assertTrue(self.controller.admit('routine'))
+        self.assertEqual(self.controller.transitions, 2)
+        self.assertEqual(self.controller.stats()['shed']['routine'], 3)
+
+
+if HAS_TORCH:
+    class AddBias(LogitsProcessor):
+        def __init__(self, bias):
+            self.bias = bias
+
+        def __call__(self, input_ids, scores):
+            return scores + self.bias
+
+    class StopAt(StoppingCriteria):
+        def __init__(self, length):
+            self.length = length
+
+        def __call__(self, input_ids, scores, **kwargs):
+            return input_ids.shape[1] >= self.length
+
+
+class RecordingPipeline:
+    """Stand-in text-generation pipeline that records each call"""
+
+    def __init__(self):
+        self.calls = []
+        self.tokenizer = types.SimpleNamespace(eos_token_id=0)
+
+    def __call__(self, text_inputs, **kwargs):
+        self.calls.append((text_inputs, kwargs))
+        if isinstance(text_inputs, str):
+            return [{'generated_text': text_inputs.upper()}]
+        return [[{'generated_text': prompt.upper()}] for prompt in text_inputs]
+
+
+@skipUnless(HAS_TORCH, "needs torch and transformers")
+class BatchingPipelineTests(SimpleTestCase):
+    def concurrent(self, batcher, calls):
+        """Run (prompt, kwargs) calls at once; returns each call's output"""
+        results = [None] * len(calls)
+        barrier = threading.Barrier(len(calls))
+
+        def run(index, prompt, kwargs):
+            barrier.wait()
+            results[index] = batcher(prompt, **kwargs)
+
+        threads = [threading.Thread(target=run, args=(i, prompt, kwargs)) for i, (prompt, kwargs) in enumerate(calls)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5.0)
+        return results
+
+    def test_merges_concurrent_prompts(self):
+        pipe = RecordingPipeline()
+        batcher = BatchingPipeline(pipe, window_ms=500, max_batch_size=4)
+        prompts = ['a', 'b', 'c', 'd']
+        results = self.concurrent(batcher, [(prompt, {'max_new_tokens': 8}) for prompt in prompts])
+
+        self.assertEqual(results, [[{'generated_text': prompt.upper()}] for prompt in prompts])
+        self.assertEqual(len(pipe.calls), 1)
+        batch, kwargs = pipe.calls[0]
+        self.assertEqual(sorted(batch), prompts)
+        self.assertEqual(kwargs, {'max_new_tokens': 8, 'batch_size': 4})
+        self.assertEqual(batcher.stats()['mean_batch_size'], 4.0)
+
+    def test_groups_by_generation_kwargs(self):
+        pipe = RecordingPipeline()
+        batcher = BatchingPipeline(pipe, window_ms=300, max_batch_size=4)
+        self.concurrent(batcher, [('a', {'max_new_tokens': 8}), ('b', {'max_new_tokens': 16})])
+        self.assertEqual(sorted(kwargs['max_new_tokens'] for _, kwargs in pipe.calls), [8, 16])
+        self.assertTrue(all(len(batch) == 1 for batch, _ in pipe.calls))
+
+    def test_unbatchable_calls_run_directly(self):
+        pipe = RecordingPipeline()
+        batcher = BatchingPipeline(pipe, window_ms=300)
+        streamer = object()
+        self.assertEqual(batcher('a', streamer=streamer), [{'generated_text': 'A'}])
+        self.assertEqual(pipe.calls, [('a', {'streamer': streamer})])
+        self.assertEqual(batcher.stats()['batches_run'], 0)
+
+    def test_merges_per_request_constraints(self):
+        pipe = RecordingPipeline()
+        batcher = BatchingPipeline(pipe, window_ms=500, max_batch_size=2)
+        calls = [
+            (prompt, {'logits_processor': LogitsProcessorList([AddBias(bias)]),
+                      'stopping_criteria': StoppingCriteriaList([StopAt(3)])})
+            for prompt, bias in (('a', 1.0), ('b', 2.0))
+        ]
+        self.concurrent(batcher, calls)
+        self.assertEqual(len(pipe.calls), 1)
+        _, kwargs = pipe.calls[0]
+        self.assertIsInstance(kwargs['logits_processor'][0], RowLogitsProcessor)
+        self.assertIsInstance(kwargs['stopping_criteria'][0], RowStoppingCriteria)
+
+    def test_rows_keep_their_own_constraints(self):
+        rows = [
+            _Row({'logits_processor': LogitsProcessorList([AddBias(1.0)]),
+                  'stopping_criteria': StoppingCriteriaList([StopAt(2)])}),
+            _Row({'logits_processor': LogitsProcessorList([AddBias(2.0)]),
+                  'stopping_criteria': StoppingCriteriaList([StopAt(3)])}),
+        ]
+        processor = RowLogitsProcessor(rows, eos_token_id=0)
+        criteria = RowStoppingCriteria(rows)
+        scores = torch.zeros(2, 4)
+
+        input_ids = torch.ones(2, 2, dtype=torch.long)
+        self.assertEqual(processor(input_ids, scores).tolist(), [[1.0] * 4, [2.0] * 4])
+        # Only the first row has reached its stopping length
+        self.assertFalse(criteria(input_ids, scores))
+        forced = processor(input_ids, scores)
+        self.assertEqual(forced[0, 0].item(), 0.0)
+        self.assertTrue(torch.isinf(forced[0, 1:]).all())
+        self.assertEqual(forced[1].tolist(), [2.0] * 4)
+
+        self.assertTrue(criteria(torch.ones(2, 3, dtype=torch.long), scores))
+
+
+class InferenceExecutorTests(SimpleTestCase):
+    def blocking_call(self):
+        """A call that runs until its cancel event is set; returns (fn, started, stopped)"""
+        started, stopped = threading.Event(), threading.Event()
+
+        def generate():
+            started.set()
+            if cancel_event().wait(2.0):
+                stopped.set()
+
+        return generate, started, stopped
+
+    def test_cancelling_the_caller_stops_a_running_call(self):
+        executor = InferenceExecutor(max_workers=1)
+        generate, started, stopped = self.blocking_call()
+
+        async def request():
+            task = asyncio.ensure_future(executor.run(generate))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 2.0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(request())
+        self.assertTrue(stopped.wait(2.0))
+        wait_for(lambda: executor.stats()['running'] == 0)
+        self.assertEqual(executor.stats()['cancelled'], 1)
+        self.assertEqual(executor.stats()['dropped'], 0)
+        self.assertIsNone(cancel_event())
+
+    def test_timeout_stops_running_and_drops_queued_calls(self):
+        executor = InferenceExecutor(max_workers=1)
+        generate, started, stopped = self.blocking_call()
+        queued = mock.Mock()
+
+        async def requests():
+            running = asyncio.ensure_future(executor.run(generate, timeout=0.2))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 2.0)
+            with self.assertRaises(asyncio.TimeoutError):
+                await executor.run(queued, timeout=0.05)
+            with self.assertRaises(asyncio.TimeoutError):
+                await running
+
+        asyncio.run(requests())
+        self.assertTrue(stopped.wait(2.0))
+        queued.assert_not_called()
+        self.assertEqual(executor.stats()['timed_out'], 2)
+        self.assertEqual(executor.stats()['dropped'], 1)
+
+    def test_client_disconnect_stops_generation(self):
+        with mock.patch('rag.engine.warm_on_server_start'):
+            from innerbalance.asgi import CancelOnDisconnect
+        executor = InferenceExecutor(max_workers=1)
+        generate, started, stopped = self.blocking_call()
+
+        async def view(scope, receive, send):
+            await receive()
+            await executor.run(generate)
+
+        async def request():
+            messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+            async def receive():
+                if messages:
+                    return messages.pop(0)
+                await asyncio.get_running_loop().run_in_executor(None, started.wait, 2.0)
+                return {'type': 'http.disconnect'}
+
+            await CancelOnDisconnect(view)({'type': 'http'}, receive, mock.AsyncMock())
+
+        asyncio.run(request())
+        self.assertTrue(stopped.wait(2.0))
+        self.assertEqual(executor.stats()['cancelled'], 1)
+
+    @skipUnless(HAS_TORCH, "needs torch and transformers")
+    def test_generation_sees_the_cancel_event(self):
+        executor = InferenceExecutor(max_workers=1)
+        deadline = GenerationDeadline(time.time() + 60)
+
+        async def run():
+            return await executor.run(with_deadline, {'max_new_tokens': 8}, deadline)
+
+        criteria = asyncio.run(run())['stopping_criteria']
+        self.assertIs(criteria[0], deadline)
+        self.assertIsInstance(criteria[1], GenerationCancelled)
+        input_ids, scores = torch.ones(1, 2, dtype=torch.long), torch.zeros(1, 4)
+        self.assertFalse(criteria(input_ids, scores))
+        criteria[1].event.set()
+        self.assertTrue(criteria(input_ids, scores))
+        self.assertFalse(deadline.hit)
+        # Outside an executor call only the deadline applies, and without one nothing does
+        self.assertEqual(with_deadline({}, GenerationDeadline(None)), {})
+
+
+class FakeEngine:
+    def __init__(self, generated_by):
+        self.generated_by = generated_by
+        self.calls = 0
+
+    def generate_comprehensive_report(self, initial_answers, follow_up_responses, **kwargs):
+        self.calls += 1
+        report = {key: ["item"] for key in REPORT_FIELDS}
+        report.update(risk_level='moderate', generated_by=self.generated_by)
+        return report
+
+
+class ReportJobTests(TestCase):
+    def enqueue(self, external_id, priority='routine', **kwargs):
+        assessment = Assessment.objects.create(external_id=external_id)
+        job, _ = ReportJob.enqueue(assessment, {'initial_answers': {'0': 2}}, priority=priority, **kwargs)
+        return job
+
+    def test_enqueue_reuses_active_job(self):
+        job = self.enqueue('a1')
+        again, created = ReportJob.enqueue(job.assessment, {})
+        self.assertFalse(created)
+        self.assertEqual(again.pk, job.pk)
+
+    def test_one_active_job_per_assessment(self):
+        job = self.enqueue('a1')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ReportJob.objects.create(assessment=job.assessment, status=ReportJob.SUCCEEDED)
+        # A failed job does not block a new one
+        ReportJob.objects.filter(pk=job.pk).update(status=ReportJob.FAILED)
+        again, created = ReportJob.enqueue(job.assessment, {})
+        self.assertTrue(created)
+        self.assertNotEqual(again.pk, job.pk)
+
+    def test_enqueue_losing_a_race_gets_the_winner(self):
+        job = self.enqueue('a1')
+        # As if the other enqueue committed between the lookup and the insert
+        with mock.patch.object(ReportJob, '_active', side_effect=[None, job]):
+            again, created = ReportJob.enqueue(job.assessment, {})
+        self.assertFalse(created)
+        self.assertEqual(again.pk, job.pk)
+        self.assertEqual(ReportJob.objects.count(), 1)
+
+    def test_claims_by_priority_then_starvation(self):
+        routine = self.enqueue('a1')
+        crisis = self.enqueue('a2', priority='crisis')
+        self.assertEqual(ReportJob.claim('w1', 60).pk, crisis.pk)
+        self.assertEqual(ReportJob.claim('w1', 60).pk, routine.pk)
+        self.assertIsNone(ReportJob.claim('w1', 60))
+
+        old = self.enqueue('a3')
+        ReportJob.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        self.enqueue('a4', priority='crisis')
+        self.assertEqual(ReportJob.claim('w1', 60, starvation_seconds=300).pk, old.pk)
+
+    def test_claim_is_exclusive(self):
+        job = self.enqueue('a1')
+        claimed = ReportJob.claim('w1', 60)
+        self.assertEqual((claimed.status, claimed.worker, claimed.attempts), (ReportJob.RUNNING, 'w1', 1))
+        self.assertIsNone(ReportJob.claim('w2', 60))
+        self.assertTrue(claimed.extend_lease(60))
+        self.assertEqual(job.pk, claimed.pk)
+
+    def test_expired_lease_is_reclaimed(self):
+        self.enqueue('a1')
+        first = ReportJob.claim('w1', 60)
+        ReportJob.objects.filter(pk=first.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        second = ReportJob.claim('w2', 60)
+        self.assertEqual((second.pk, second.worker, second.attempts), (first.pk, 'w2', 2))
+        # The first worker's lease is gone
+        self.assertFalse(first.succeed({'risk_level': 'low'}))
+        self.assertFalse(first.extend_lease(60))
+        self.assertTrue(second.succeed({'risk_level': 'low'}))
+
+    def test_retry_backoff_then_fail(self):
+        self.enqueue('a1', max_attempts=2)
+        job = ReportJob.claim('w1', 60)
+        self.assertTrue(job.retry_or_fail('boom', backoff_seconds=30))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.QUEUED)
+        self.assertGreater(job.available_at, timezone.now() + timedelta(seconds=20))
+        self.assertIsNone(ReportJob.claim('w1', 60))
+
+        ReportJob.objects.filter(pk=job.pk).update(available_at=timezone.now())
+        job = ReportJob.claim('w1', 60)
+        self.assertEqual(job.attempts, 2)
+        self.assertTrue(job.retry_or_fail('boom again', backoff_seconds=30))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (ReportJob.FAILED, 'boom again'))
+
+    def test_expired_final_attempt_fails(self):
+        self.enqueue('a1', max_attempts=1)
+        job = ReportJob.claim('w1', 60)
+        ReportJob.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(ReportJob.claim('w2', 60))
+        self.assertEqual(ReportJob.fail_exhausted(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.FAILED)
+
+    def test_rule_based_report_is_retried_not_stored(self):
+        self.enqueue('a1')
+        worker = ReportWorker('w1', config={'VISIBILITY_TIMEOUT': 60, 'RETRY_BACKOFF_SECONDS': 0})
+        job = ReportJob.claim('w1', 60)
+        with self.assertLogs('api.jobs', level='ERROR'):
+            worker.process(job, FakeEngine('rules'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.QUEUED)
+        self.assertFalse(AssessmentReport.objects.exists())
+
+        job = ReportJob.claim('w1', 60)
+        engine = FakeEngine('llm')
+        worker.process(job, engine)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.SUCCEEDED)
+        self.assertEqual(job.result['generated_by'], 'llm')
+        # A later attempt reuses the stored report
+        self.assertEqual(generate_job_report(job, engine)['generated_by'], 'llm')
+        self.assertEqual(engine.calls, 1)
+
+
+class ColdEngine(RAGEngine):
+    """Engine that never loads the models, so every answer is rule-based"""
+
+    def start_warmup(self):
+        return False
+
+
+# Keep the session cache out of the source tree
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'rag_sessions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'rag-sessions'},
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AnalyzeInitialViewTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(rag_views, 'rag_engine', ColdEngine())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_frontend_payload(self):
+        # my-app keys answers by question id (1-10 on a fresh database) and
+        # sends choice answers as text
+        answers = {str(question_id): 1 for question_id in range(1, 11)}
+        answers['10'] = 2
+        answers['11'] = 'Sometimes'
+        response = self.client.post('/api/analyze-initial/', {'assessment_id': 'web-1', 'answers': answers},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['assessment_id'], 'web-1')
+        self.assertEqual(len(response.json()['follow_up_questions']), 5)
+        self.assertEqual(Assessment.objects.get(external_id='web-1').overall_score, 9)
+
+    def test_out_of_range_score(self):
+        response = self.client.post('/api/analyze-initial/', {'assessment_id': 'web-2', 'answers': {'1': 7}},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Invalid answers')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SubmitAnswerViewTests(TestCase):
+    def setUp(self):
+        self.question = Question.objects.create(text="Item 9", question_type='scale', category='mood', order=9)
+
+    def post(self, **data):
+        return self.client.post('/api/assessments/answer/', {'assessment_id': 'a1', **data},
+                                content_type='application/json')
+
+    def test_invalid_fields(self):
+        for data in ({'question_order': 'abc', 'score': 1}, {'question_order': 9.5, 'score': 1},
+                     {'question_order': 0, 'score': 1}, {'question_id': [1], 'score': 1},
+                     {'question_order': 9, 'score': '2.5'}, {'question_order': 9, 'score': 4},
+                     {'question_order': 9, 'score': True}, {'question_order': 9}):
+            self.assertEqual(self.post(**data).status_code, 400, data)
+        self.assertEqual(self.post(question_order=3, score=1).status_code, 404)
+        self.assertFalse(Assessment.objects.exists())
+
+    def test_crisis_answer(self):
+        response = self.post(question_order='9', score='2')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(response.json()['crisis'])
+        self.assertEqual(response.json()['status'], 'crisis')
+
+
+def bare_system(**attributes):
+    """A MeditronRAGSystem without models or a vector store, for its prompt and parsing helpers"""
+    system = MeditronRAGSystem.__new__(MeditronRAGSystem)
+    system.deadline_stats = DeadlineStats()
+    system.__dict__.update(attributes)
+    return system
+
+
+def expired_deadline():
+    deadline = GenerationDeadline(time.time() - 1)
+    deadline.hit = True
+    return deadline
+
+
+@skipUnless(HAS_RAG, "needs torch, transformers and langchain")
+class DeadlineSalvageTests(SimpleTestCase):
+    def test_deadline_stops_generation(self):
+        deadline = GenerationDeadline(time.time() + 0.1)
+        input_ids, scores = torch.ones(1, 2, dtype=torch.long), torch.zeros(1, 4)
+        self.assertFalse(deadline(input_ids, scores))
+        self.assertGreater(deadline.remaining(), 0)
+        time.sleep(0.15)
+        self.assertTrue(deadline(input_ids, scores))
+        self.assertTrue(deadline.hit)
+        self.assertEqual(deadline.remaining(), 0.0)
+        self.assertIsNone(GenerationDeadline(None).remaining())
+
+    def test_salvaged_questions_are_topped_up(self):
+        system = bare_system()
+        analysis = system.analyze_initial_answers({0: 2, 4: 2})
+        deadline = expired_deadline()
+        follow_up = system._salvage_questions('["How has your mood been?", "What helps when you', analysis, deadline)
+        self.assertEqual(follow_up['generated_by'], 'partial')
+        self.assertEqual(follow_up['questions'][0], "How has your mood been?")
+        self.assertEqual(len(follow_up['questions']), 5)
+
+        follow_up = system._salvage_questions('["What', analysis, deadline)
+        self.assertEqual(follow_up['generated_by'], 'rules')
+        self.assertEqual(system.deadline_stats.stats()['follow_up'],
+                         {'requests': 2, 'hits': 2, 'salvaged': 1, 'hit_rate': 1.0})
+
+    def test_salvaged_report_fields_override_the_basic_report(self):
+        system = bare_system()
+        answers = {0: 1}
+        report = system._salvage_report('{"risk_level": "moderate", "recommendations": ["Rest", "Wal',
+                                        answers, {}, expired_deadline())
+        basic = system._generate_basic_report(answers, {})
+        self.assertEqual(report['generated_by'], 'partial')
+        self.assertEqual(report['risk_level'], 'moderate')
+        self.assertEqual(report['recommendations'], ['Rest'])
+        self.assertEqual(report['clinical_insights'], basic['clinical_insights'])
+
+        self.assertEqual(system._salvage_report('{"recommendations": [', answers, {}, expired_deadline()),
+                         basic)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class UnfinishedResultTests(TestCase):
+    def setUp(self):
+        self.assessment = Assessment.objects.create(external_id='a1')
+
+    def test_partial_and_rule_reports_are_not_stored(self):
+        report = {**{key: ["item"] for key in REPORT_FIELDS}, 'risk_level': 'low'}
+        for generated_by in ('rules', 'partial'):
+            returned = rag_views._store_report(self.assessment, {**report, 'generated_by': generated_by}, {})
+            self.assertEqual(returned['generated_by'], generated_by)
+        self.assertFalse(AssessmentReport.objects.exists())
+
+        rag_views._store_report(self.assessment, {**report, 'generated_by': 'llm'}, {})
+        self.assertEqual(AssessmentReport.objects.get().content['generated_by'], 'llm')
+        self.assessment.refresh_from_db()
+        self.assertEqual(self.assessment.status, 'completed')
+
+    def test_partial_questions_are_not_reused(self):
+        scores = self.assessment.scores()
+        analysis = rag_views.rag_engine.analysis_from_scores(scores)
+        for generated_by, reused in (('partial', False), ('rules', False), ('llm', True)):
+            save_session(self.assessment, scores, analysis, {'questions': ['Q?'], 'generated_by': generated_by})
+            self.assertEqual(cached_follow_up(self.assessment, scores) is not None, reused, generated_by)
+
+
+@skipUnless(HAS_TORCH, "needs torch and transformers")
+class PrefixKVCacheTests(SimpleTestCase):
+    TEMPLATE = "Instructions that never change.\n\nPATIENT:\n{analysis}\n"
+
+    def setUp(self):
+        self.model, self.tokenizer = tiny_causal_lm()
+        self.cache = PrefixKVCache(self.model, self.tokenizer)
+
+    def greedy(self, input_ids, **kwargs):
+        with torch.no_grad():
+            output = self.model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                                         max_new_tokens=12, do_sample=False, pad_token_id=0, **kwargs)
+        return output[0, input_ids.shape[1]:].tolist()
+
+    def test_matches_uncached_generation(self):
+        prefix = static_prefix(self.TEMPLATE)
+        self.assertEqual(prefix, "Instructions that never change.\n\nPATIENT:\n")
+        for analysis in ("mild depression", "severe anxiety, poor sleep"):
+            prompt = self.TEMPLATE.format(analysis=analysis)
+            input_ids, past_key_values = self.cache.prepare('follow_up', prefix, prompt)
+            plain = self.tokenizer(prompt, return_tensors='pt').input_ids
+            self.assertEqual(input_ids.tolist(), plain.tolist())
+            self.assertEqual(self.greedy(input_ids, past_key_values=past_key_values), self.greedy(plain))
+        self.assertEqual(self.cache.stats()['hits'], 2)
+        self.assertEqual(self.cache.stats()['prefix_tokens_saved'], 2 * len(prefix))
+
+    def test_prompt_without_the_prefix_is_a_miss(self):
+        prefix = static_prefix(self.TEMPLATE)
+        self.assertIsNone(self.cache.prepare('follow_up', prefix, "Something else entirely"))
+        self.assertIsNone(self.cache.prepare('follow_up', prefix, prefix))
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def test_changed_prefix_is_recomputed(self):
+        self.cache.warm('report', "Old instructions\n")
+        self.cache.warm('report', "New instructions, longer\n")
+        self.assertEqual(self.cache.stats()['templates'], {'report': len("New instructions, longer\n")})
+
+
+@skipUnless(HAS_RAG, "needs torch, transformers and langchain")
+class PrefixCacheSetupTests(SimpleTestCase):
+    def system(self, pipe, **config):
+        model, tokenizer = tiny_causal_lm()
+        return bare_system(config={'PREFIX_CACHE': True, **config}, llm=object(), pipe=pipe, assisted=None,
+                           model=model, tokenizer=tokenizer)
+
+    def test_only_without_batching(self):
+        batched = self.system(BatchingPipeline(RecordingPipeline()))
+        batched.setup_prefix_cache()
+        self.assertIsNone(batched.prefix_cache)
+        self.assertTrue(batched._batches_generations())
+
+        single = self.system(RecordingPipeline())
+        single.setup_prefix_cache()
+        self.assertIsInstance(single.prefix_cache, PrefixKVCache)
+
+        disabled = self.system(RecordingPipeline(), PREFIX_CACHE=False)
+        disabled.setup_prefix_cache()
+        self.assertIsNone(disabled.prefix_cache)
+
+
+@skipUnless(HAS_RAG, "needs torch, transformers and langchain")
+class InferencePrecisionTests(SimpleTestCase):
+    def system(self, precision):
+        return bare_system(config={'INFERENCE_PRECISION': precision}, model_precisions={}, model_name='phi')
+
+    def test_small_models_keep_full_precision_on_cpu(self):
+        with mock.patch('torch.cuda.is_available', return_value=False):
+            for configured, large in (('auto', 'bf16'), ('bf16', 'bf16'), ('int8', 'int8'), ('fp32', 'fp32')):
+                system = self.system(configured)
+                self.assertEqual(system._resolve_precision(), large)
+                self.assertEqual(system._resolve_precision(reduced_precision=False), 'fp32')
+        with mock.patch('torch.cuda.is_available', return_value=True):
+            self.assertEqual(self.system('auto')._resolve_precision(reduced_precision=False), 'fp16')
+        with self.assertRaises(ValueError):
+            self.system('fp8')._resolve_precision()
+
+    def test_loaded_dtypes(self):
+        system = self.system('auto')
+
+        def from_pretrained(name, torch_dtype=None, **kwargs):
+            return tiny_causal_lm()[0].to(torch_dtype)
+
+        with mock.patch('torch.cuda.is_available', return_value=False), \
+                mock.patch('rag.meditron_rag.AutoModelForCausalLM.from_pretrained', side_effect=from_pretrained):
+            large = system._load_causal_lm('phi')
+            small = system._load_causal_lm('distilgpt2', reduced_precision=False)
+        self.assertEqual(large.dtype, torch.bfloat16)
+        self.assertEqual(small.dtype, torch.float32)
+        self.assertEqual(system.precision, 'bf16')
+        self.assertEqual(system.model_precisions, {'phi': 'bf16', 'distilgpt2': 'fp32'})
+
+
+class HashEmbeddings:
+    """Deterministic stand-in encoder: `dim` numbers derived from each text's hash"""
+
+    def __init__(self, dim=8):
+        self.dim = dim
+        self.encoded = 0
+
+    def vector(self, text):
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        return [byte / 255.0 + 0.01 for byte in digest[:self.dim]]
+
+    def embed_documents(self, texts):
+        self.encoded += len(texts)
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.vector(text)
+
+
+class KnowledgeBaseMixin:
+    """A two-file knowledge base and a NumPy vector store in a temporary directory"""
+
+    def setUp(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.root = temp.name
+        self.kb_path = os.path.join(self.root, 'kb')
+        self.index_path = os.path.join(self.root, 'index')
+        self.manifest_path = os.path.join(self.index_path, 'manifest.json')
+        self.write_kb_file('clinical_guidelines/sleep.txt', "Sleep hygiene guidance.")
+        self.write_kb_file('assessment_tools/phq9.txt', "PHQ-9 scoring bands.")
+
+    def write_kb_file(self, rel_path, text):
+        path = os.path.join(self.kb_path, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def ingestor(self, embeddings, encoder_spec=None, store=None):
+        store = store or NumpyVectorStore(self.index_path, embeddings)
+        return KnowledgeBaseIngestor(store, self.kb_path, self.manifest_path,
+                                     embeddings=embeddings, encoder_spec=encoder_spec)
+
+
+@skipUnless(HAS_LANGCHAIN, "needs langchain")
+class EncoderChangeTests(KnowledgeBaseMixin, SimpleTestCase):
+    MINILM = {'backend': 'sentence_transformers', 'model_path': 'all-MiniLM-L6-v2'}
+    MINILM_INT8 = {'backend': 'int8', 'model_path': 'all-MiniLM-L6-v2'}
+
+    def test_spec_is_recorded_and_unchanged_spec_is_incremental(self):
+        embeddings = HashEmbeddings()
+        self.assertEqual(self.ingestor(embeddings, self.MINILM).ingest()['chunks_added'], 2)
+        self.assertEqual(read_manifest(self.manifest_path)['encoder'], self.MINILM)
+
+        report = self.ingestor(embeddings, self.MINILM).ingest()
+        self.assertFalse(report['encoder_changed'])
+        self.assertEqual((report['chunks_added'], embeddings.encoded), (0, 2))
+
+    def test_new_encoder_reencodes_everything(self):
+        self.ingestor(HashEmbeddings(dim=8), self.MINILM).ingest()
+        # Another backend with another dimensionality
+        embeddings = HashEmbeddings(dim=4)
+        report = self.ingestor(embeddings, self.MINILM_INT8).ingest()
+        self.assertTrue(report['encoder_changed'])
+        self.assertEqual((report['chunks_added'], report['chunks_removed']), (2, 2))
+        self.assertEqual(read_manifest(self.manifest_path)['encoder'], self.MINILM_INT8)
+
+        store = NumpyVectorStore(self.index_path, embeddings)
+        self.assertEqual(store.count(), 2)
+        self.assertEqual(store.similarity_search("PHQ-9 scoring bands.", k=1)[0].metadata['type'], 'assessment_tool')
+
+    def test_unrecorded_encoder_is_reencoded_once(self):
+        self.ingestor(HashEmbeddings()).ingest()
+        self.assertNotIn('encoder', read_manifest(self.manifest_path))
+        embeddings = HashEmbeddings()
+        self.assertTrue(self.ingestor(embeddings, self.MINILM).ingest()['encoder_changed'])
+        self.assertFalse(self.ingestor(embeddings, self.MINILM).ingest()['encoder_changed'])
+        self.assertEqual(embeddings.encoded, 2)
+
+
+
+@skipUnless(HAS_LANGCHAIN, "needs langchain")
+class IngestionManifestTests(KnowledgeBaseMixin, SimpleTestCase):
+    def test_unchanged_files_are_not_reembedded(self):
+        embeddings = HashEmbeddings()
+        report = self.ingestor(embeddings).ingest()
+        self.assertEqual(sorted(report['added_files']), ['assessment_tools/phq9.txt', 'clinical_guidelines/sleep.txt'])
+        self.assertEqual(report['chunks_added'], 2)
+        self.assertEqual(len(read_manifest(self.manifest_path)['files']['clinical_guidelines/sleep.txt']['chunks']), 1)
+
+        report = self.ingestor(embeddings).ingest()
+        self.assertEqual(len(report['unchanged_files']), 2)
+        self.assertFalse(report['changed'])
+        self.assertEqual(embeddings.encoded, 2)
+
+    def test_added_changed_and_removed_files(self):
+        embeddings = HashEmbeddings()
+        self.ingestor(embeddings).ingest()
+        self.write_kb_file('clinical_guidelines/sleep.txt', "Revised sleep hygiene guidance.")
+        self.write_kb_file('clinical_guidelines/anxiety.txt', "Grounding exercises.")
+        os.remove(os.path.join(self.kb_path, 'assessment_tools/phq9.txt'))
+
+        report = self.ingestor(embeddings).ingest()
+        self.assertEqual(report['added_files'], ['clinical_guidelines/anxiety.txt'])
+        self.assertEqual(report['changed_files'], ['clinical_guidelines/sleep.txt'])
+        self.assertEqual(report['removed_files'], ['assessment_tools/phq9.txt'])
+        self.assertEqual((report['chunks_added'], report['chunks_removed']), (2, 2))
+        self.assertEqual(embeddings.encoded, 4)
+
+        store = NumpyVectorStore(self.index_path, embeddings)
+        self.assertEqual(store.count(), 2)
+        self.assertEqual(sorted(read_manifest(self.manifest_path)['files']),
+                         ['clinical_guidelines/anxiety.txt', 'clinical_guidelines/sleep.txt'])
+        contents = {doc.page_content for doc in store.similarity_search("anything", k=5)}
+        self.assertEqual(contents, {"Revised sleep hygiene guidance.", "Grounding exercises."})
+
+    def test_vectors_without_a_manifest_are_replaced(self):
+        embeddings = HashEmbeddings()
+        store = NumpyVectorStore(self.index_path, embeddings)
+        store.upsert_embeddings(['legacy-1'], [embeddings.vector("old")], ["old"], [{}])
+        store.persist()
+
+        report = self.ingestor(embeddings).ingest()
+        self.assertEqual((report['chunks_added'], report['chunks_removed']), (2, 1))
+        self.assertNotIn('legacy-1', NumpyVectorStore(self.index_path, embeddings).get()['ids'])
+
+    def test_rebuild_reencodes_everything(self):
+        embeddings = HashEmbeddings()
+        self.ingestor(embeddings).ingest()
+        report = self.ingestor(embeddings).ingest(rebuild=True)
+        self.assertEqual((report['chunks_added'], report['chunks_removed']), (2, 2))
+        self.assertEqual(NumpyVectorStore(self.index_path, embeddings).count(), 2)
+
+
+
+@skipUnless(HAS_LANGCHAIN, "needs langchain")
+class NumpyVectorStoreTests(SimpleTestCase):
+    def setUp(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.directory = temp.name
+        self.embeddings = HashEmbeddings()
+
+    def store(self):
+        return NumpyVectorStore(self.directory, self.embeddings)
+
+    def write(self, store, *texts):
+        store.upsert_embeddings(list(texts), self.embeddings.embed_documents(texts), list(texts),
+                                [{'source': text} for text in texts])
+        store.persist()
+
+    def generations(self):
+        return sorted(name for name in os.listdir(self.directory) if name.startswith('vectors-'))
+
+    def test_persist_swaps_the_pointer_and_prunes_old_generations(self):
+        store = self.store()
+        for text in ("sleep", "mood", "appetite"):
+            self.write(store, text)
+        # The live generation and the one before it, for readers of the old pointer
+        self.assertEqual(len(self.generations()), 2)
+        with open(os.path.join(self.directory, 'current.json'), encoding='utf-8') as f:
+            pointer = json.load(f)
+        self.assertEqual(pointer['rows'], 3)
+        self.assertIn(f"vectors-{pointer['generation']}.npy", self.generations())
+
+        reopened = self.store()
+        self.assertEqual(reopened.count(), 3)
+        self.assertEqual(reopened.similarity_search("mood", k=1)[0].page_content, "mood")
+
+    def test_readers_pick_up_a_new_generation(self):
+        writer = self.store()
+        self.write(writer, "sleep")
+        reader = self.store()
+        reader.RELOAD_INTERVAL = 0
+        self.write(writer, "mood")
+        self.assertEqual(reader.similarity_search("mood", k=1)[0].page_content, "mood")
+        self.assertEqual(reader.count(), 2)
+
+    def test_reader_keeps_its_pair_when_the_pointer_names_missing_files(self):
+        writer = self.store()
+        self.write(writer, "sleep", "mood")
+        reader = self.store()
+        with open(os.path.join(self.directory, 'current.json'), 'w', encoding='utf-8') as f:
+            json.dump({'generation': 'pruned', 'rows': 0}, f)
+        self.assertFalse(reader._load())
+        self.assertEqual(reader.count(), 2)
+        self.assertEqual(len(reader.similarity_search("sleep", k=5)), 2)
+
+    def test_mismatched_pair_is_not_loaded(self):
+        self.write(self.store(), "sleep", "mood")
+        generation = self.generations()[0][len('vectors-'):-len('.npy')]
+        with open(os.path.join(self.directory, f'metadata-{generation}.json'), 'w', encoding='utf-8') as f:
+            json.dump({'ids': ['sleep'], 'documents': ['sleep'], 'metadatas': [{}]}, f)
+        self.assertEqual(self.store().count(), 0)
+
+    def test_legacy_single_pair_layout_is_read(self):
+        np.save(os.path.join(self.directory, 'vectors.npy'),
+                np.asarray([self.embeddings.vector("sleep")], dtype=np.float32))
+        with open(os.path.join(self.directory, 'metadata.json'), 'w', encoding='utf-8') as f:
+            json.dump({'ids': ['legacy'], 'documents': ['sleep'], 'metadatas': [{'source': 'old'}]}, f)
+        store = self.store()
+        self.assertEqual(store.get()['ids'], ['legacy'])
+        self.assertEqual(store.similarity_search("sleep", k=1)[0].metadata, {'source': 'old'})
+
+    def test_upsert_and_delete(self):
+        store = self.store()
+        self.write(store, "sleep", "mood")
+        store.upsert_embeddings(['sleep'], [self.embeddings.vector("appetite")], ["appetite"], [{}])
+        store.delete(['mood'])
+        store.persist()
+        reopened = self.store()
+        self.assertEqual(reopened.get()['ids'], ['sleep'])
+        self.assertEqual(reopened.similarity_search("appetite", k=1)[0].page_content, "appetite")
+
+
+class ServedSystem:
+    """Stand-in MeditronRAGSystem behind the model server"""
+
+    def __init__(self):
+        self.reports = []
+
+    def describe(self):
+        return {'llm_loaded': True}
+
+    def generate_comprehensive_report(self, initial_answers, follow_up_responses, **kwargs):
+        self.reports.append((initial_answers, kwargs))
+        return {'risk_level': 'low', 'generated_by': 'llm'}
+
+    def generate_follow_up(self, analysis, **kwargs):
+        raise RuntimeError("model exploded")
+
+    def stream_follow_up_questions(self, analysis, **kwargs):
+        for question in ("First?", "Second?"):
+            yield {'event': 'question', 'data': question}
+        if analysis.get('fail'):
+            raise RuntimeError("stream broke")
+
+
+class ModelServerTests(SimpleTestCase):
+    def setUp(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.socket_path = os.path.join(temp.name, 'model.sock')
+        self.system = ServedSystem()
+        self.start_server()
+        self.client = RemoteRAGSystem(self.socket_path, timeout=5.0)
+        self.addCleanup(self.client._drop_connection)
+
+    def start_server(self):
+        self.server = ModelServer(self.socket_path, self.system)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.stop_server)
+
+    def stop_server(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def test_calls_round_trip(self):
+        self.client.warmup()
+        self.assertEqual(self.client.describe(), {'llm_loaded': True, 'model_server': self.socket_path})
+        report = self.client.generate_comprehensive_report({0: 2, 8: 1}, {'Q?': 'A'}, priority='crisis')
+        self.assertEqual(report['risk_level'], 'low')
+        answers, kwargs = self.system.reports[0]
+        # JSON object keys come back as item numbers
+        self.assertEqual(answers, {0: 2, 8: 1})
+        self.assertEqual(kwargs['priority'], 'crisis')
+
+    def test_errors_are_raised_in_the_client(self):
+        with self.assertRaisesRegex(ModelServerError, "model exploded"):
+            self.client.generate_follow_up({'depression_severity': 'mild'})
+        with self.assertRaisesRegex(ModelServerError, "Unknown method"):
+            self.client.call('load_more_models')
+        # The connection is still usable afterwards
+        self.assertEqual(self.client.call('ping'), 'pong')
+
+    def test_streams_events(self):
+        events = list(self.client.stream_follow_up_questions({}))
+        self.assertEqual([event['data'] for event in events], ["First?", "Second?"])
+
+        stream = self.client.stream_follow_up_questions({'fail': True})
+        self.assertEqual(next(stream)['data'], "First?")
+        self.assertEqual(next(stream)['data'], "Second?")
+        with self.assertRaisesRegex(ModelServerError, "stream broke"):
+            next(stream)
+        self.assertEqual(self.client.call('ping'), 'pong')
+
+    def test_reconnects_once_on_a_stale_connection(self):
+        # A pooled connection the server side has since closed (e.g. a restart)
+        stale, peer = socket.socketpair()
+        peer.close()
+        self.client._local.sock = stale
+        self.assertEqual(self.client.call('ping'), 'pong')
+
+    def test_unreachable_server(self):
+        self.stop_server()
+        with self.assertRaisesRegex(ModelServerError, "unavailable"):
+            RemoteRAGSystem(self.socket_path, timeout=1.0).call('ping')
+
+
+class QuestionStreamParserTests(SimpleTestCase):
+    def test_questions_complete_as_their_quote_closes(self):
+        parser = QuestionStreamParser()
+        chunks = ['Sure! ', '["How has your ', 'sleep changed lately?", "Wh', 'at does \\"a good day\\" look like?"', ']']
+        emitted = [parser.feed(chunk) for chunk in chunks]
+        self.assertEqual(emitted, [[], [], ["How has your sleep changed lately?"],
+                                   ['What does "a good day" look like?'], []])
+
+    def test_short_strings_and_text_before_the_array_are_skipped(self):
+        parser = QuestionStreamParser(min_length=5)
+        self.assertEqual(parser.feed('"Not a question yet" ["ok", "Long enough?"]'), ["Long enough?"])
+
+
+class StreamingSystem:
+    """Stand-in loaded system that streams like MeditronRAGSystem"""
+
+    def __init__(self):
+        self.streams = 0
+
+    def warmup(self):
+        pass
+
+    def describe(self):
+        return {'llm_loaded': True}
+
+    def stream_follow_up_questions(self, analysis, **kwargs):
+        self.streams += 1
+        questions = [f"Generated question number {n}?" for n in range(1, 6)]
+        yield {'event': 'token', 'data': '["'}
+        for question in questions:
+            yield {'event': 'question', 'data': question}
+        yield {'event': 'done', 'data': {'follow_up_questions': questions, 'generated_by': 'llm',
+                                         'context_documents': [{'content': 'guideline', 'source': 'kb'}]}}
+
+    def stream_comprehensive_report(self, initial_answers, follow_up_responses, **kwargs):
+        self.streams += 1
+        self.report_kwargs = kwargs
+        report = {**{key: ["item"] for key in REPORT_FIELDS}, 'risk_level': 'low', 'generated_by': 'llm'}
+        yield {'event': 'token', 'data': '{"risk_level"'}
+        yield {'event': 'done', 'data': {'report': report}}
+
+
+def sse_events(response):
+    """(event, data) pairs of a text/event-stream response"""
+    body = b''.join(response.streaming_content).decode('utf-8')
+    events = []
+    for block in filter(None, body.split('\n\n')):
+        event, data = block.split('\n')
+        events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StreamingViewTests(TestCase):
+    def setUp(self):
+        caches['rag_sessions'].clear()
+        self.system = StreamingSystem()
+        engine = RAGEngine(factory=lambda: self.system)
+        engine.wait_until_ready(5.0)
+        patcher = mock.patch.object(rag_views, 'rag_engine', engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, path, data):
+        response = self.client.post(path, data, content_type='application/json')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return sse_events(response)
+
+    def analyze(self):
+        return self.post('/api/analyze-initial/stream/', {'assessment_id': 's1', 'answers': {'1': 2, '2': 1}})
+
+    def test_follow_up_stream(self):
+        events = self.analyze()
+        self.assertEqual([name for name, _ in events], ['analysis', 'token'] + ['question'] * 5 + ['done'])
+        self.assertEqual(events[0][1]['assessment_id'], 's1')
+        done = events[-1][1]
+        self.assertEqual(done['generated_by'], 'llm')
+        # Retrieved documents stay server-side
+        self.assertNotIn('context_documents', done)
+
+        # A repeat request replays the session's questions without generating
+        replay = self.analyze()
+        self.assertEqual([name for name, _ in replay], ['analysis'] + ['question'] * 5 + ['done'])
+        self.assertEqual(replay[-1][1]['follow_up_questions'], done['follow_up_questions'])
+        self.assertEqual(self.system.streams, 1)
+
+    def test_report_stream_is_stored_once(self):
+        self.analyze()
+        data = {'assessment_id': 's1', 'follow_up_responses': {'Q?': 'A'}}
+        events = self.post('/api/generate-report/stream/', data)
+        self.assertEqual([name for name, _ in events], ['token', 'done'])
+        self.assertEqual(events[-1][1]['report']['generated_by'], 'llm')
+        # The follow-up step's documents are reused for the report
+        self.assertEqual(self.system.report_kwargs['context_documents'], [{'content': 'guideline', 'source': 'kb'}])
+        self.assertEqual(AssessmentReport.objects.count(), 1)
+
+        again = self.post('/api/generate-report/stream/', data)
+        self.assertEqual(again, [('done', {'report': events[-1][1]['report']})])
+        self.assertEqual(self.system.streams, 2)
+
+
+class QuestionCacheTests(SimpleTestCase):
+    ANALYSIS = {'depression_severity': 'moderate', 'anxiety_severity': 'mild', 'sleep_disturbance': 'minimal',
+                'suicide_risk': 'low', 'primary_concerns': ['depression'], 'follow_up_focus': ['mood_patterns']}
+
+    def test_fingerprint_covers_only_prompt_fields(self):
+        fingerprint = analysis_fingerprint(self.ANALYSIS, 'meditron|v1')
+        self.assertEqual(analysis_fingerprint({**self.ANALYSIS, 'scores': {'depression': 12}}, 'meditron|v1'),
+                         fingerprint)
+        self.assertNotEqual(analysis_fingerprint({**self.ANALYSIS, 'suicide_risk': 'moderate'}, 'meditron|v1'),
+                            fingerprint)
+        # Another model or prompt version never shares entries
+        self.assertNotEqual(analysis_fingerprint(self.ANALYSIS, 'phi|v1'), fingerprint)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = QuestionCache(max_entries=2)
+        cache.set('a', ["A?"])
+        cache.set('b', ["B?"])
+        cache.get('a')
+        cache.set('c', ["C?"])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (["A?"], ["C?"]))
+        self.assertEqual(cache.stats()['entries'], 2)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_entries_expire(self):
+        cache = QuestionCache(ttl_seconds=60)
+        with mock.patch('rag.question_cache.time.time', return_value=1000.0):
+            cache.set('a', ["A?"])
+        with mock.patch('rag.question_cache.time.time', return_value=1059.0):
+            self.assertEqual(cache.get('a'), ["A?"])
+        with mock.patch('rag.question_cache.time.time', return_value=1061.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_disk_tier_is_shared_and_survives_restarts(self):
+        with tempfile.TemporaryDirectory() as disk_path:
+            QuestionCache(disk_path=disk_path).set('a', ["A?"])
+            other = QuestionCache(disk_path=disk_path, ttl_seconds=60)
+            self.assertEqual(other.get('a'), ["A?"])
+            self.assertEqual(other.stats()['entries'], 1)
+            # Expired files are ignored like expired memory entries
+            with mock.patch('rag.question_cache.time.time', return_value=time.time() + 120):
+                self.assertIsNone(QuestionCache(disk_path=disk_path, ttl_seconds=60).get('a'))
+
+
+class ContextTableTests(SimpleTestCase):
+    def setUp(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.root = temp.name
+        self.path = os.path.join(self.root, 'context_table.json')
+        self.searches = []
+
+    def search(self, query):
+        self.searches.append(query)
+        return [{'content': f"About {query}", 'source': 'kb'}]
+
+    def test_build_searches_each_query_once_and_persists(self):
+        table = ContextTable(self.path)
+        table.build(['sleep', 'mood', 'sleep'], self.search, 'v1')
+        self.assertEqual(self.searches, ['mood', 'sleep'])
+
+        loaded = ContextTable(self.path)
+        self.assertTrue(loaded.load('v1'))
+        self.assertEqual(loaded.get('sleep'), [{'content': "About sleep", 'source': 'kb'}])
+        self.assertIsNone(loaded.get('appetite'))
+        self.assertEqual(loaded.stats(), {'entries': 2, 'version': 'v1', 'hits': 1, 'misses': 1})
+
+    def test_stale_or_foreign_tables_are_not_loaded(self):
+        self.assertFalse(ContextTable(self.path).load('v1'))
+        ContextTable(self.path).build(['sleep'], self.search, 'v1')
+        self.assertFalse(ContextTable(self.path).load('v2'))
+        with mock.patch.object(ContextTable, 'FORMAT', ContextTable.FORMAT + 1):
+            self.assertFalse(ContextTable(self.path).load('v1'))
+
+    def test_rebuild_by_another_process_is_picked_up(self):
+        table = ContextTable(self.path)
+        table.build(['sleep'], self.search, 'v1')
+        table.RELOAD_INTERVAL = 0
+        ContextTable(self.path).build(['sleep', 'mood'], self.search, 'v2')
+        # Make sure the rebuild is visible even on coarse mtime filesystems
+        os.utime(self.path, (time.time() + 5, time.time() + 5))
+        self.assertEqual(table.get('mood'), [{'content': "About mood", 'source': 'kb'}])
+        self.assertEqual(table.version, 'v2')
+
+    def test_version_tracks_manifest_and_encoder(self):
+        manifest_path = os.path.join(self.root, 'manifest.json')
+        encoder = {'backend': 'sentence_transformers', 'model_path': 'all-MiniLM-L6-v2'}
+        missing = vector_store_version(manifest_path, encoder)
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({'files': {'sleep.txt': {'sha256': 'a', 'chunks': ['1']}}}, f)
+        version = vector_store_version(manifest_path, encoder)
+        self.assertNotEqual(version, missing)
+        self.assertEqual(vector_store_version(manifest_path, dict(reversed(encoder.items()))), version)
+        self.assertNotEqual(vector_store_version(manifest_path, {**encoder, 'backend': 'int8'}), version)
+
+
+class KeywordEmbeddings:
+    """Bag-of-keywords encoder, so similarity follows shared topic words"""
+
+    KEYWORDS = ('sleep', 'insomnia', 'mood', 'anxiety', 'appetite')
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        return [float(text.lower().count(word)) for word in self.KEYWORDS]
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [self.embed_query(text) for text in texts]
+
+
+class WordTokenizer:
+    """Whitespace tokenizer with the encode/decode calls ContextPacker makes"""
+
+    def encode(self, text, add_special_tokens=False):
+        return text.split()
+
+    def decode(self, ids, skip_special_tokens=True):
+        return " ".join(ids)
+
+
+class ContextPackerTests(SimpleTestCase):
+    DOCUMENTS = [
+        {'type': 'clinical_guideline', 'content': "Mood is tracked weekly. Sleep hygiene helps insomnia. "
+                                                  "Keep a regular sleep schedule."},
+        {'type': 'assessment_tool', 'content': "Appetite changes are scored on item five."},
+    ]
+
+    def test_split_sentences(self):
+        self.assertEqual(split_sentences("One. Two?  Three!\n\nFour"), ["One.", "Two?", "Three!", "Four"])
+
+    def test_best_sentences_fit_the_budget_in_document_order(self):
+        packer = ContextPacker(KeywordEmbeddings(), WordTokenizer())
+        context = packer.pack_documents("sleep and insomnia", self.DOCUMENTS, budget=17)
+        self.assertEqual(context, "CLINICAL CONTEXT:\n\n--- CLINICAL_GUIDELINE ---\n"
+                                  "Sleep hygiene helps insomnia. Keep a regular sleep schedule.\n")
+        self.assertLessEqual(packer.count_tokens(context), 17)
+
+        # Nothing fits: only the header is left
+        self.assertEqual(packer.pack_documents("sleep", self.DOCUMENTS, budget=3), packer.HEADER)
+
+    def test_packed_context_is_memoised(self):
+        embeddings = KeywordEmbeddings()
+        packer = ContextPacker(embeddings, cache_size=1)
+        first = packer.pack_documents("appetite", self.DOCUMENTS, budget=200)
+        self.assertIn("--- ASSESSMENT_TOOL ---", first)
+        self.assertEqual(packer.pack_documents("appetite", self.DOCUMENTS, budget=200), first)
+        self.assertEqual(embeddings.calls, 1)
+        packer.pack_documents("mood", self.DOCUMENTS, budget=200)
+        self.assertEqual(packer.stats(), {'token_counter': 'characters', 'packed_entries': 1})
+
+    def test_pack_items_keeps_short_items_whole(self):
+        packer = ContextPacker(KeywordEmbeddings(), WordTokenizer())
+        items = ["Q1: Yes", "Q2: " + "word " * 20, "Q3: " + "word " * 20]
+        packed = packer.pack_items(items, budget=22)
+        parts = packed.split(" | ")
+        self.assertEqual(parts[0], "Q1: Yes")
+        self.assertEqual([len(part.split()) for part in parts[1:]], [9, 9])
+        self.assertLessEqual(packer.count_tokens(packed), 22)
+        self.assertEqual(packer.pack_items([], budget=10), "")
+
+    def test_character_estimate_without_a_tokenizer(self):
+        packer = ContextPacker(KeywordEmbeddings())
+        self.assertEqual(packer.count_tokens("x" * 9), 3)
+        self.assertEqual(packer.truncate("abcdefghij", 2), "abcdefgh")
+        self.assertEqual(packer.truncate("abc", 0), "")
+
+
+class SeverityRoutingTests(SimpleTestCase):
+    MINIMAL = {'depression_severity': 'minimal', 'anxiety_severity': 'minimal',
+               'sleep_disturbance': 'minimal', 'suicide_risk': 'low'}
+
+    def analysis(self, **fields):
+        return {**self.MINIMAL, **fields}
+
+    def test_tiers(self):
+        cases = [
+            ({}, 'minimal'),
+            ({'sleep_disturbance': 'moderate'}, 'mild'),
+            ({'anxiety_severity': 'moderate'}, 'moderate'),
+            ({'depression_severity': 'moderately_severe'}, 'severe'),
+            ({'depression_severity': 'minimal', 'suicide_risk': 'moderate'}, 'suicidality'),
+        ]
+        for fields, tier in cases:
+            self.assertEqual(severity_tier(self.analysis(**fields)), tier, fields)
+
+    def test_default_table_and_overrides(self):
+        router = SeverityRouter()
+        self.assertEqual(router.route(self.analysis()), 'template')
+        self.assertEqual(router.route(self.analysis(depression_severity='moderate')), 'small')
+        self.assertEqual(router.route(self.analysis(suicide_risk='high')), 'large')
+        self.assertEqual(SeverityRouter({'moderate': 'large'}).route(self.analysis(anxiety_severity='moderate')),
+                         'large')
+
+    def test_invalid_tables_are_rejected(self):
+        for routes in ({'suicidality': 'small'}, {'critical': 'large'}, {'mild': 'tiny'}):
+            with self.assertRaises(ValueError):
+                SeverityRouter(routes)
+
+    def test_timed_requests_are_counted_per_route_and_tier(self):
+        router = SeverityRouter()
+        with router.timed('large', self.analysis(suicide_risk='high')):
+            pass
+        with self.assertRaises(RuntimeError):
+            with router.timed('template', self.analysis()):
+                raise RuntimeError("failed requests still count")
+        stats = router.stats()
+        self.assertEqual((stats['tiers']['suicidality'], stats['tiers']['minimal']), (1, 1))
+        self.assertEqual(stats['routes']['large']['requests'], 1)
+        self.assertIsNotNone(stats['routes']['template']['p95_ms'])
+        self.assertEqual(stats['routes']['small'], {'requests': 0, 'p50_ms': None, 'p95_ms': None, 'mean_ms': None})
+
+    @skipUnless(HAS_RAG, "needs torch, transformers and langchain")
+    def test_system_routes(self):
+        system = bare_system(router=SeverityRouter(), small_pipe=None, llm=object())
+        moderate = self.analysis(depression_severity='moderate')
+        # The small route falls back to the generation model while it is not loaded
+        self.assertEqual(system._route(moderate), 'large')
+        self.assertEqual(bare_system(router=SeverityRouter(), small_pipe=object())._route(moderate), 'small')
+        self.assertEqual(bare_system(router=None)._route(self.analysis()), 'large')
+
+        # Low tiers are answered from the templates without touching the model
+        result = system.generate_follow_up(self.analysis())
+        self.assertEqual(result['generated_by'], 'template')
+        self.assertEqual(len(result['questions']), 5)
+        report = system.generate_comprehensive_report({0: 1}, {'Q?': 'A'}, analysis=self.analysis())
+        self.assertEqual(report['generated_by'], 'template')
+        self.assertEqual(system.router.stats()['routes']['template']['requests'], 2)
@@ -11,11 +11,21 @@ urlpatterns = [
     path('', include(router.urls)),
     path('test/', views.test_api, name='test_api'),
     path('questions/', views.get_questions, name='get_questions'),
+    path('assessments/answer/', views.submit_answer, name='submit_answer'),
     
     # New RAG endpoints
     path('analyze-initial/', rag_views.analyze_initial_assessment, name='analyze_initial'),
     path('generate-report/', rag_views.generate_clinical_report, name='generate_report'),
+    path('analyze-initial/stream/', rag_views.analyze_initial_assessment_stream, name='analyze_initial_stream'),
+    path('generate-report/stream/', rag_views.generate_clinical_report_stream, name='generate_report_stream'),
+    path('report-jobs/', rag_views.enqueue_report_job, name='enqueue_report_job'),
+    path('report-jobs/<uuid:job_id>/', rag_views.report_job_status, name='report_job_status'),
     path('system-status/', rag_views.system_status, name='system_status'),
+    
+    # Async variants (serve under ASGI)
+    path('analyze-initial/async/', rag_views.analyze_initial_assessment_async, name='analyze_initial_async'),
+    path('generate-report/async/', rag_views.generate_clinical_report_async, name='generate_report_async'),
+    path('system-status/async/', rag_views.system_status_async, name='system_status_async'),
 ]
 
 
@@ -1,8 +1,13 @@
 # E:\2025\Archit\Inner-Balance\backend\InnerBalance\backend\innerbalance\api\views.py
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from questionnaires.models import Question
+from rest_framework import status
+from questionnaires.models import Question, Assessment
+from rag.scoring import MAX_ITEM_SCORE
 import traceback 
+import logging
+
+logger = logging.getLogger(__name__)
 
 @api_view(['GET'])
 def test_api(request):
@@ -53,6 +58,61 @@ def get_questions(request):
             'questions': []
         }, status=500)
 
+def _whole_number(value):
+    """The int in a JSON integer or integer string; None for bools, fractions and anything else"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            return None
+    return None
 
-
-
+@api_view(['POST'])
+def submit_answer(request):
+    """
+    Record one answer and update the assessment's running scores; the
+    assessment is escalated to crisis as soon as the suicidality item is
+    answered high
+    """
+    data = request.data
+    assessment_id = data.get('assessment_id')
+    score = _whole_number(data.get('score'))
+    if assessment_id in (None, '') or score is None or not 0 <= score <= MAX_ITEM_SCORE:
+        return Response({
+            'error': f'assessment_id and a score between 0 and {MAX_ITEM_SCORE} are required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    field = 'question_id' if data.get('question_id') is not None else 'question_order'
+    number = _whole_number(data.get(field))
+    if number is None or number < 1:
+        return Response({
+            'error': 'question_id or question_order must be a positive integer'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if field == 'question_id':
+        question = Question.objects.filter(id=number).first()
+    else:
+        question = Question.objects.filter(order=number, is_follow_up=False).first()
+    if question is None:
+        return Response({'error': 'Unknown question'}, status=status.HTTP_404_NOT_FOUND)
+    
+    assessment = Assessment.for_external_id(assessment_id, request.user)
+    was_crisis = assessment.status == 'crisis'
+    crises = assessment.record_answer(question, score, data.get('response', ''))
+    
+    if crises and not was_crisis:
+        logger.warning(f"CRISIS detected in assessment {assessment_id} at question {question.order}")
+    
+    return Response({
+        'assessment_id': assessment_id,
+        'question_order': question.order,
+        'current_question_index': assessment.current_question_index,
+        'scores': assessment.scores(),
+        'status': assessment.status,
+        'risk_level': assessment.risk_level,
+        'crisis': bool(crises),
+    }, status=status.HTTP_200_OK)
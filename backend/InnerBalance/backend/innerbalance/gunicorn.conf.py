@@ -0,0 +1,20 @@
+"""
+Gunicorn settings, picked up automatically when gunicorn is started from this
+directory:
+
+    gunicorn innerbalance.wsgi
+
+The RAG models are loaded per worker, after the fork. warm_on_server_start()
+does nothing under gunicorn, so `--preload` only shares the Django import and
+never loads the models in the master.
+"""
+
+import os
+
+
+def post_worker_init(worker):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'innerbalance.settings')
+
+    from rag.engine import warm_worker
+
+    warm_worker()
@@ -7,10 +7,55 @@ For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
 
+import asyncio
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'innerbalance.settings')
 
-application = get_asgi_application()
+
+class CancelOnDisconnect:
+    """
+    Cancel a request's handler as soon as its client disconnects, so async
+    views stop waiting, their queued inference calls are dropped and running
+    generations stop (InferenceExecutor sets the call's cancel event). Django
+    4.2 does not watch for http.disconnect once the body has been read.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        messages = asyncio.Queue()
+        handler = asyncio.ensure_future(self.app(scope, messages.get, send))
+
+        async def listen():
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message['type'] == 'http.disconnect':
+                    handler.cancel()
+                    return
+
+        listener = asyncio.ensure_future(listen())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            # Only swallow the cancellation we caused
+            if not listener.done():
+                raise
+        finally:
+            listener.cancel()
+
+
+application = CancelOnDisconnect(get_asgi_application())
+
+# Start loading the RAG models in the background; requests are answered from
+# the rule-based fallbacks until the engine is ready.
+from rag.engine import warm_on_server_start
+
+warm_on_server_start()
@@ -88,6 +88,20 @@ DATABASES = {
     }
 }
 
+# 'rag_sessions' keeps per-assessment RAG state between analyze-initial and
+# generate-report (api.session_cache); file-based so that every worker
+# process, report workers included, shares it
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'rag_sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('RAG_SESSION_CACHE_DIR') or os.path.join(BASE_DIR, 'rag', 'vector_store', 'sessions'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -147,3 +161,119 @@ CORS_ALLOW_METHODS = [
     "DELETE",
     "OPTIONS",
 ]
+
+# -------------------------
+# RAG engine
+# -------------------------
+RAG_ENGINE = {
+    # Build and warm the models in a background thread when a server starts
+    'WARMUP_ON_START': os.environ.get('RAG_WARMUP_ON_START', '1') == '1',
+    # Unix socket of a shared `manage.py run_model_server` daemon; when set,
+    # workers stay thin and forward inference calls to it
+    'MODEL_SERVER_SOCKET': os.environ.get('RAG_MODEL_SERVER_SOCKET'),
+    'MODEL_SERVER_TIMEOUT': 120.0,
+    # Async endpoints: threads running engine calls (0 = one per core) and
+    # seconds a request waits before answering from the rule-based fallbacks
+    'INFERENCE_WORKERS': int(os.environ.get('RAG_INFERENCE_WORKERS', '0')),
+    'REQUEST_DEADLINE_SECONDS': float(os.environ.get('RAG_REQUEST_DEADLINE_SECONDS', '60')),
+    # Generation stops this many seconds into a request and keeps what it has
+    # produced, topped up from the fallback banks (0 = unbounded); keep it
+    # below REQUEST_DEADLINE_SECONDS so the salvaged answer arrives in time
+    'GENERATION_DEADLINE_SECONDS': float(os.environ.get('RAG_GENERATION_DEADLINE_SECONDS', '45')),
+    # Collect concurrent prompts for this long (or up to this many) and run
+    # them as one padded generate call; 0 disables batching
+    'BATCH_WINDOW_MS': int(os.environ.get('RAG_BATCH_WINDOW_MS', '20')),
+    'BATCH_MAX_SIZE': int(os.environ.get('RAG_BATCH_MAX_SIZE', '8')),
+    # 'auto' (fp16 on GPU, bf16 on CPU), 'fp16', 'fp32', 'bf16' or 'int8'
+    # (dynamic quantisation of Linear layers for CPU-only hosts). Applies to
+    # Phi-3; distilgpt2 (fallback, draft, small route) stays fp32 on CPU
+    'INFERENCE_PRECISION': os.environ.get('RAG_INFERENCE_PRECISION', 'auto'),
+    # 'chroma' or 'numpy' (memory-mapped brute-force index shared through the
+    # page cache; compare with `manage.py benchmark_vector_store`)
+    'VECTOR_BACKEND': os.environ.get('RAG_VECTOR_BACKEND', 'chroma'),
+    # Knowledge base ingestion (`manage.py ingest_knowledge_base`)
+    'INGEST_BATCH_SIZE': 64,
+    'INGEST_WORKERS': int(os.environ.get('RAG_INGEST_WORKERS', '0')),
+    # Greedy follow-up generation so cached questions are reusable; the cache
+    # can be pre-filled with `manage.py warm_question_cache`
+    'DETERMINISTIC_QUESTIONS': True,
+    # Constrain questions and reports to their JSON schema while decoding and
+    # stop generating as soon as the JSON is complete
+    'STRUCTURED_DECODING': os.environ.get('RAG_STRUCTURED_DECODING', '1') == '1',
+    # Draft model for assisted generation; it must use the generation model's
+    # tokenizer (compare with `manage.py benchmark_assisted_decoding`)
+    'DRAFT_MODEL': os.environ.get('RAG_DRAFT_MODEL') or None,
+    'DRAFT_TOKENS': int(os.environ.get('RAG_DRAFT_TOKENS', '5')),
+    # Reuse the KV cache of the prompt templates' fixed instruction blocks
+    # (RAG_PREFIX_CACHE=1). Those generations run one at a time, so it only
+    # applies with micro-batching off (RAG_BATCH_WINDOW_MS=0)
+    'PREFIX_CACHE': os.environ.get('RAG_PREFIX_CACHE', '0') == '1',
+    # Retrieved documents per query and per-prompt token budgets for the
+    # packed context and follow-up answers (Phi-3 has a 4k window)
+    'RETRIEVAL_K': 4,
+    # Sentence embeddings: 'sentence_transformers', 'int8' or 'onnx' (ONNX
+    # Runtime; RAG_EMBEDDING_MODEL_PATH must point at a local export)
+    'EMBEDDINGS': {
+        'BACKEND': os.environ.get('RAG_EMBEDDING_BACKEND', 'sentence_transformers'),
+        'MODEL_PATH': os.environ.get('RAG_EMBEDDING_MODEL_PATH') or None,
+        'BATCH_SIZE': 64,
+        'QUERY_CACHE_SIZE': 2048,
+    },
+    'CONTEXT_BUDGETS': {
+        'FOLLOW_UP_CONTEXT': 384,
+        'REPORT_CONTEXT': 256,
+        'REPORT_ANSWERS': 384,
+    },
+    # Queued reports (POST /api/report-jobs/), consumed by
+    # `manage.py run_report_workers`; a job whose worker stops heartbeating
+    # for VISIBILITY_TIMEOUT seconds is handed to another worker. Jobs are
+    # claimed by clinical priority, except that one waiting longer than
+    # STARVATION_SECONDS goes first
+    'REPORT_JOBS': {
+        'WORKERS': int(os.environ.get('RAG_REPORT_WORKERS', '1')),
+        'VISIBILITY_TIMEOUT': 600,
+        'MAX_ATTEMPTS': 3,
+        'RETRY_BACKOFF_SECONDS': 15,
+        'POLL_INTERVAL': 1.0,
+        'STARVATION_SECONDS': 300,
+    },
+    # Generations are admitted by clinical priority (crisis > high >
+    # moderate > routine); crisis work also has reserved slots
+    'SCHEDULER': {
+        'SLOTS': int(os.environ.get('RAG_INFERENCE_SLOTS', '0')),
+        'RESERVED_CRISIS_SLOTS': 1,
+        'AGING_SECONDS': 10.0,
+    },
+    # Shed non-crisis work to the rule-based answers when queued generations
+    # would miss this latency; None disables shedding
+    'ADMISSION': {
+        'LATENCY_SLO_SECONDS': float(os.environ.get('RAG_LATENCY_SLO_SECONDS', '20')),
+        'RECOVER_RATIO': 0.7,
+        'HOLD_SECONDS': 10.0,
+        'WINDOW_SECONDS': 60.0,
+    },
+    # Severity routing (rag.routing): which engine answers each tier, from the
+    # question banks ('template') through the small model to Phi-3 ('large');
+    # suicidality always goes to Phi-3. RAG_ROUTING=0 sends everything to Phi-3
+    'ROUTING': {
+        'SMALL_MODEL': os.environ.get('RAG_SMALL_MODEL', 'distilgpt2'),
+        'ROUTES': {
+            'minimal': 'template',
+            'mild': 'template',
+            'moderate': 'small',
+            'severe': 'large',
+            'suicidality': 'large',
+        },
+    } if os.environ.get('RAG_ROUTING', '1') == '1' else None,
+    # Per-assessment analysis, retrieved documents and follow-up questions,
+    # reused by the report step (cache alias from CACHES)
+    'SESSION_CACHE': {
+        'CACHE_ALIAS': 'rag_sessions',
+        'TTL_SECONDS': int(os.environ.get('RAG_SESSION_TTL_SECONDS', '3600')),
+    },
+    'QUESTION_CACHE': {
+        'MAX_ENTRIES': 1024,
+        'TTL_SECONDS': 7 * 24 * 3600,
+        'DISK_PATH': os.path.join(BASE_DIR, 'rag', 'vector_store', 'question_cache'),
+    },
+}
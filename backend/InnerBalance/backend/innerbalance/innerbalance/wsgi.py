@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'innerbalance.settings')
 
 application = get_wsgi_application()
+
+# Start loading the RAG models in the background; requests are answered from
+# the rule-based fallbacks until the engine is ready.
+from rag.engine import warm_on_server_start
+
+warm_on_server_start()
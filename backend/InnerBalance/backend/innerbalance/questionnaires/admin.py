@@ -12,7 +12,7 @@ class QuestionAdmin(admin.ModelAdmin):
 
 @admin.register(Assessment)
 class AssessmentAdmin(admin.ModelAdmin):
-    list_display = ['id', 'patient', 'status', 'risk_level', 'started_at']
+    list_display = ['id', 'patient', 'status', 'risk_level', 'suicidality_score', 'current_question_index', 'started_at']
     list_filter = ['status', 'risk_level', 'started_at']
     readonly_fields = ['started_at']
 
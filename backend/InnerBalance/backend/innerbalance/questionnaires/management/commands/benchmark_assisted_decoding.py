@@ -0,0 +1,83 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+    help = 'Compare generation tokens/sec with and without assisted (draft model) decoding'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--draft-model', default=None,
+                            help="Draft model (defaults to RAG_ENGINE['DRAFT_MODEL'])")
+        parser.add_argument('--draft-tokens', type=int, default=None)
+        parser.add_argument('--prompts', type=int, default=5)
+        parser.add_argument('--max-new-tokens', type=int, default=128)
+        parser.add_argument('--precision', default=None,
+                            help="Override RAG_ENGINE['INFERENCE_PRECISION'] (fp32 for plain CPU runs)")
+        parser.add_argument('--structured', action='store_true',
+                            help='Constrain both runs to the follow-up JSON schema, as served')
+
+    def _run(self, system, prompts, max_new_tokens, assisted):
+        outputs = []
+        tokens = 0
+        started = time.perf_counter()
+        for prompt in prompts:
+            # Fresh constraint state per call (empty unless --structured)
+            kwargs = {**system._question_generation_kwargs(), 'do_sample': False, 'max_new_tokens': max_new_tokens}
+            if assisted:
+                text = system.assisted.generate(system.pipe, prompt, **kwargs)
+            else:
+                text = system.pipe(prompt, **kwargs)[0]['generated_text']
+            outputs.append(text)
+            tokens += len(system.tokenizer.encode(text, add_special_tokens=False))
+        return outputs, tokens, time.perf_counter() - started
+
+    def handle(self, *args, **options):
+        from rag.meditron_rag import MeditronRAGSystem
+
+        config = dict(settings.RAG_ENGINE)
+        config.update({
+            'DRAFT_MODEL': options['draft_model'] or config.get('DRAFT_MODEL'),
+            # Measure raw generation: no batching or caching
+            'BATCH_WINDOW_MS': 0,
+            'QUESTION_CACHE': None,
+            'STRUCTURED_DECODING': options['structured'],
+        })
+        if options['draft_tokens']:
+            config['DRAFT_TOKENS'] = options['draft_tokens']
+        if options['precision']:
+            config['INFERENCE_PRECISION'] = options['precision']
+        if not config['DRAFT_MODEL']:
+            raise CommandError('No draft model: pass --draft-model or set RAG_DRAFT_MODEL')
+
+        system = MeditronRAGSystem(config=config)
+        if system.assisted is None:
+            raise CommandError(f"Assisted decoding unavailable with draft model {config['DRAFT_MODEL']}")
+
+        analyses = list(system.iter_analysis_buckets())[:options['prompts']]
+        prompts = [system.follow_up_prompt.format(**system._follow_up_inputs(a)) for a in analyses]
+        system.pipe("Warm up the model.", max_new_tokens=4)
+
+        self.stdout.write(f"{system.model_name} ({system.precision}), draft {config['DRAFT_MODEL']}, "
+                          f"{len(prompts)} prompts x {options['max_new_tokens']} tokens"
+                          f"{' (JSON-constrained)' if options['structured'] else ''}")
+
+        baseline, base_tokens, base_seconds = self._run(system, prompts, options['max_new_tokens'], False)
+        assisted, assisted_tokens, assisted_seconds = self._run(system, prompts, options['max_new_tokens'], True)
+
+        base_rate = base_tokens / base_seconds
+        assisted_rate = assisted_tokens / assisted_seconds
+        self.stdout.write(f"  baseline  {base_tokens:6d} tokens  {base_seconds:8.2f}s  {base_rate:7.2f} tok/s")
+        self.stdout.write(f"  assisted  {assisted_tokens:6d} tokens  {assisted_seconds:8.2f}s  {assisted_rate:7.2f} tok/s")
+        self.stdout.write(f"  speedup   {assisted_rate / base_rate:.2f}x")
+
+        stats = system.assisted.stats()
+        self.stdout.write(f"  acceptance rate {stats['acceptance_rate']}  "
+                          f"tokens per verification pass {stats['tokens_per_verification']}")
+
+        # Greedy assisted decoding must reproduce the target model's output
+        mismatches = sum(1 for a, b in zip(baseline, assisted) if a != b)
+        if mismatches:
+            self.stdout.write(self.style.WARNING(f"  {mismatches} outputs differ from the baseline"))
+        else:
+            self.stdout.write(self.style.SUCCESS("  Outputs identical to the baseline"))
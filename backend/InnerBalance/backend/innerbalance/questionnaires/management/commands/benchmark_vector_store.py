@@ -0,0 +1,87 @@
+import time
+import shutil
+import tempfile
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from rag.numpy_store import NumpyVectorStore
+
+class Command(BaseCommand):
+    help = 'Compare NumPy and Chroma vector search latency on synthetic corpora'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=2)
+        parser.add_argument('--dim', type=int, default=384, help='MiniLM-L6 embedding size')
+        parser.add_argument('--skip-chroma', action='store_true')
+
+    def _percentiles(self, timings):
+        ms = np.array(timings) * 1000.0
+        return f"p50 {np.percentile(ms, 50):.2f}ms  p95 {np.percentile(ms, 95):.2f}ms"
+
+    def _time_queries(self, store, queries, k):
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            store.similarity_search_by_vector(query.tolist(), k=k)
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    def _build_numpy(self, directory, ids, vectors, texts, metadatas):
+        store = NumpyVectorStore(directory)
+        store.upsert_embeddings(ids, vectors, texts, metadatas)
+        store.persist()
+        # Re-open so searches run against the memory-mapped file like workers do
+        return NumpyVectorStore(directory)
+
+    def _build_chroma(self, directory, ids, vectors, texts, metadatas):
+        from langchain_community.vectorstores import Chroma
+
+        store = Chroma(persist_directory=directory, embedding_function=None)
+        for start in range(0, len(ids), 5000):
+            end = start + 5000
+            store._collection.upsert(
+                ids=ids[start:end], embeddings=vectors[start:end].tolist(),
+                documents=texts[start:end], metadatas=metadatas[start:end]
+            )
+        return store
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        k = options['k']
+        queries = rng.standard_normal((options['queries'], options['dim'])).astype(np.float32)
+        backends = [('numpy', self._build_numpy)]
+        if not options['skip_chroma']:
+            backends.append(('chroma', self._build_chroma))
+
+        for size in options['sizes']:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\n{size} chunks"))
+            vectors = rng.standard_normal((size, options['dim'])).astype(np.float32)
+            ids = [f"chunk-{i}" for i in range(size)]
+            texts = [f"Synthetic guideline chunk {i}" for i in range(size)]
+            metadatas = [{"source": "benchmark", "type": "synthetic"} for _ in range(size)]
+
+            for name, build in backends:
+                directory = tempfile.mkdtemp(prefix=f"rag-bench-{name}-")
+                try:
+                    started = time.perf_counter()
+                    store = build(directory, ids, vectors, texts, metadatas)
+                    build_seconds = time.perf_counter() - started
+
+                    timings = self._time_queries(store, queries, k)
+                    line = (f"  {name:<7} build {build_seconds:7.2f}s  "
+                            f"query {self._percentiles(timings)}  "
+                            f"{len(queries) / sum(timings):8.0f} q/s")
+
+                    if name == 'numpy':
+                        started = time.perf_counter()
+                        store.batch_similarity_search_by_vector(queries, k=k)
+                        batch_seconds = time.perf_counter() - started
+                        line += f"  (batched: {len(queries) / batch_seconds:.0f} q/s)"
+                    self.stdout.write(line)
+                except ImportError as e:
+                    self.stdout.write(self.style.WARNING(f"  {name:<7} skipped: {e}"))
+                finally:
+                    shutil.rmtree(directory, ignore_errors=True)
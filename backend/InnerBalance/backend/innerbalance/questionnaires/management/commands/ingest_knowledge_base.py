@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = 'Incrementally embed new or changed knowledge base files and drop removed ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Ignore the manifest and re-embed the whole knowledge base'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Embedding processes (0 embeds in-process; default RAG_ENGINE["INGEST_WORKERS"])'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Chunks per embedding batch (default RAG_ENGINE["INGEST_BATCH_SIZE"])'
+        )
+
+    def handle(self, *args, **options):
+        from rag.meditron_rag import MeditronRAGSystem
+
+        # Retrieval components only; ingestion never needs the LLM. The context
+        # table is built from the synced store below, not the one on disk now.
+        system = MeditronRAGSystem(config=settings.RAG_ENGINE, load_llm=False, load_context_table=False)
+        report = system.load_knowledge_base(
+            rebuild=options['rebuild'],
+            workers=options['workers'],
+            batch_size=options['batch_size']
+        )
+
+        if report['encoder_changed']:
+            self.stdout.write("  Encoder changed: every chunk was re-encoded")
+        for label, key in [('Added', 'added_files'), ('Changed', 'changed_files'),
+                           ('Removed', 'removed_files'), ('Failed', 'failed_files')]:
+            for rel_path in report[key]:
+                self.stdout.write(f"  {label}: {rel_path}")
+        self.stdout.write(f"  Unchanged files: {len(report['unchanged_files'])}")
+        self.stdout.write(
+            f"  Throughput: {report['chunks_per_second']} chunks/sec "
+            f"({report['elapsed_seconds']}s)"
+        )
+
+        # Loads the table if it already matches the synced store, rebuilds it otherwise
+        system.setup_context_table()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Ingestion complete: {report['chunks_added']} chunks embedded, "
+            f"{report['chunks_removed']} chunks removed"
+        ))
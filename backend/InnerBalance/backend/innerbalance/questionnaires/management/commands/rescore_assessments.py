@@ -0,0 +1,65 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from questionnaires.models import Answer, Assessment
+from rag.scoring import SCORING
+
+class Command(BaseCommand):
+    help = 'Recompute the running score totals of every assessment from its answers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Assessments scored and written per batch')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def _answer_rows(self):
+        """(assessment id, item index, score) for every scored initial answer, by assessment"""
+        return (
+            Answer.objects
+            .filter(score__isnull=False, question__is_follow_up=False,
+                    question__order__gte=1, question__order__lte=SCORING.num_items)
+            .order_by('assessment_id')
+            .values_list('assessment_id', 'question__order', 'score')
+            .iterator(chunk_size=self.chunk_size)
+        )
+
+    def _chunks(self):
+        """Stream answers into (assessment ids, answer matrix) blocks"""
+        ids = []
+        matrix = np.zeros((self.chunk_size, SCORING.num_items), dtype=np.int32)
+        for assessment_id, order, score in self._answer_rows():
+            if not ids or ids[-1] != assessment_id:
+                if len(ids) == self.chunk_size:
+                    yield ids, matrix
+                    ids = []
+                    matrix = np.zeros_like(matrix)
+                ids.append(assessment_id)
+            matrix[len(ids) - 1, order - 1] = score
+        if ids:
+            yield ids, matrix[:len(ids)]
+
+    def handle(self, *args, **options):
+        self.chunk_size = options['chunk_size']
+        fields = Assessment.SCORE_FIELDS
+        columns = [SCORING.index[name] for name in fields]
+        started = time.monotonic()
+        total = 0
+
+        for ids, matrix in self._chunks():
+            scores = SCORING.score(matrix)[:, columns]
+            assessments = [
+                Assessment(id=assessment_id, **{field: int(value) for field, value in zip(fields.values(), row)})
+                for assessment_id, row in zip(ids, scores)
+            ]
+            if not options['dry_run']:
+                with transaction.atomic():
+                    Assessment.objects.bulk_update(assessments, list(fields.values()), batch_size=1000)
+            total += len(assessments)
+            self.stdout.write(f"Scored {total} assessments...")
+
+        elapsed = time.monotonic() - started
+        verb = 'Would update' if options['dry_run'] else 'Updated'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {total} assessments in {elapsed:.1f}s"))
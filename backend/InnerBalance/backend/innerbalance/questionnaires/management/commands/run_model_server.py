@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rag.model_server import ModelServer
+
+class Command(BaseCommand):
+    help = 'Run the shared inference daemon that owns the RAG models for this host'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--socket',
+            default=settings.RAG_ENGINE.get('MODEL_SERVER_SOCKET'),
+            help='Unix socket path to listen on (defaults to RAG_ENGINE["MODEL_SERVER_SOCKET"])'
+        )
+
+    def handle(self, *args, **options):
+        socket_path = options['socket']
+        if not socket_path:
+            raise CommandError('No socket path given and RAG_MODEL_SERVER_SOCKET is not set')
+
+        from rag.meditron_rag import MeditronRAGSystem
+
+        self.stdout.write("🔄 Loading RAG system...")
+        system = MeditronRAGSystem(config=settings.RAG_ENGINE)
+        system.warmup()
+
+        server = ModelServer(socket_path, system)
+        self.stdout.write(self.style.SUCCESS(f"✅ Model server listening on {socket_path}"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write("Shutting down model server")
+        finally:
+            server.server_close()
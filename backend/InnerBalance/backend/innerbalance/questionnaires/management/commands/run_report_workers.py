@@ -0,0 +1,58 @@
+import signal
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.jobs import ReportWorker, job_config
+
+class Command(BaseCommand):
+    help = 'Consume queued report jobs with a pool of local worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=job_config()['WORKERS'],
+                            help='Worker processes (each loads its own models unless '
+                                 'RAG_MODEL_SERVER_SOCKET points them at a shared daemon)')
+        parser.add_argument('--max-jobs', type=int, default=0,
+                            help='Exit after this many jobs (single worker only)')
+
+    def handle(self, *args, **options):
+        if options['workers'] <= 1:
+            self._run_worker(options['max_jobs'])
+        else:
+            self._supervise(options['workers'])
+
+    def _run_worker(self, max_jobs):
+        worker = ReportWorker()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: worker.stop())
+
+        self.stdout.write(f"🔄 Report worker {worker.name} waiting for the RAG engine...")
+        processed = worker.run(max_jobs=max_jobs or None)
+        self.stdout.write(self.style.SUCCESS(f"Worker {worker.name} stopped after {processed} jobs"))
+
+    def _spawn(self):
+        return subprocess.Popen([sys.executable, sys.argv[0], 'run_report_workers', '--workers', '1'])
+
+    def _supervise(self, count):
+        """Run single-worker child processes and restart any that die"""
+        stopping = []
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stopping.append(True))
+
+        children = [self._spawn() for _ in range(count)]
+        self.stdout.write(self.style.SUCCESS(f"✅ Started {count} report workers"))
+        while not stopping:
+            for i, child in enumerate(children):
+                if child.poll() is not None:
+                    self.stderr.write(f"Worker {child.pid} exited with {child.returncode}; restarting")
+                    children[i] = self._spawn()
+            time.sleep(1)
+
+        self.stdout.write("Stopping report workers after their current jobs...")
+        for child in children:
+            if child.poll() is None:
+                child.terminate()
+        for child in children:
+            child.wait()
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rag.engine import get_engine
+
+class Command(BaseCommand):
+    help = 'Pre-generate follow-up questions for every analysis bucket'
+
+    def handle(self, *args, **options):
+        engine = get_engine()
+        self.stdout.write("🔄 Loading RAG system...")
+        if not engine.wait_until_ready() or not engine.status()['llm_loaded']:
+            raise CommandError('No LLM available; nothing to cache')
+
+        system = engine.acquire()
+        buckets = list(engine.rules.iter_analysis_buckets())
+        self.stdout.write(f"Warming {len(buckets)} analysis buckets...")
+
+        started = time.monotonic()
+        for i, analysis in enumerate(buckets, 1):
+            questions = system.generate_follow_up_questions(analysis)
+            self.stdout.write(
+                f"  [{i}/{len(buckets)}] {', '.join(analysis['primary_concerns'])} "
+                f"(suicide risk: {analysis['suicide_risk']}) -> {len(questions)} questions"
+            )
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Question cache warmed: {len(buckets)} buckets in {elapsed:.1f}s"
+        ))
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0001_initial'),
+        ('questionnaires', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assessment',
+            name='external_id',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='assessment',
+            name='sleep_score',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='assessment',
+            name='suicidality_score',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='assessment',
+            name='patient',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='patients.patient'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaires', '0002_assessment_running_scores'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assessmentreport',
+            name='content',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='assessmentreport',
+            name='follow_up_responses',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -1,9 +1,14 @@
 #E:\2025\Archit\Inner-Balance\backend\InnerBalance\backend\innerbalance\questionnaires\models.py
-from django.db import models
+import uuid
+
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import models, transaction, IntegrityError
+from django.utils import timezone
 
 # Create your models here.
 
 from patients.models import Patient
+from rag.scoring import SCORING, MAX_ITEM_SCORE
 
 class Question(models.Model):
     QUESTION_TYPES = [
@@ -53,20 +58,147 @@ class Assessment(models.Model):
         ('crisis', 'Crisis - Immediate Attention Needed'),
     ]
     
-    patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
+    # Anonymous assessments are keyed by the client's assessment id
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, null=True, blank=True)
+    external_id = models.CharField(max_length=64, unique=True, null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
     risk_level = models.CharField(max_length=20, choices=RISK_LEVELS, default='low')
     started_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     current_question_index = models.IntegerField(default=0)
     
-    # Assessment scores (will be calculated)
+    # Running instrument totals, updated as each answer is recorded
     depression_score = models.IntegerField(default=0)
     anxiety_score = models.IntegerField(default=0)
     overall_score = models.IntegerField(default=0)
+    sleep_score = models.IntegerField(default=0)
+    suicidality_score = models.IntegerField(default=0)
+    
+    # Scoring instrument -> running total field
+    SCORE_FIELDS = {
+        'depression': 'depression_score',
+        'anxiety': 'anxiety_score',
+        'overall': 'overall_score',
+        'sleep': 'sleep_score',
+        'suicide_risk': 'suicidality_score',
+    }
     
     def __str__(self):
         return f"Assessment #{self.id} - {self.patient}"
+    
+    @classmethod
+    def for_external_id(cls, external_id, user=None):
+        """
+        The assessment for a client assessment id, created on first use (with
+        a generated id when the client has none yet). Raises PermissionDenied
+        if it belongs to a patient other than `user`
+        """
+        patient = None
+        if user is not None and user.is_authenticated:
+            patient = Patient.objects.filter(user=user).first()
+        external_id = str(external_id) if external_id not in (None, '') else uuid.uuid4().hex
+        try:
+            assessment, _ = cls.objects.get_or_create(
+                external_id=external_id, defaults={'patient': patient}
+            )
+        except IntegrityError:
+            # Another request created it first
+            assessment = cls.objects.get(external_id=external_id)
+        assessment.check_access(user)
+        return assessment
+    
+    def check_access(self, user=None):
+        """Raise PermissionDenied unless `user` may use this assessment; anonymous ones are open"""
+        if self.patient_id is None:
+            return
+        if user is None or not user.is_authenticated or self.patient.user_id != user.id:
+            raise PermissionDenied("This assessment belongs to another patient")
+    
+    def scores(self):
+        """Running totals keyed by scoring instrument"""
+        return {name: getattr(self, field) for name, field in self.SCORE_FIELDS.items()}
+    
+    def record_answer(self, question, score, response=''):
+        """
+        Save one answer and apply its score change to the running totals.
+        Returns the instruments whose totals are at their crisis threshold.
+        """
+        with transaction.atomic():
+            # Lock the row so concurrent answers cannot lose updates
+            locked = Assessment.objects.select_for_update().get(pk=self.pk)
+            previous = Answer.objects.filter(assessment=locked, question=question).first()
+            old_score = previous.score if previous and previous.score is not None else 0
+            Answer.objects.update_or_create(
+                assessment=locked, question=question,
+                defaults={'response': response or str(score), 'score': score}
+            )
+            
+            item = question.order - 1
+            if not question.is_follow_up and 0 <= item < SCORING.num_items:
+                for name, delta in SCORING.item_deltas(item, score - old_score).items():
+                    field = self.SCORE_FIELDS[name]
+                    setattr(locked, field, getattr(locked, field) + delta)
+            locked.current_question_index = max(locked.current_question_index, question.order)
+            crises = locked._save_scores()
+        
+        self.refresh_from_db()
+        return crises
+    
+    def record_answers(self, answers):
+        """
+        Save a submitted set of initial answers (keyed by item index, as in
+        rag.scoring) with one bulk upsert and recompute the running totals.
+        Returns the instruments whose totals are at their crisis threshold.
+        Items outside the scored range are skipped, as in
+        ScoringEngine.answer_matrix; a score outside 0-3 raises
+        ValidationError, saving nothing.
+        """
+        answers = {item: score for item, score in answers.items() if 0 <= item < SCORING.num_items}
+        invalid = {item: score for item, score in answers.items() if not 0 <= score <= MAX_ITEM_SCORE}
+        if invalid:
+            raise ValidationError(f"Initial answers are scored 0-{MAX_ITEM_SCORE}; got {invalid}")
+        questions = Question.objects.filter(is_follow_up=False, order__in=[item + 1 for item in answers])
+        questions = {question.order: question for question in questions}
+        with transaction.atomic():
+            locked = Assessment.objects.select_for_update().get(pk=self.pk)
+            Answer.objects.bulk_create(
+                [
+                    Answer(assessment=locked, question=questions[item + 1], response=str(score), score=score)
+                    for item, score in answers.items() if item + 1 in questions
+                ],
+                update_conflicts=True,
+                unique_fields=['assessment', 'question'],
+                update_fields=['response', 'score'],
+            )
+            
+            # Answers recorded earlier one at a time count too
+            merged = locked.initial_answers()
+            merged.update(answers)
+            for name, score in SCORING.score_answers(merged).items():
+                setattr(locked, self.SCORE_FIELDS[name], score)
+            locked.current_question_index = max([locked.current_question_index] + [
+                item + 1 for item in merged if 0 <= item < SCORING.num_items
+            ])
+            crises = locked._save_scores()
+        
+        self.refresh_from_db()
+        return crises
+    
+    def initial_answers(self):
+        """Stored initial answer scores keyed by item index"""
+        rows = self.answers.filter(question__is_follow_up=False, score__isnull=False)
+        return {order - 1: score for order, score in rows.values_list('question__order', 'score')}
+    
+    def _save_scores(self):
+        """Escalate a locked row at a crisis threshold and write its totals"""
+        crises = SCORING.crises(self.scores())
+        if crises:
+            self.status = 'crisis'
+            self.risk_level = 'crisis'
+        self.save(update_fields=list(self.SCORE_FIELDS.values()) + [
+            'current_question_index', 'status', 'risk_level'
+        ])
+        return crises
 
 class Answer(models.Model):
     assessment = models.ForeignKey(Assessment, on_delete=models.CASCADE, related_name='answers')
@@ -81,12 +213,46 @@ class Answer(models.Model):
     def __str__(self):
         return f"Answer: {self.response[:20]} (Score: {self.score})"
 
+def _as_text(value):
+    """Report field as plain text, one list item per line"""
+    if isinstance(value, (list, tuple)):
+        return "\n".join(str(item) for item in value)
+    return "" if value is None else str(value)
+
 class AssessmentReport(models.Model):
     assessment = models.OneToOneField(Assessment, on_delete=models.CASCADE)
     summary = models.TextField()
     risk_factors = models.TextField()
     recommendations = models.TextField()
+    # Full report as returned by the API, and the answers it was generated from
+    content = models.JSONField(default=dict)
+    follow_up_responses = models.JSONField(default=dict, blank=True)
     generated_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
-        return f"Report for Assessment #{self.assessment.id}"
\ No newline at end of file
+        return f"Report for Assessment #{self.assessment.id}"
+    
+    @classmethod
+    def store(cls, assessment, report, follow_up_responses=None):
+        """
+        Persist a generated report and complete its assessment. Reports are
+        written once: a concurrent duplicate gets the report stored first.
+        """
+        with transaction.atomic():
+            stored, created = cls.objects.get_or_create(assessment=assessment, defaults={
+                'summary': _as_text(report.get('clinical_insights')),
+                'risk_factors': _as_text(report.get('crisis_indicators')),
+                'recommendations': _as_text(report.get('recommendations')),
+                'content': report,
+                'follow_up_responses': follow_up_responses or {},
+            })
+            if created:
+                locked = Assessment.objects.select_for_update().get(pk=assessment.pk)
+                # A crisis flagged while answering is never downgraded
+                if locked.status != 'crisis':
+                    locked.status = 'completed'
+                    if report.get('risk_level') in dict(Assessment.RISK_LEVELS):
+                        locked.risk_level = report['risk_level']
+                locked.completed_at = timezone.now()
+                locked.save(update_fields=['status', 'risk_level', 'completed_at'])
+        return stored
\ No newline at end of file
@@ -1,3 +1,187 @@
-from django.test import TestCase
+import itertools
+import random
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.test import SimpleTestCase, TestCase
 
 # Create your tests here.
+
+from patients.models import Patient
+from questionnaires.models import Answer, Assessment, Question
+from rag.clinical_rules import ClinicalRules
+from rag.scoring import SCORING, NUM_ITEMS
+
+
+def baseline_analysis(answers):
+    """analyze_initial_answers as it was before the scoring engine, kept as the reference"""
+    depression_score = sum(answers.get(i, 0) for i in range(9))
+    anxiety_score = sum(answers.get(i, 0) for i in [4, 5, 6])
+    sleep_score = answers.get(2, 0)
+    suicide_risk = answers.get(8, 0)
+
+    def phq9(score):
+        if score >= 20: return "severe"
+        elif score >= 15: return "moderately_severe"
+        elif score >= 10: return "moderate"
+        elif score >= 5: return "mild"
+        else: return "minimal"
+
+    def gad7(score):
+        if score >= 15: return "severe"
+        elif score >= 10: return "moderate"
+        elif score >= 5: return "mild"
+        else: return "minimal"
+
+    analysis = {
+        "depression_severity": phq9(depression_score),
+        "anxiety_severity": gad7(anxiety_score),
+        "sleep_disturbance": "significant" if sleep_score >= 2 else "moderate" if sleep_score == 1 else "minimal",
+        "suicide_risk": "high" if suicide_risk >= 2 else "moderate" if suicide_risk == 1 else "low",
+        "primary_concerns": [],
+        "follow_up_focus": []
+    }
+    if depression_score >= 10:
+        analysis["primary_concerns"].append("depression")
+        analysis["follow_up_focus"].extend(["mood_patterns", "anhedonia", "cognitive_symptoms"])
+    if anxiety_score >= 8:
+        analysis["primary_concerns"].append("anxiety")
+        analysis["follow_up_focus"].extend(["worry_patterns", "physical_symptoms", "avoidance"])
+    if sleep_score >= 2:
+        analysis["primary_concerns"].append("sleep_disturbance")
+        analysis["follow_up_focus"].append("sleep_quality")
+    if not analysis["primary_concerns"]:
+        analysis["primary_concerns"].append("general_wellbeing")
+        analysis["follow_up_focus"].extend(["coping_strategies", "support_systems", "life_impact"])
+    return analysis
+
+
+class ScoringEquivalenceTests(SimpleTestCase):
+    def setUp(self):
+        self.rules = ClinicalRules()
+
+    def assertMatchesBaseline(self, answers):
+        expected = baseline_analysis(answers)
+        analysis = self.rules.analyze_initial_answers(answers)
+        self.assertEqual({key: analysis[key] for key in expected}, expected, answers)
+
+    def test_every_single_item_answer(self):
+        for item, score in itertools.product(range(NUM_ITEMS), range(4)):
+            self.assertMatchesBaseline({item: score})
+
+    def test_random_answer_sets(self):
+        rng = random.Random(0)
+        for _ in range(2000):
+            items = rng.sample(range(NUM_ITEMS), rng.randint(0, NUM_ITEMS))
+            self.assertMatchesBaseline({item: rng.randint(0, 3) for item in items})
+
+    def test_band_boundaries(self):
+        # Depression totals 0-27 via items 0-8 (item 8 also drives suicide risk)
+        for total in range(28):
+            answers, left = {}, total
+            for item in range(9):
+                answers[item] = min(3, left)
+                left -= answers[item]
+            self.assertMatchesBaseline(answers)
+
+    def test_batch_scoring_matches_single(self):
+        rng = random.Random(1)
+        answer_sets = [{item: rng.randint(0, 3) for item in range(NUM_ITEMS)} for _ in range(50)]
+        totals = SCORING.score(SCORING.answer_matrix(answer_sets))
+        for row, answers in enumerate(answer_sets):
+            self.assertEqual(list(totals[row]), list(SCORING.score_answers(answers).values()))
+
+
+class RecordAnswerTests(TestCase):
+    def setUp(self):
+        self.questions = {
+            order: Question.objects.create(text=f"Item {order}", question_type='scale', category='depression', order=order)
+            for order in range(1, NUM_ITEMS + 1)
+        }
+        self.assessment = Assessment.objects.create(external_id='a1')
+
+    def test_running_totals(self):
+        self.assessment.record_answer(self.questions[1], 2)
+        self.assertEqual((self.assessment.depression_score, self.assessment.overall_score), (2, 2))
+        # A changed answer applies only the difference
+        self.assessment.record_answer(self.questions[1], 1)
+        self.assessment.record_answer(self.questions[5], 3)
+        self.assertEqual(self.assessment.scores(), {
+            'depression': 4, 'anxiety': 3, 'overall': 4, 'sleep': 0, 'suicide_risk': 0,
+        })
+        self.assertEqual(self.assessment.current_question_index, 5)
+
+    def test_matches_bulk_scoring(self):
+        rng = random.Random(2)
+        answers = {}
+        for _ in range(40):
+            item = rng.randrange(NUM_ITEMS)
+            answers[item] = rng.randint(0, 3)
+            self.assessment.record_answer(self.questions[item + 1], answers[item])
+        self.assertEqual(self.assessment.scores(), SCORING.score_answers(answers))
+
+    def test_follow_up_answers_are_not_scored(self):
+        follow_up = Question.objects.create(text="Tell me more", question_type='text', category='general',
+                                            order=3, is_follow_up=True)
+        self.assessment.record_answer(follow_up, 3, 'A lot')
+        self.assertEqual(self.assessment.overall_score, 0)
+
+    def test_question_nine_escalates_to_crisis(self):
+        self.assertEqual(self.assessment.record_answer(self.questions[9], 1), [])
+        self.assertEqual(self.assessment.status, 'in_progress')
+
+        self.assertEqual(self.assessment.record_answer(self.questions[9], 2), ['suicide_risk'])
+        self.assertEqual((self.assessment.status, self.assessment.risk_level), ('crisis', 'crisis'))
+
+        # Lowering the answer afterwards never clears the escalation
+        self.assessment.record_answer(self.questions[9], 0)
+        self.assertEqual(self.assessment.status, 'crisis')
+
+
+class RecordAnswersTests(TestCase):
+    def setUp(self):
+        for order in range(1, NUM_ITEMS + 1):
+            Question.objects.create(text=f"Item {order}", question_type='scale', category='depression', order=order)
+        self.assessment = Assessment.objects.create(external_id='a1')
+
+    def test_totals_and_crisis(self):
+        crises = self.assessment.record_answers({0: 3, 1: 3, 8: 2})
+        self.assertEqual(crises, ['suicide_risk'])
+        self.assertEqual(self.assessment.depression_score, 8)
+        self.assertEqual(self.assessment.suicidality_score, 2)
+        self.assertEqual(self.assessment.status, 'crisis')
+        self.assertEqual(self.assessment.initial_answers(), {0: 3, 1: 3, 8: 2})
+
+    def test_out_of_range_scores_save_nothing(self):
+        for answers in ({0: 4}, {0: -1}, {0: 1, 1: 7}):
+            with self.assertRaises(ValidationError):
+                self.assessment.record_answers(answers)
+        self.assertFalse(Answer.objects.exists())
+        self.assessment.refresh_from_db()
+        self.assertEqual(self.assessment.overall_score, 0)
+
+    def test_unknown_items_are_skipped(self):
+        self.assessment.record_answers({0: 1, NUM_ITEMS: 3, -1: 9})
+        self.assertEqual(self.assessment.initial_answers(), {0: 1})
+        self.assertEqual(self.assessment.overall_score, 1)
+
+
+class AssessmentAccessTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='x')
+        self.other = User.objects.create_user('other', password='x')
+        Patient.objects.create(user=self.owner, patient_id='P1')
+        Patient.objects.create(user=self.other, patient_id='P2')
+
+    def test_owner_only(self):
+        assessment = Assessment.for_external_id('a1', self.owner)
+        self.assertEqual(assessment.patient.user, self.owner)
+        self.assertEqual(Assessment.for_external_id('a1', self.owner).pk, assessment.pk)
+        for user in (self.other, AnonymousUser(), None):
+            with self.assertRaises(PermissionDenied):
+                Assessment.for_external_id('a1', user)
+
+    def test_anonymous_assessment_is_open(self):
+        assessment = Assessment.for_external_id('a2', AnonymousUser())
+        self.assertIsNone(assessment.patient)
+        self.assertEqual(Assessment.for_external_id('a2', self.other).pk, assessment.pk)
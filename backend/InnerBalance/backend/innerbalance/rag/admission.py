@@ -0,0 +1,96 @@
+"""
+Load-aware admission control in front of the scheduler.
+
+The controller predicts how long a new generation would take from the
+recent generation latency and the scheduler's queue depth. When that would
+breach the latency SLO, requests are answered from the rule-based paths
+instead of joining the queue. Normal service resumes only once the
+prediction is back under a lower threshold and the degraded state has been
+held for a minimum time. The two thresholds and the hold time stop the
+system from flapping between the two modes.
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Dict
+
+import numpy as np
+
+from rag.scheduler import InferenceScheduler, PRIORITIES
+
+
+class AdmissionController:
+    """Degrade to the rule-based answers while the latency SLO cannot be met"""
+
+    def __init__(self, scheduler: InferenceScheduler, slo_seconds: float = 20.0,
+                 recover_ratio: float = 0.7, hold_seconds: float = 10.0,
+                 window_seconds: float = 60.0, min_samples: int = 3):
+        self.scheduler = scheduler
+        self.slo_seconds = slo_seconds
+        self.recover_ratio = recover_ratio
+        self.hold_seconds = hold_seconds
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        # (finished at, seconds) of recent generations
+        self._latencies = deque(maxlen=256)
+        self.degraded = False
+        self._degraded_since = None
+        self.transitions = 0
+        self.admitted = {name: 0 for name in PRIORITIES}
+        self.shed = {name: 0 for name in PRIORITIES}
+
+    def record(self, seconds: float):
+        """Latency of one finished generation, excluding its queue wait"""
+        with self._lock:
+            self._latencies.append((time.monotonic(), seconds))
+
+    def _recent_latency(self, now: float) -> float:
+        while self._latencies and now - self._latencies[0][0] > self.window_seconds:
+            self._latencies.popleft()
+        if len(self._latencies) < self.min_samples:
+            return 0.0
+        return float(np.percentile([seconds for _, seconds in self._latencies], 90))
+
+    def _predicted(self, now: float):
+        """(predicted seconds for a new request, requests already waiting)"""
+        waiting = self.scheduler.waiting()
+        return self._recent_latency(now) * (1 + waiting / self.scheduler.slots), waiting
+
+    def admit(self, priority: str = 'routine') -> bool:
+        """False if the request should be served from the rule-based paths"""
+        now = time.monotonic()
+        with self._lock:
+            predicted, waiting = self._predicted(now)
+            if not self.degraded:
+                # Only a queue can be shed; a slow but idle model is left alone
+                if waiting and predicted > self.slo_seconds:
+                    self.degraded = True
+                    self._degraded_since = now
+                    self.transitions += 1
+            elif now - self._degraded_since >= self.hold_seconds and \
+                    (not waiting or predicted <= self.slo_seconds * self.recover_ratio):
+                self.degraded = False
+                self.transitions += 1
+
+            # Crisis work always reaches the model (it has reserved slots)
+            if self.degraded and priority != 'crisis':
+                self.shed[priority] += 1
+                return False
+            self.admitted[priority] += 1
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            predicted, waiting = self._predicted(now)
+            return {
+                'degraded': self.degraded,
+                'latency_slo_seconds': self.slo_seconds,
+                'predicted_seconds': round(predicted, 3),
+                'recent_p90_seconds': round(self._recent_latency(now), 3),
+                'waiting': waiting,
+                'transitions': self.transitions,
+                'admitted': dict(self.admitted),
+                'shed': dict(self.shed),
+            }
@@ -0,0 +1,79 @@
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any
+
+
+def tokenizers_compatible(draft_tokenizer, target_tokenizer) -> bool:
+    """Assisted generation hands token ids between the models, so vocabularies must match exactly"""
+    return draft_tokenizer.get_vocab() == target_tokenizer.get_vocab()
+
+
+class AssistedDecoder:
+    """
+    Assisted (speculative) generation: a small draft model proposes a few
+    tokens, the generation model verifies them in a single forward pass and
+    keeps the longest agreeing prefix.
+
+    Forward hooks on both models count draft proposals and verification
+    passes during assisted calls. Each verification pass yields its accepted
+    draft tokens plus one token of its own, so
+
+        accepted = new tokens - verification passes
+        acceptance rate = accepted / drafted
+    """
+
+    def __init__(self, draft_model, target_model, tokenizer, num_draft_tokens: int = 5):
+        self.draft_model = draft_model
+        self.tokenizer = tokenizer
+        self.num_draft_tokens = num_draft_tokens
+        self.draft_model.generation_config.num_assistant_tokens = num_draft_tokens
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.new_tokens = 0
+        self.drafted = 0
+        self.verified = 0
+
+        draft_model.register_forward_hook(self._count('draft'))
+        target_model.register_forward_hook(self._count('target'))
+
+    def _count(self, role: str):
+        def hook(module, inputs, output):
+            counts = getattr(self._local, 'counts', None)
+            if counts is not None:
+                counts[role] += 1
+        return hook
+
+    @contextmanager
+    def _tracking(self):
+        self._local.counts = {'draft': 0, 'target': 0}
+        try:
+            yield self._local.counts
+        finally:
+            self._local.counts = None
+
+    def generate(self, pipe, prompt: str, **generate_kwargs) -> str:
+        """Run one prompt through the pipeline with the draft model attached"""
+        with self._tracking() as counts:
+            text = pipe(prompt, assistant_model=self.draft_model, **generate_kwargs)[0]["generated_text"]
+        new_tokens = len(self.tokenizer.encode(text, add_special_tokens=False))
+        with self._lock:
+            self.calls += 1
+            self.new_tokens += new_tokens
+            self.drafted += counts['draft']
+            self.verified += counts['target']
+        return text
+
+    def stats(self) -> Dict[str, Any]:
+        accepted = max(self.new_tokens - self.verified, 0)
+        return {
+            'draft_model': self.draft_model.name_or_path,
+            'num_draft_tokens': self.num_draft_tokens,
+            'calls': self.calls,
+            'new_tokens': self.new_tokens,
+            'drafted_tokens': self.drafted,
+            'verification_passes': self.verified,
+            'acceptance_rate': round(accepted / self.drafted, 3) if self.drafted else None,
+            'tokens_per_verification': round(self.new_tokens / self.verified, 2) if self.verified else None,
+        }
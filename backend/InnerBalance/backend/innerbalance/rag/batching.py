@@ -0,0 +1,191 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from transformers import LogitsProcessor, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+
+
+class _PendingPrompt:
+    def __init__(self, prompt: str, key: Tuple, kwargs: Dict[str, Any], row_kwargs: Dict[str, Any]):
+        self.prompt = prompt
+        self.key = key
+        self.kwargs = kwargs
+        self.row_kwargs = row_kwargs
+        self.future = Future()
+
+
+class _Row:
+    """One request's logits processors and stopping criteria within a merged batch"""
+
+    def __init__(self, row_kwargs: Dict[str, Any]):
+        self.processors = row_kwargs.get('logits_processor')
+        self.criteria = row_kwargs.get('stopping_criteria')
+        self.stopped = False
+
+
+class RowLogitsProcessor(LogitsProcessor):
+    """
+    Apply each request's logits processors to its own row. A row whose
+    stopping criteria have fired may only emit EOS, which finishes it where
+    the unbatched call would have stopped
+    """
+
+    def __init__(self, rows: List[_Row], eos_token_id: int):
+        self.rows = rows
+        self.eos_token_id = eos_token_id
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        scores = scores.clone()
+        for index, row in enumerate(self.rows):
+            if row.stopped:
+                scores[index] = float('-inf')
+                scores[index, self.eos_token_id] = 0.0
+            elif row.processors:
+                scores[index:index + 1] = row.processors(input_ids[index:index + 1], scores[index:index + 1])
+        return scores
+
+
+class RowStoppingCriteria(StoppingCriteria):
+    """Evaluate each request's stopping criteria on its own row; stop once all rows have"""
+
+    def __init__(self, rows: List[_Row]):
+        self.rows = rows
+
+    def __call__(self, input_ids: torch.LongTensor, scores, **kwargs) -> bool:
+        for index, row in enumerate(self.rows):
+            if not row.stopped and row.criteria and bool(row.criteria(input_ids[index:index + 1], scores)):
+                row.stopped = True
+        return all(row.stopped for row in self.rows)
+
+
+class BatchingPipeline:
+    """
+    Dynamic micro-batching in front of a transformers text-generation pipeline.
+
+    Concurrent callers' prompts are collected for up to ``window_ms`` (or until
+    ``max_batch_size`` prompts are waiting), padded together and run through a
+    single batched ``generate`` call. Each caller gets back only its own
+    output, in the same shape the wrapped pipeline would have returned.
+
+    Logits processors and stopping criteria (JSON constraints, deadlines)
+    stay per request: a merged batch applies each request's own to its row.
+    Streamers, a draft model and unhashable arguments bypass the scheduler
+    and run directly.
+    """
+
+    # Streamers and assisted generation only support a batch size of one
+    UNBATCHABLE_KWARGS = ('streamer', 'assistant_model')
+    # Per-request generation state, applied row by row in a merged batch
+    ROW_KWARGS = ('logits_processor', 'stopping_criteria')
+
+    def __init__(self, pipe, window_ms: float = 20.0, max_batch_size: int = 8):
+        self.pipe = pipe
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches_run = 0
+        self.prompts_batched = 0
+
+    def __getattr__(self, name):
+        # Expose task, tokenizer, model, ... of the wrapped pipeline
+        return getattr(self.pipe, name)
+
+    def _batch_key(self, kwargs: Dict[str, Any]) -> Optional[Tuple]:
+        if any(name in kwargs for name in self.UNBATCHABLE_KWARGS):
+            return None
+        key = tuple(sorted((name, value) for name, value in kwargs.items() if name not in self.ROW_KWARGS))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _ensure_scheduler(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='rag-batcher', daemon=True)
+                self._thread.start()
+
+    def __call__(self, text_inputs, **kwargs):
+        single = isinstance(text_inputs, str)
+        row_kwargs = {name: kwargs[name] for name in self.ROW_KWARGS if name in kwargs}
+        key = self._batch_key(kwargs)
+        if key is None or (row_kwargs and not single):
+            # Per-request state cannot be split across several prompts
+            return self.pipe(text_inputs, **kwargs)
+
+        shared = {name: value for name, value in kwargs.items() if name not in self.ROW_KWARGS}
+        prompts = [text_inputs] if single else list(text_inputs)
+        pending = [_PendingPrompt(prompt, key, shared, row_kwargs) for prompt in prompts]
+
+        self._ensure_scheduler()
+        for item in pending:
+            self._queue.put(item)
+
+        results = [item.future.result() for item in pending]
+        return results[0] if single else results
+
+    def _collect(self) -> List[_PendingPrompt]:
+        """Block for the first prompt, then gather more until the window closes"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            groups: Dict[Tuple, List[_PendingPrompt]] = {}
+            for item in self._collect():
+                groups.setdefault(item.key, []).append(item)
+            for items in groups.values():
+                self._execute(items)
+
+    def _row_kwargs(self, items: List[_PendingPrompt]) -> Dict[str, Any]:
+        """Logits processor and stopping criterion applying each item's own to its row"""
+        if not any(item.row_kwargs for item in items):
+            return {}
+        if len(items) == 1:
+            return items[0].row_kwargs
+        rows = [_Row(item.row_kwargs) for item in items]
+        return {
+            'logits_processor': LogitsProcessorList([RowLogitsProcessor(rows, self.pipe.tokenizer.eos_token_id)]),
+            'stopping_criteria': StoppingCriteriaList([RowStoppingCriteria(rows)]),
+        }
+
+    def _execute(self, items: List[_PendingPrompt]):
+        try:
+            outputs = self.pipe(
+                [item.prompt for item in items],
+                batch_size=len(items),
+                **items[0].kwargs,
+                **self._row_kwargs(items)
+            )
+        except Exception as e:
+            for item in items:
+                item.future.set_exception(e)
+            return
+
+        self.batches_run += 1
+        self.prompts_batched += len(items)
+        for item, output in zip(items, outputs):
+            item.future.set_result(output)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'batch_window_ms': self.window * 1000.0,
+            'max_batch_size': self.max_batch_size,
+            'batches_run': self.batches_run,
+            'mean_batch_size': (self.prompts_batched / self.batches_run) if self.batches_run else 0.0,
+        }
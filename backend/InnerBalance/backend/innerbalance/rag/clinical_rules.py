@@ -0,0 +1,263 @@
+import json
+from typing import List, Dict, Any, Iterator
+
+from rag.scoring import SCORING
+
+# Keys every report carries, whether generated or rule-based
+REPORT_FIELDS = (
+    "risk_level", "diagnostic_considerations", "symptom_severity",
+    "clinical_insights", "functional_impact", "recommendations", "crisis_indicators"
+)
+
+
+class ClinicalRules:
+    """Rule-based scoring, question banks and reports that need no models"""
+
+    def analyze_initial_answers(self, answers: Dict[int, int]) -> Dict[str, Any]:
+        """Analyze first 10 answers using clinical scoring"""
+        return self.analysis_from_scores(SCORING.score_answers(answers))
+    
+    def analysis_from_scores(self, scores: Dict[str, int]) -> Dict[str, Any]:
+        """Build the analysis from instrument totals (see rag.scoring.INSTRUMENTS)"""
+        analysis = {
+            "depression_severity": self._score_phq9(scores["depression"]),
+            "anxiety_severity": self._score_gad7(scores["anxiety"]),
+            "sleep_disturbance": SCORING.severity("sleep", scores["sleep"]),
+            "suicide_risk": SCORING.severity("suicide_risk", scores["suicide_risk"]),
+            "primary_concerns": [],
+            "follow_up_focus": []
+        }
+        
+        # Determine primary concerns
+        if SCORING.is_concern("depression", scores["depression"]):
+            analysis["primary_concerns"].append("depression")
+            analysis["follow_up_focus"].extend(["mood_patterns", "anhedonia", "cognitive_symptoms"])
+        
+        if SCORING.is_concern("anxiety", scores["anxiety"]):
+            analysis["primary_concerns"].append("anxiety") 
+            analysis["follow_up_focus"].extend(["worry_patterns", "physical_symptoms", "avoidance"])
+        
+        if SCORING.is_concern("sleep", scores["sleep"]):
+            analysis["primary_concerns"].append("sleep_disturbance")
+            analysis["follow_up_focus"].append("sleep_quality")
+        
+        # If no clear primary concerns, focus on general wellbeing
+        if not analysis["primary_concerns"]:
+            analysis["primary_concerns"].append("general_wellbeing")
+            analysis["follow_up_focus"].extend(["coping_strategies", "support_systems", "life_impact"])
+        
+        return analysis
+    
+    def iter_analysis_buckets(self) -> Iterator[Dict[str, Any]]:
+        """Yield one analysis for every distinct outcome of analyze_initial_answers"""
+        def spread(total: int, items: List[int]) -> Dict[int, int]:
+            answers = {}
+            for item in items:
+                answers[item] = min(3, total)
+                total -= answers[item]
+            return answers
+        
+        sleep_item = SCORING.items("sleep")[0]
+        suicide_item = SCORING.items("suicide_risk")[0]
+        anxiety_items = SCORING.items("anxiety")
+        rest_items = [i for i in SCORING.items("depression")
+                      if i not in anxiety_items and i not in (sleep_item, suicide_item)]
+        
+        seen = set()
+        # Only these sums and single items influence the analysis
+        for sleep in range(4):
+            for suicide in range(4):
+                for anxiety in range(3 * len(anxiety_items) + 1):
+                    for rest in range(3 * len(rest_items) + 1):
+                        answers = {sleep_item: sleep, suicide_item: suicide}
+                        answers.update(spread(anxiety, anxiety_items))
+                        answers.update(spread(rest, rest_items))
+                        analysis = self.analyze_initial_answers(answers)
+                        key = json.dumps(analysis, sort_keys=True)
+                        if key not in seen:
+                            seen.add(key)
+                            yield analysis
+    
+    def _score_phq9(self, score: int) -> str:
+        return SCORING.severity("depression", score)
+    
+    def _score_gad7(self, score: int) -> str:
+        return SCORING.severity("anxiety", score)
+
+    def _get_enhanced_fallback_questions(self, analysis: Dict[str, Any]) -> List[str]:
+        """Provide more personalized fallback questions"""
+        # More specific question banks
+        severe_depression_questions = [
+            "When the weight feels heaviest, what goes through your mind?",
+            "What does a 'better day' look like for you right now, even if it feels far away?",
+            "How has this affected your sense of who you are?",
+            "What keeps you going when everything feels overwhelming?",
+            "If your pain could speak, what would it want me to understand?"
+        ]
+        
+        moderate_depression_questions = [
+            "Can you describe what a typical day looks like for you now compared to before these feelings started?",
+            "What moments, if any, bring you even temporary relief from the heavy feelings?",
+            "How has this affected your relationships with people you care about?",
+            "What would you most want to change about how you're feeling right now?",
+            "When you look ahead, what feels most uncertain or concerning to you?"
+        ]
+        
+        anxiety_focused_questions = [
+            "When anxiety peaks, what physical sensations do you notice in your body?",
+            "Are there specific thoughts that tend to trigger the anxious feelings?",
+            "What situations have you started avoiding because of how they make you feel?",
+            "How does anxiety affect your sleep and morning routine?",
+            "What have you found that provides even brief moments of calm?"
+        ]
+        
+        sleep_focused_questions = [
+            "What's your mind like when you're trying to fall asleep?",
+            "How do you feel when you wake up - rested or something else?",
+            "What happens in the hours before bed that might affect your sleep?",
+            "How does poor sleep impact the following day for you?",
+            "What have you tried that has helped even a little with sleep?"
+        ]
+        
+        # Select questions based on analysis
+        questions = []
+        
+        # Depression severity-based selection
+        if analysis["depression_severity"] in ["severe", "moderately_severe"]:
+            questions.extend(severe_depression_questions[:2])
+        elif analysis["depression_severity"] == "moderate":
+            questions.extend(moderate_depression_questions[:2])
+        
+        # Add anxiety questions if relevant
+        if analysis["anxiety_severity"] in ["moderate", "severe"] and len(questions) < 4:
+            questions.extend(anxiety_focused_questions[:1])
+        
+        # Add sleep questions if relevant
+        if analysis["sleep_disturbance"] in ["moderate", "significant"] and len(questions) < 4:
+            questions.extend(sleep_focused_questions[:1])
+        
+        # Fill remaining slots with general but personalized questions
+        general_fallbacks = [
+            "What would someone who knows you well say has changed most about you?",
+            "If you could wave a magic wand and change one thing, what would it be?",
+            "What small thing still feels meaningful to you?",
+            "How has this experience changed what's important to you?",
+            "What do you wish people understood about what you're going through?"
+        ]
+        
+        while len(questions) < 5:
+            for q in general_fallbacks:
+                if q not in questions and len(questions) < 5:
+                    questions.append(q)
+        
+        return questions[:5]
+    
+    def _get_fallback_questions(self, analysis: Dict[str, Any]) -> List[str]:
+        """Original fallback questions"""
+        question_bank = {
+            "depression": [
+                "How long have you been experiencing these low mood symptoms?",
+                "What activities or interactions still bring you some sense of pleasure or accomplishment?",
+                "How would you describe your energy levels throughout the day?",
+                "Have you noticed changes in your ability to concentrate or make decisions?",
+                "What does your support system look like right now?"
+            ],
+            "anxiety": [
+                "Can you describe what happens in your body when you feel most anxious?",
+                "Are there specific situations or thoughts that trigger these feelings?",
+                "How does anxiety affect your ability to complete daily tasks?",
+                "What techniques have you tried to manage anxious feelings?",
+                "Do you ever experience panic attacks or intense fear episodes?"
+            ],
+            "sleep_disturbance": [
+                "What does your typical sleep routine look like from evening to morning?",
+                "How do you feel when you wake up in the morning?",
+                "Do you find your mind racing when you try to sleep?",
+                "What have you tried to improve your sleep quality?",
+                "How does poor sleep affect your next day?"
+            ],
+            "general_wellbeing": [
+                "How would you describe your overall quality of life right now?",
+                "What aspects of your life are going well despite these challenges?",
+                "What kind of support would be most helpful to you right now?",
+                "How have you coped with difficult times in the past?",
+                "What would you most like to change about how you're feeling?"
+            ]
+        }
+        
+        questions = []
+        for concern in analysis["primary_concerns"]:
+            if concern in question_bank:
+                questions.extend(question_bank[concern][:2])
+        
+        # Fill remaining slots
+        general_questions = question_bank["general_wellbeing"]
+        while len(questions) < 5:
+            for q in general_questions:
+                if q not in questions and len(questions) < 5:
+                    questions.append(q)
+        
+        return questions[:5]
+
+    def _summarize_answers(self, answers: Dict[int, int]) -> str:
+        """Create concise summary of initial answers"""
+        scores = SCORING.score_answers(answers)
+        return ", ".join(
+            f"{label}: {scores[name]}/{SCORING.max_score(name)}"
+            for name, label in (("depression", "Depression"), ("anxiety", "Anxiety"), ("sleep", "Sleep"))
+        )
+    
+    def _validate_report_structure(self, report: Dict[str, Any]) -> Dict[str, Any]:
+        """Ensure report has all required fields"""
+        for field in REPORT_FIELDS:
+            if field not in report:
+                report[field] = "Not specified"
+        
+        return report
+    
+    def _generate_basic_report(self, initial_answers: Dict[int, int], 
+                             follow_up_responses: Dict[str, str]) -> Dict[str, Any]:
+        """Generate basic report without LLM"""
+        analysis = self.analyze_initial_answers(initial_answers)
+        
+        return {
+            "risk_level": analysis["suicide_risk"],
+            "diagnostic_considerations": [
+                f"Potential {concern.replace('_', ' ')}" for concern in analysis["primary_concerns"]
+            ],
+            "symptom_severity": {
+                "depression": analysis["depression_severity"],
+                "anxiety": analysis["anxiety_severity"], 
+                "sleep": analysis["sleep_disturbance"],
+                "overall": "severe" if analysis["suicide_risk"] == "high" else "moderate"
+            },
+            "clinical_insights": [
+                f"Primary concerns: {', '.join(analysis['primary_concerns'])}",
+                f"Follow-up focus areas: {', '.join(analysis['follow_up_focus'])}"
+            ],
+            "functional_impact": "Assessment indicates significant impact on daily functioning",
+            "recommendations": self._generate_basic_recommendations(analysis),
+            "crisis_indicators": ["Suicide risk present"] if analysis["suicide_risk"] == "high" else [],
+            "generated_by": "rules"
+        }
+    
+    def _generate_basic_recommendations(self, analysis: Dict[str, Any]) -> List[str]:
+        """Generate basic clinical recommendations"""
+        recommendations = []
+        
+        if analysis["suicide_risk"] == "high":
+            recommendations.append("🚨 IMMEDIATE: Crisis assessment and safety planning required")
+            recommendations.append("Consider urgent psychiatric evaluation")
+        
+        if analysis["depression_severity"] in ["moderate", "moderately_severe", "severe"]:
+            recommendations.append("Comprehensive depression assessment recommended")
+            recommendations.append("Consider therapy or medication evaluation")
+        
+        if analysis["anxiety_severity"] in ["moderate", "severe"]:
+            recommendations.append("Anxiety management strategies indicated")
+            recommendations.append("Consider cognitive-behavioral therapy")
+        
+        recommendations.append("Review social support systems and coping strategies")
+        recommendations.append("Schedule follow-up within 1-2 weeks")
+        
+        return recommendations
@@ -0,0 +1,143 @@
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any
+
+import numpy as np
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n+')
+
+# Rough characters-per-token ratio used when no tokenizer is loaded
+CHARS_PER_TOKEN = 4
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in SENTENCE_BOUNDARY.split(text) if s.strip()]
+
+
+class ContextPacker:
+    """
+    Assembles prompt context under a token budget counted with the
+    generation model's tokenizer.
+
+    Retrieved documents are split into sentences, scored by cosine
+    similarity to the retrieval query and added best-first while they fit;
+    the chosen sentences are rendered in their original order under their
+    document's heading. Packed results are memoised, since the same query
+    and documents recur across patients.
+    """
+
+    HEADER = "CLINICAL CONTEXT:\n"
+
+    def __init__(self, embeddings, tokenizer=None, cache_size: int = 256):
+        self.embeddings = embeddings
+        self.tokenizer = tokenizer
+        self.cache_size = cache_size
+        self._packed = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count_tokens(self, text: str) -> int:
+        if self.tokenizer is None:
+            return -(-len(text) // CHARS_PER_TOKEN)
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def truncate(self, text: str, budget: int) -> str:
+        """Cut `text` to at most `budget` tokens"""
+        if budget <= 0:
+            return ""
+        if self.tokenizer is None:
+            return text[:budget * CHARS_PER_TOKEN]
+        ids = self.tokenizer.encode(text, add_special_tokens=False)
+        if len(ids) <= budget:
+            return text
+        return self.tokenizer.decode(ids[:budget], skip_special_tokens=True)
+
+    def _score(self, query: str, sentences: List[str]) -> np.ndarray:
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        matrix = np.asarray(self.embeddings.embed_documents(sentences), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query_vector) or 1.0)
+        norms[norms == 0] = 1.0
+        return matrix @ query_vector / norms
+
+    def _render(self, documents: List[Dict[str, str]], sentences, selected) -> str:
+        context = self.HEADER
+        for doc_index, doc in enumerate(documents):
+            chosen = [text for (i, j, text) in sentences if i == doc_index and (i, j) in selected]
+            if chosen:
+                context += f"\n--- {doc['type'].upper()} ---\n"
+                context += " ".join(chosen) + "\n"
+        return context
+
+    def pack_documents(self, query: str, documents: List[Dict[str, str]], budget: int) -> str:
+        """Best-scoring sentences of `documents` for `query` within `budget` tokens"""
+        key = hashlib.sha256(
+            repr((query, budget, [(d['type'], d['content']) for d in documents])).encode('utf-8')
+        ).hexdigest()
+        with self._lock:
+            if key in self._packed:
+                self._packed.move_to_end(key)
+                return self._packed[key]
+
+        sentences = [
+            (doc_index, sentence_index, text)
+            for doc_index, doc in enumerate(documents)
+            for sentence_index, text in enumerate(split_sentences(doc['content']))
+        ]
+        if not sentences:
+            return self.HEADER
+
+        scores = self._score(query, [text for _, _, text in sentences])
+        ranked = [sentences[i] for i in np.argsort(-scores, kind='stable')]
+
+        used = self.count_tokens(self.HEADER)
+        opened = set()
+        selected = []
+        for doc_index, sentence_index, text in ranked:
+            cost = self.count_tokens(text) + 1
+            if doc_index not in opened:
+                cost += self.count_tokens(f"\n--- {documents[doc_index]['type'].upper()} ---\n")
+            if used + cost > budget:
+                continue
+            used += cost
+            opened.add(doc_index)
+            selected.append((doc_index, sentence_index))
+
+        # Per-piece counts can drift from the joined text at the seams
+        context = self._render(documents, sentences, set(selected))
+        while selected and self.count_tokens(context) > budget:
+            selected.pop()
+            context = self._render(documents, sentences, set(selected))
+
+        with self._lock:
+            self._packed[key] = context
+            while len(self._packed) > self.cache_size:
+                self._packed.popitem(last=False)
+        return context
+
+    def pack_items(self, items: List[str], budget: int, separator: str = " | ") -> str:
+        """
+        Keep every item, sharing `budget` between them: short items are kept
+        whole and the remainder is split evenly between the longer ones.
+        """
+        if not items:
+            return ""
+        budget -= self.count_tokens(separator) * (len(items) - 1)
+        costs = [self.count_tokens(item) for item in items]
+        allowance: Dict[int, int] = {}
+        remaining = budget
+        for position, index in enumerate(sorted(range(len(items)), key=costs.__getitem__)):
+            share = remaining // (len(items) - position)
+            allowance[index] = min(costs[index], max(share, 0))
+            remaining -= allowance[index]
+
+        packed = []
+        for index, item in enumerate(items):
+            packed.append(item if allowance[index] >= costs[index] else self.truncate(item, allowance[index]))
+        return separator.join(text for text in packed if text)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'token_counter': 'tokenizer' if self.tokenizer is not None else 'characters',
+            'packed_entries': len(self._packed),
+        }
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import hashlib
+from typing import Any, Callable, Dict, Iterable, Optional
+
+
+def vector_store_version(manifest_path: str, encoder_spec: Dict[str, Any]) -> str:
+    """
+    Hash of the ingestion manifest (files and chunk ids actually in the vector
+    store) and the encoder that embedded them
+    """
+    digest = hashlib.sha256(json.dumps(encoder_spec, sort_keys=True).encode('utf-8'))
+    try:
+        with open(manifest_path, 'rb') as f:
+            digest.update(f.read())
+    except OSError:
+        pass
+    return digest.hexdigest()
+
+
+class ContextTable:
+    """
+    Precomputed retrieval results for every query analyze_initial_answers can
+    produce. Request-time retrieval becomes a dictionary lookup; the table is
+    tagged with the vector store version it was built from.
+    """
+
+    # Seconds between checks for a table rebuilt by another process
+    RELOAD_INTERVAL = 30.0
+    # Bumped when the shape of the stored entries changes
+    FORMAT = 2
+
+    def __init__(self, path: str):
+        self.path = path
+        self.version = None
+        self.entries: Dict[str, Any] = {}
+        self.hits = 0
+        self.misses = 0
+        self._mtime = None
+        self._checked_at = time.monotonic()
+
+    def _file_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def _read(self) -> Optional[Dict]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _maybe_reload(self):
+        """Pick up a table rebuilt by `manage.py ingest_knowledge_base`"""
+        now = time.monotonic()
+        if now - self._checked_at < self.RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+        mtime = self._file_mtime()
+        if mtime is not None and mtime != self._mtime:
+            data = self._read()
+            if data is not None and data.get('format') == self.FORMAT:
+                self.version = data['version']
+                self.entries = data['entries']
+                self._mtime = mtime
+
+    def load(self, expected_version: str) -> bool:
+        """Load the table from disk; False if missing or built from another version"""
+        mtime = self._file_mtime()
+        data = self._read()
+        if data is None or data.get('version') != expected_version or data.get('format') != self.FORMAT:
+            return False
+        self.version = data['version']
+        self.entries = data['entries']
+        self._mtime = mtime
+        return True
+
+    def build(self, queries: Iterable[str], search: Callable[[str], Any], version: str):
+        """Run `search` once per distinct query and persist the results"""
+        self.entries = {query: search(query) for query in sorted(set(queries))}
+        self.version = version
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'format': self.FORMAT, 'version': version, 'entries': self.entries}, f, indent=2)
+        os.replace(tmp_path, self.path)
+        self._mtime = self._file_mtime()
+
+    def get(self, query: str) -> Optional[Any]:
+        self._maybe_reload()
+        context = self.entries.get(query)
+        if context is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return context
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'version': self.version,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
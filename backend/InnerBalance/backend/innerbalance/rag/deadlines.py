@@ -0,0 +1,92 @@
+"""
+Per-request generation deadlines.
+
+Views pass an absolute wall-clock deadline (time.time() seconds, so it
+survives the hop to the model server) down to generation. There it bounds
+the wait for a scheduler slot and stops decoding through a StoppingCriteria,
+so the caller gets whatever was produced in time and can salvage it.
+Generation also stops once the inference executor call it runs in is
+abandoned by its caller (client disconnect or request timeout).
+"""
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+from rag.executor import cancel_event
+
+
+class GenerationDeadline(StoppingCriteria):
+    """Stop decoding once the deadline passes; `hit` records that it did"""
+
+    def __init__(self, at: Optional[float]):
+        self.at = at
+        self.hit = False
+
+    def remaining(self) -> Optional[float]:
+        return None if self.at is None else max(self.at - time.time(), 0.0)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        if self.at is not None and time.time() >= self.at:
+            self.hit = True
+        return self.hit
+
+
+class GenerationCancelled(StoppingCriteria):
+    """Stop decoding once the caller has gone away"""
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        return self.event.is_set()
+
+
+def with_deadline(generate_kwargs: Dict[str, Any], deadline: Optional[GenerationDeadline]) -> Dict[str, Any]:
+    """
+    generate() kwargs with the deadline, and the cancel event of the executor
+    call running on this thread, added to any other stopping criteria
+    """
+    added = []
+    if deadline is not None and deadline.at is not None:
+        added.append(deadline)
+    cancel = cancel_event()
+    if cancel is not None:
+        added.append(GenerationCancelled(cancel))
+    if not added:
+        return generate_kwargs
+    criteria = StoppingCriteriaList(generate_kwargs.get('stopping_criteria') or [])
+    criteria.extend(added)
+    return {**generate_kwargs, 'stopping_criteria': criteria}
+
+
+class DeadlineStats:
+    """How often deadline-bound generations ran out of time, per kind"""
+
+    KINDS = ('follow_up', 'report')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {kind: {'requests': 0, 'hits': 0, 'salvaged': 0} for kind in self.KINDS}
+
+    def record(self, kind: str, deadline: GenerationDeadline, salvaged: bool = False):
+        if deadline.at is None:
+            return
+        with self._lock:
+            counts = self._counts[kind]
+            counts['requests'] += 1
+            if deadline.hit:
+                counts['hits'] += 1
+                counts['salvaged'] += int(salvaged)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                kind: {
+                    **counts,
+                    'hit_rate': round(counts['hits'] / counts['requests'], 3) if counts['requests'] else None,
+                }
+                for kind, counts in self._counts.items()
+            }
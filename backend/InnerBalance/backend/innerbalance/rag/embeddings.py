@@ -0,0 +1,134 @@
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def normalise_text(text: str) -> str:
+    """Cache key for a query: Unicode-normalised with whitespace collapsed"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class SentenceTransformerEncoder:
+    """sentence-transformers on CPU, optionally with int8 dynamic quantisation"""
+
+    def __init__(self, model_path: str, quantize: bool = False):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_path, device='cpu')
+        if quantize:
+            # Linear weights stored as int8; activations quantised on the fly
+            self.model = torch.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+
+
+class OnnxEncoder:
+    """
+    ONNX Runtime export of a sentence-transformers model, loaded from a local
+    directory holding ``model.onnx`` (or ``model_quantized.onnx``) and the
+    tokenizer files. Mean pooling and L2 normalisation match MiniLM's
+    sentence-transformers pipeline.
+    """
+
+    def __init__(self, model_path: str, max_length: int = 256):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        model_file = next(
+            (os.path.join(model_path, name) for name in ("model_quantized.onnx", "model.onnx")
+             if os.path.exists(os.path.join(model_path, name))),
+            None
+        )
+        if model_file is None:
+            raise FileNotFoundError(f"No model.onnx in {model_path}")
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.session = onnxruntime.InferenceSession(model_file, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.max_length = max_length
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        inputs = self.tokenizer(texts, padding=True, truncation=True,
+                                max_length=self.max_length, return_tensors="np")
+        feed = {name: value.astype(np.int64) for name, value in inputs.items() if name in self.input_names}
+        token_embeddings = self.session.run(None, feed)[0]
+
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return pooled / norms
+
+
+def load_encoder(backend: str = "sentence_transformers", model_path: str = DEFAULT_EMBEDDING_MODEL):
+    """Build the encoder described by an EmbeddingService spec"""
+    if backend == "onnx":
+        return OnnxEncoder(model_path)
+    if backend in ("sentence_transformers", "int8"):
+        return SentenceTransformerEncoder(model_path, quantize=backend == "int8")
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+class EmbeddingService:
+    """
+    LangChain-compatible embeddings (``embed_query`` / ``embed_documents``)
+    over a pluggable encoder.
+
+    Query vectors are kept in an LRU keyed by normalised text, since most
+    retrieval queries repeat exactly. Documents are encoded in fixed-size
+    batches.
+    """
+
+    def __init__(self, backend: str = "sentence_transformers", model_path: Optional[str] = None,
+                 batch_size: int = 64, query_cache_size: int = 2048):
+        self.spec = {"backend": backend, "model_path": model_path or DEFAULT_EMBEDDING_MODEL}
+        self.encoder = load_encoder(**self.spec)
+        self.batch_size = batch_size
+        self.query_cache_size = query_cache_size
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self.encoder.encode(list(texts[start:start + self.batch_size])).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalise_text(text)
+        with self._lock:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+                self.hits += 1
+                return list(vector)
+            self.misses += 1
+
+        vector = self.encoder.encode([key])[0].tolist()
+        if self.query_cache_size:
+            with self._lock:
+                self._queries[key] = vector
+                while len(self._queries) > self.query_cache_size:
+                    self._queries.popitem(last=False)
+        return list(vector)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.spec,
+            "batch_size": self.batch_size,
+            "query_cache_entries": len(self._queries),
+            "query_cache_hits": self.hits,
+            "query_cache_misses": self.misses,
+        }
@@ -0,0 +1,275 @@
+import os
+import time
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Iterator
+
+from rag.clinical_rules import ClinicalRules
+
+logger = logging.getLogger(__name__)
+
+
+class RAGEngine:
+    """
+    Process-wide handle around MeditronRAGSystem.
+
+    The system is built lazily in a background thread so that importing the
+    API (migrations, management commands, admin workers) never loads torch or
+    the models. Until the system is ready every call is answered from the
+    rule-based paths in ClinicalRules.
+    """
+
+    COLD = 'cold'
+    WARMING = 'warming'
+    READY = 'ready'
+    DEGRADED = 'degraded'
+
+    # Seconds to wait before retrying a warm-up that failed outright
+    RETRY_AFTER = 30.0
+
+    def __init__(self, factory=None):
+        self._factory = factory or self._build_system
+        self._lock = threading.Lock()
+        self.rules = ClinicalRules()
+        self._reset()
+
+    def _reset(self):
+        self._thread = None
+        self._pid = os.getpid()
+        self._state = self.COLD
+        self._system = None
+        self._error = None
+        self._warmup_started = None
+        self._warmup_seconds = None
+        self._failed_at = None
+        self._description = {}
+
+    def _build_system(self):
+        from django.conf import settings
+
+        socket_path = settings.RAG_ENGINE.get('MODEL_SERVER_SOCKET')
+        if socket_path:
+            from rag.model_server import RemoteRAGSystem
+            return RemoteRAGSystem(socket_path, timeout=settings.RAG_ENGINE.get('MODEL_SERVER_TIMEOUT', 120.0))
+
+        from rag.meditron_rag import MeditronRAGSystem
+        return MeditronRAGSystem(config=settings.RAG_ENGINE)
+
+    def _check_fork(self):
+        """Forget state inherited from a parent process (e.g. gunicorn --preload)"""
+        if self._pid != os.getpid():
+            self._lock = threading.Lock()
+            self._reset()
+
+    @property
+    def state(self) -> str:
+        self._check_fork()
+        return self._state
+
+    def start_warmup(self) -> bool:
+        """Start building the system in a background thread if nobody has yet"""
+        self._check_fork()
+        with self._lock:
+            if self._state != self.COLD:
+                return False
+            self._state = self.WARMING
+            self._warmup_started = time.monotonic()
+            self._thread = threading.Thread(target=self._warm, name='rag-warmup', daemon=True)
+            self._thread.start()
+            return True
+
+    def _warm(self):
+        try:
+            system = self._factory()
+            system.warmup()
+        except Exception as e:
+            logger.exception("RAG engine failed to warm up")
+            with self._lock:
+                self._error = str(e)
+                self._state = self.DEGRADED
+                self._failed_at = time.monotonic()
+                self._warmup_seconds = self._failed_at - self._warmup_started
+            return
+
+        description = system.describe()
+        with self._lock:
+            self._system = system
+            self._description = description
+            self._error = None
+            self._state = self.READY if description.get('llm_loaded') else self.DEGRADED
+            self._warmup_seconds = time.monotonic() - self._warmup_started
+        logger.info(f"RAG engine {self._state} after {self._warmup_seconds:.1f}s")
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """Block until warm-up has finished (used by management commands)"""
+        self.start_warmup()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return self._system is not None
+
+    def acquire(self):
+        """Return the loaded system, or None while it is still cold or warming"""
+        state = self.state
+        if state == self.DEGRADED and self._system is None:
+            if time.monotonic() - self._failed_at >= self.RETRY_AFTER:
+                with self._lock:
+                    if self._state == self.DEGRADED and self._system is None:
+                        self._state = self.COLD
+                state = self.COLD
+        if state == self.COLD:
+            self.start_warmup()
+        return self._system
+
+    def analyze_initial_answers(self, answers: Dict[int, int]) -> Dict[str, Any]:
+        return self.rules.analyze_initial_answers(answers)
+    
+    def analysis_from_scores(self, scores: Dict[str, int]) -> Dict[str, Any]:
+        return self.rules.analysis_from_scores(scores)
+
+    def generate_follow_up_questions(self, analysis: Dict[str, Any], priority: Optional[str] = None,
+                                     deadline: Optional[float] = None) -> List[str]:
+        return self.generate_follow_up(analysis, priority, deadline)['questions']
+
+    def generate_follow_up(self, analysis: Dict[str, Any], priority: Optional[str] = None,
+                           deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        {'questions', 'generated_by'}; `priority` (see rag.scheduler) defaults
+        to the analysis' own, `deadline` (time.time() seconds) bounds generation
+        """
+        system = self.acquire()
+        if system is not None:
+            try:
+                return system.generate_follow_up(analysis, priority=priority, deadline=deadline)
+            except Exception:
+                logger.exception("Follow-up generation failed; using rule-based questions")
+        return {'questions': self.rules._get_enhanced_fallback_questions(analysis), 'generated_by': 'rules'}
+
+    def generate_comprehensive_report(self, initial_answers: Dict[int, int],
+                                      follow_up_responses: Dict[str, str],
+                                      priority: Optional[str] = None,
+                                      admission: bool = True,
+                                      deadline: Optional[float] = None,
+                                      analysis: Optional[Dict[str, Any]] = None,
+                                      context_documents: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+        """`analysis` and `context_documents` from the follow-up step skip recomputing them"""
+        system = self.acquire()
+        if system is not None:
+            try:
+                return system.generate_comprehensive_report(initial_answers, follow_up_responses,
+                                                            priority=priority, admission=admission,
+                                                            deadline=deadline, analysis=analysis,
+                                                            context_documents=context_documents)
+            except Exception:
+                logger.exception("Report generation failed; using rule-based report")
+        return self.rules._generate_basic_report(initial_answers, follow_up_responses)
+
+    def fallback_follow_up_questions(self, analysis: Dict[str, Any]) -> List[str]:
+        """Rule-based questions, for callers that cannot wait for the models"""
+        return self.rules._get_enhanced_fallback_questions(analysis)
+
+    def fallback_report(self, initial_answers: Dict[int, int],
+                        follow_up_responses: Dict[str, str]) -> Dict[str, Any]:
+        """Rule-based report, for callers that cannot wait for the models"""
+        return self.rules._generate_basic_report(initial_answers, follow_up_responses)
+
+    def stream_follow_up_questions(self, analysis: Dict[str, Any],
+                                   priority: Optional[str] = None,
+                                   deadline: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """Yield token/question/done events; rule-based questions if not ready"""
+        system = self.acquire()
+        if system is not None:
+            done = False
+            try:
+                for event in system.stream_follow_up_questions(analysis, priority=priority, deadline=deadline):
+                    done = done or event['event'] == 'done'
+                    yield event
+                if done:
+                    return
+            except Exception:
+                logger.exception("Follow-up streaming failed; using rule-based questions")
+
+        questions = self.rules._get_enhanced_fallback_questions(analysis)
+        for question in questions:
+            yield {'event': 'question', 'data': question}
+        yield {'event': 'done', 'data': {'follow_up_questions': questions, 'generated_by': 'rules'}}
+
+    def stream_comprehensive_report(self, initial_answers: Dict[int, int],
+                                    follow_up_responses: Dict[str, str],
+                                    priority: Optional[str] = None,
+                                    deadline: Optional[float] = None,
+                                    analysis: Optional[Dict[str, Any]] = None,
+                                    context_documents: Optional[List[Dict[str, str]]] = None
+                                    ) -> Iterator[Dict[str, Any]]:
+        """Yield token/done events; the rule-based report if not ready"""
+        system = self.acquire()
+        if system is not None:
+            done = False
+            try:
+                for event in system.stream_comprehensive_report(initial_answers, follow_up_responses,
+                                                                priority=priority, deadline=deadline,
+                                                                analysis=analysis,
+                                                                context_documents=context_documents):
+                    done = done or event['event'] == 'done'
+                    yield event
+                if done:
+                    return
+            except Exception:
+                logger.exception("Report streaming failed; using rule-based report")
+
+        report = self.rules._generate_basic_report(initial_answers, follow_up_responses)
+        yield {'event': 'done', 'data': {'report': report}}
+
+    def status(self) -> Dict[str, Any]:
+        """Readiness information for the system-status endpoint"""
+        state = self.state
+        system = self._system
+        if system is not None:
+            try:
+                self._description = system.describe()
+            except Exception as e:
+                self._error = str(e)
+
+        status_info = {
+            'state': state,
+            'llm_loaded': False,
+            'vector_store_ready': system is not None,
+            'knowledge_base_items': 0,
+            'warmup_seconds': self._warmup_seconds,
+            'error': self._error,
+        }
+        status_info.update(self._description)
+        return status_info
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> RAGEngine:
+    """Return the process-wide RAG engine, creating it on first use"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RAGEngine()
+    return _engine
+
+
+def warm_on_server_start():
+    """Kick off background warm-up from the WSGI/ASGI entry points"""
+    # Under gunicorn the application may be imported in the master
+    # (--preload), which would load the models there only for every forked
+    # worker to discard them and load its own; gunicorn.conf.py warms each
+    # worker from post_worker_init instead.
+    if os.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn/'):
+        return
+    warm_worker()
+
+
+def warm_worker():
+    """Start warm-up in this process, unless RAG_ENGINE disables it"""
+    from django.conf import settings
+
+    if settings.RAG_ENGINE.get('WARMUP_ON_START', True):
+        get_engine().start_warmup()
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+
+class InferenceExecutor:
+    """
+    Bounded thread pool that async views hand RAG engine calls to.
+
+    The event loop only holds the waiting connections; at most `max_workers`
+    calls run at once and the rest queue here. Threads rather than processes
+    keep a single copy of the models, and concurrent calls still meet in the
+    request batcher. A call still queued when its caller gives up (deadline or
+    client disconnect) is dropped without running; a running one has its
+    cancel event set, which stops generation at the next token.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        # Calls cancelled before they started
+        self.dropped = 0
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        # Pool threads do not survive a fork (e.g. gunicorn --preload)
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='rag-inference')
+                self._pid = os.getpid()
+            self.submitted += 1
+            return self._pool
+
+    def _call(self, fn: Callable, args, kwargs, cancel: threading.Event):
+        with self._lock:
+            self.started += 1
+        _current.cancel = cancel
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.cancel = None
+            with self._lock:
+                self.completed += 1
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        Await fn(*args, **kwargs) on the pool. Raises asyncio.TimeoutError past
+        `timeout` seconds. When the caller times out or is cancelled, a call
+        that is already running is asked to stop through cancel_event() and
+        its result is discarded.
+        """
+        cancel = threading.Event()
+        future = self._get_pool().submit(self._call, fn, args, kwargs, cancel)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            self._abandon(future, cancel)
+            with self._lock:
+                self.timed_out += 1
+            raise
+        except asyncio.CancelledError:
+            self._abandon(future, cancel)
+            with self._lock:
+                self.cancelled += 1
+            raise
+
+    def _abandon(self, future, cancel: threading.Event):
+        cancel.set()
+        if future.cancel():
+            with self._lock:
+                self.dropped += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'running': self.started - self.completed,
+                'queued': self.submitted - self.started - self.dropped,
+                'completed': self.completed,
+                'timed_out': self.timed_out,
+                'cancelled': self.cancelled,
+                'dropped': self.dropped,
+            }
+
+
+_current = threading.local()
+
+
+def cancel_event() -> Optional[threading.Event]:
+    """The cancel event of the executor call running on this thread, if any"""
+    return getattr(_current, 'cancel', None)
+
+
+def cancelled() -> bool:
+    """Whether the caller of the executor call on this thread has given up"""
+    event = cancel_event()
+    return event is not None and event.is_set()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> InferenceExecutor:
+    """Return the process-wide inference executor, creating it on first use"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                from django.conf import settings
+
+                _executor = InferenceExecutor(settings.RAG_ENGINE.get('INFERENCE_WORKERS') or None)
+    return _executor
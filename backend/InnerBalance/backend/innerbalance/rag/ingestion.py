@@ -0,0 +1,293 @@
+import os
+import json
+import time
+import hashlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Tuple, Iterator, Optional
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# Document type recorded in chunk metadata, by top-level knowledge base folder
+DOCUMENT_TYPES = {
+    "clinical_guidelines": "clinical_guideline",
+    "assessment_tools": "assessment_tool",
+    "diagnostic_criteria": "assessment_tool",
+}
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def discover_files(knowledge_base_path: str) -> List[str]:
+    """Every non-hidden file under the knowledge base, relative and sorted"""
+    found = []
+    for root, dirs, files in os.walk(knowledge_base_path):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            if not name.startswith('.'):
+                found.append(os.path.relpath(os.path.join(root, name), knowledge_base_path))
+    return sorted(found)
+
+
+def read_document(knowledge_base_path: str, rel_path: str) -> Document:
+    """Load one knowledge base file as a LangChain document"""
+    with open(os.path.join(knowledge_base_path, rel_path), 'r', encoding='utf-8') as f:
+        content = f.read()
+    if rel_path.endswith('.json'):
+        content = json.dumps(json.loads(content), indent=2)
+
+    folder = rel_path.split(os.sep)[0]
+    return Document(
+        page_content=content,
+        metadata={"source": rel_path, "type": DOCUMENT_TYPES.get(folder, folder)}
+    )
+
+
+def chunk_ids(rel_path: str, chunks: List[Document]) -> List[str]:
+    """Content-addressed chunk ids; repeated chunks in one file get an occurrence suffix"""
+    ids = []
+    seen = {}
+    for chunk in chunks:
+        base = hashlib.sha256(f"{rel_path}\0{chunk.page_content}".encode('utf-8')).hexdigest()[:32]
+        seen[base] = seen.get(base, 0) + 1
+        ids.append(base if seen[base] == 1 else f"{base}-{seen[base]}")
+    return ids
+
+
+def read_manifest(manifest_path: str) -> Dict[str, Any]:
+    """The ingestion manifest, or an empty one"""
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"files": {}}
+
+
+def encoder_changed(manifest: Dict[str, Any], encoder_spec: Optional[Dict[str, Any]]) -> bool:
+    """Whether the manifest's chunks were embedded by a different (or unrecorded) encoder"""
+    return bool(manifest["files"]) and encoder_spec is not None and manifest.get("encoder") != encoder_spec
+
+
+# Per-process encoder for the embedding pool, loaded once by _init_encoder
+_encoder = None
+
+
+def _init_encoder(encoder_spec: Dict[str, Any]):
+    global _encoder
+    import torch
+    from rag.embeddings import load_encoder
+
+    # One intra-op thread per worker process; the pool provides the parallelism
+    torch.set_num_threads(1)
+    _encoder = load_encoder(**encoder_spec)
+
+
+def _encode_batch(texts: List[str]) -> List[List[float]]:
+    return _encoder.encode(texts).tolist()
+
+
+class KnowledgeBaseIngestor:
+    """
+    Incremental knowledge base ingestion driven by a manifest of per-file and
+    per-chunk content hashes. Only new or changed chunks are embedded; chunks
+    that disappeared are deleted from the vector store. The manifest also
+    records the encoder spec, and a different encoder re-encodes everything.
+
+    Ingestion is a streaming pipeline: a file reader generator feeds the text
+    splitter, new chunks are grouped into batches, encoded on a process pool
+    (or in-process when ``workers`` is 0) and written to the vector store in
+    bulk. At most ``2 * workers`` batches are in flight, so peak memory does
+    not grow with corpus size.
+    """
+
+    def __init__(self, vector_store, knowledge_base_path: str, manifest_path: str,
+                 embeddings=None, encoder_spec: Optional[Dict[str, Any]] = None,
+                 chunk_size: int = 1000, chunk_overlap: int = 200,
+                 batch_size: int = 64, workers: int = 0):
+        self.vector_store = vector_store
+        self.knowledge_base_path = knowledge_base_path
+        self.manifest_path = manifest_path
+        self.embeddings = embeddings
+        self.encoder_spec = encoder_spec
+        self.batch_size = batch_size
+        self.workers = workers
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap
+        )
+
+    def load_manifest(self) -> Dict[str, Any]:
+        return read_manifest(self.manifest_path)
+
+    def save_manifest(self, manifest: Dict[str, Any]):
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _untracked_ids(self) -> List[str]:
+        """Vectors written before the manifest existed cannot be diffed"""
+        return self.vector_store.get(include=[])['ids']
+
+    def split_file(self, rel_path: str) -> Tuple[List[str], List[Document]]:
+        chunks = self.text_splitter.split_documents([read_document(self.knowledge_base_path, rel_path)])
+        return chunk_ids(rel_path, chunks), chunks
+
+    def write_embeddings(self, ids: List[str], chunks: List[Document], vectors: List[List[float]]):
+        """Bulk write of pre-computed embeddings (upsert keeps re-runs idempotent)"""
+        if hasattr(self.vector_store, 'upsert_embeddings'):
+            self.vector_store.upsert_embeddings(
+                ids, vectors,
+                [chunk.page_content for chunk in chunks],
+                [chunk.metadata for chunk in chunks]
+            )
+            return
+        self.vector_store._collection.upsert(
+            ids=ids,
+            embeddings=vectors,
+            documents=[chunk.page_content for chunk in chunks],
+            metadatas=[chunk.metadata for chunk in chunks]
+        )
+
+    def delete_chunks(self, ids: List[str]):
+        if ids:
+            self.vector_store.delete(ids=ids)
+
+    def clear_store(self):
+        """Drop every vector; another encoder's vectors may not even share their dimensionality"""
+        if hasattr(self.vector_store, 'clear'):
+            self.vector_store.clear()
+            return
+        # A Chroma collection keeps its dimensionality once created; recreate it empty
+        client, collection = self.vector_store._client, self.vector_store._collection
+        client.delete_collection(collection.name)
+        self.vector_store._collection = client.get_or_create_collection(
+            name=collection.name, embedding_function=None, metadata=collection.metadata
+        )
+
+    def _read_changed_files(self, manifest: Dict[str, Any], current: List[str],
+                            report: Dict[str, Any]) -> Iterator[Tuple[str, str, Optional[Dict[str, Any]]]]:
+        """Stage 1: yield (path, sha256, previous manifest entry) for new or changed files"""
+        for rel_path in current:
+            sha = file_sha256(os.path.join(self.knowledge_base_path, rel_path))
+            previous = manifest["files"].get(rel_path)
+            if previous and previous["sha256"] == sha:
+                report["unchanged_files"].append(rel_path)
+                continue
+            yield rel_path, sha, previous
+
+    def _split_new_chunks(self, changed_files, manifest: Dict[str, Any],
+                          report: Dict[str, Any]) -> Iterator[Tuple[str, Document]]:
+        """Stage 2: split each file, drop its vanished chunks and yield only new ones"""
+        for rel_path, sha, previous in changed_files:
+            try:
+                ids, chunks = self.split_file(rel_path)
+            except (UnicodeDecodeError, ValueError) as e:
+                print(f"⚠️ Skipping {rel_path}: {e}")
+                report["failed_files"].append(rel_path)
+                continue
+
+            old_ids = set(previous["chunks"]) if previous else set()
+            removed = sorted(old_ids - set(ids))
+            self.delete_chunks(removed)
+            manifest["files"][rel_path] = {"sha256": sha, "chunks": ids}
+
+            report["changed_files" if previous else "added_files"].append(rel_path)
+            report["chunks_removed"] += len(removed)
+            for chunk_id, chunk in zip(ids, chunks):
+                if chunk_id not in old_ids:
+                    yield chunk_id, chunk
+
+    def _batches(self, chunks: Iterator[Tuple[str, Document]]) -> Iterator[List[Tuple[str, Document]]]:
+        """Stage 3: group chunks into fixed-size embedding batches"""
+        batch = []
+        for item in chunks:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _embed_and_write(self, batches: Iterator[List[Tuple[str, Document]]]) -> int:
+        """Stages 4 and 5: encode batches (optionally in a process pool) and bulk-write them"""
+        written = 0
+
+        def write(batch, vectors):
+            self.write_embeddings([i for i, _ in batch], [c for _, c in batch], vectors)
+            return len(batch)
+
+        if self.workers <= 0:
+            for batch in batches:
+                vectors = self.embeddings.embed_documents([c.page_content for _, c in batch])
+                written += write(batch, vectors)
+            return written
+
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                 initializer=_init_encoder,
+                                 initargs=(self.encoder_spec,)) as pool:
+            in_flight = deque()
+            for batch in batches:
+                in_flight.append((batch, pool.submit(_encode_batch, [c.page_content for _, c in batch])))
+                if len(in_flight) >= 2 * self.workers:
+                    done_batch, future = in_flight.popleft()
+                    written += write(done_batch, future.result())
+            while in_flight:
+                done_batch, future = in_flight.popleft()
+                written += write(done_batch, future.result())
+        return written
+
+    def ingest(self, rebuild: bool = False) -> Dict[str, Any]:
+        """Bring the vector store in line with the knowledge base; returns what changed"""
+        started = time.monotonic()
+        manifest = self.load_manifest()
+        report = {
+            "added_files": [], "changed_files": [], "removed_files": [], "unchanged_files": [],
+            "failed_files": [], "chunks_added": 0, "chunks_removed": 0,
+            "encoder_changed": encoder_changed(manifest, self.encoder_spec),
+        }
+
+        if rebuild or report["encoder_changed"]:
+            if report["encoder_changed"]:
+                print(f"🔄 Encoder changed ({manifest.get('encoder')} -> {self.encoder_spec}); "
+                      "re-encoding every chunk")
+            report["chunks_removed"] += len(self._untracked_ids())
+            self.clear_store()
+            manifest = {"files": {}}
+        elif not manifest["files"]:
+            stale = self._untracked_ids()
+            self.delete_chunks(stale)
+            report["chunks_removed"] += len(stale)
+
+        current = discover_files(self.knowledge_base_path)
+        changed_files = self._read_changed_files(manifest, current, report)
+        new_chunks = self._split_new_chunks(changed_files, manifest, report)
+        report["chunks_added"] = self._embed_and_write(self._batches(new_chunks))
+
+        for rel_path in sorted(set(manifest["files"]) - set(current)):
+            removed = manifest["files"].pop(rel_path)["chunks"]
+            self.delete_chunks(removed)
+            report["removed_files"].append(rel_path)
+            report["chunks_removed"] += len(removed)
+
+        if hasattr(self.vector_store, 'persist'):
+            self.vector_store.persist()
+        if self.encoder_spec is not None:
+            manifest["encoder"] = self.encoder_spec
+        self.save_manifest(manifest)
+
+        elapsed = time.monotonic() - started
+        report["elapsed_seconds"] = round(elapsed, 3)
+        report["chunks_per_second"] = round(report["chunks_added"] / elapsed, 1) if elapsed > 0 else 0.0
+        report["changed"] = bool(report["chunks_added"] or report["chunks_removed"])
+        return report
@@ -1,85 +1,309 @@
 import os
 import json
+import time
+import hashlib
 import torch
-from typing import List, Dict, Any
-from langchain.schema import Document
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterator
 
 from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.llms import HuggingFacePipeline
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from transformers import (
     AutoTokenizer, 
     AutoModelForCausalLM, 
     pipeline,
-    BitsAndBytesConfig
+    TextIteratorStreamer
 )
 
-class MeditronRAGSystem:
-    def __init__(self):
+from rag.clinical_rules import ClinicalRules, REPORT_FIELDS
+from rag.batching import BatchingPipeline
+from rag.streaming import QuestionStreamParser
+from rag.question_cache import QuestionCache, analysis_fingerprint
+from rag.context_table import ContextTable, vector_store_version
+from rag.ingestion import KnowledgeBaseIngestor, encoder_changed, read_manifest
+from rag.numpy_store import NumpyVectorStore
+from rag.structured import json_constraints, repair_json, token_texts
+from rag.assisted import AssistedDecoder, tokenizers_compatible
+from rag.prefix_cache import PrefixKVCache, static_prefix
+from rag.context_packer import ContextPacker
+from rag.embeddings import EmbeddingService
+from rag.scheduler import InferenceScheduler, priority_for
+from rag.admission import AdmissionController
+from rag.routing import SeverityRouter
+from rag.deadlines import GenerationDeadline, DeadlineStats, with_deadline
+from rag.executor import cancelled
+
+# Defaults for the RAG_ENGINE settings dict
+DEFAULT_CONFIG = {
+    # Micro-batching of concurrent generations (0 disables batching)
+    'BATCH_WINDOW_MS': 20,
+    'BATCH_MAX_SIZE': 8,
+    # Generation model precision: 'auto' (fp16 on GPU, bf16 on CPU), 'fp16',
+    # 'fp32', 'bf16' or 'int8' (dynamic quantisation of Linear layers, CPU).
+    # distilgpt2 (fallback, draft or small route) stays fp32 on CPU
+    'INFERENCE_PRECISION': 'auto',
+    # Vector index backend: 'chroma' or 'numpy' (memory-mapped brute force)
+    'VECTOR_BACKEND': 'chroma',
+    # Knowledge base ingestion: chunks per embedding batch and encoder
+    # processes (0 embeds in-process)
+    'INGEST_BATCH_SIZE': 64,
+    'INGEST_WORKERS': 0,
+    # Greedy decoding for follow-up questions so cached entries are reusable
+    'DETERMINISTIC_QUESTIONS': True,
+    # Constrain question and report generation to their JSON schema and stop
+    # as soon as the answer is complete
+    'STRUCTURED_DECODING': True,
+    # Assisted generation: a small draft model proposes DRAFT_TOKENS tokens per
+    # step for the generation model to verify. Must share its tokenizer (None
+    # disables)
+    'DRAFT_MODEL': None,
+    'DRAFT_TOKENS': 5,
+    # Keep past_key_values for each prompt template's static instruction
+    # block so only the per-patient suffix is prefilled. Prefix-cached
+    # generations run one at a time, so the cache is only used when
+    # micro-batching is off (BATCH_WINDOW_MS 0)
+    'PREFIX_CACHE': False,
+    # Documents retrieved per query, and token budgets (counted with the
+    # generation model's tokenizer) for each part of the assembled prompts
+    'RETRIEVAL_K': 4,
+    # Sentence embeddings: BACKEND 'sentence_transformers', 'int8' (dynamic
+    # quantisation) or 'onnx' (ONNX Runtime, MODEL_PATH must be a local
+    # export); MODEL_PATH None uses all-MiniLM-L6-v2 from the hub
+    'EMBEDDINGS': {
+        'BACKEND': 'sentence_transformers',
+        'MODEL_PATH': None,
+        'BATCH_SIZE': 64,
+        'QUERY_CACHE_SIZE': 2048,
+    },
+    'CONTEXT_BUDGETS': {
+        'FOLLOW_UP_CONTEXT': 384,
+        'REPORT_CONTEXT': 256,
+        'REPORT_ANSWERS': 384,
+    },
+    # Priority admission to the model: SLOTS concurrent generations (0 = one
+    # per batch position when generations are batched, else 1) plus
+    # crisis-only slots; a waiter gains one priority class per AGING_SECONDS
+    # spent queued
+    'SCHEDULER': {
+        'SLOTS': 0,
+        'RESERVED_CRISIS_SLOTS': 1,
+        'AGING_SECONDS': 10.0,
+    },
+    # Serve non-crisis requests from the rule-based paths while the queue
+    # would push generation past LATENCY_SLO_SECONDS; resume below
+    # RECOVER_RATIO of the SLO after at least HOLD_SECONDS (None disables)
+    'ADMISSION': {
+        'LATENCY_SLO_SECONDS': 20.0,
+        'RECOVER_RATIO': 0.7,
+        'HOLD_SECONDS': 10.0,
+        'WINDOW_SECONDS': 60.0,
+    },
+    # Severity routing (see rag.routing): ROUTES maps each severity tier to the
+    # 'template' engine, the SMALL_MODEL or the 'large' generation model, and
+    # the small model's prompts get its own budgets for its 1k window (None
+    # sends everything to the generation model)
+    'ROUTING': {
+        'SMALL_MODEL': 'distilgpt2',
+        'ROUTES': None,
+        'SMALL_CONTEXT_BUDGETS': {
+            'FOLLOW_UP_CONTEXT': 192,
+            'REPORT_CONTEXT': 128,
+            'REPORT_ANSWERS': 192,
+        },
+    },
+    # Follow-up question cache keyed on the analysis fingerprint (None disables)
+    'QUESTION_CACHE': {
+        'MAX_ENTRIES': 1024,
+        'TTL_SECONDS': 7 * 24 * 3600,
+        'DISK_PATH': None,
+    },
+}
+
+class MeditronRAGSystem(ClinicalRules):
+    def __init__(self, config: Dict[str, Any] = None, load_llm: bool = True,
+                 load_context_table: bool = True):
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
         self.knowledge_base_path = "rag/knowledge_base/"
         self.vector_db_path = "rag/vector_store/chroma_db/"
+        self.numpy_index_path = "rag/vector_store/numpy_index/"
+        self.manifest_path = "rag/vector_store/manifest.json"
+        self.context_table_path = "rag/vector_store/context_table.json"
+        self.model_precisions = {}
         
         # Initialize components
+        self.setup_router()
         self.setup_embeddings()
         self.setup_vector_store()
-        self.setup_meditron_llm()
+        self.context_table = None
+        if load_context_table:
+            self.setup_context_table()
+        self.assisted = None
+        self.small_pipe = None
+        if load_llm:
+            self.setup_meditron_llm()
+            self.setup_draft_model()
+            self.setup_small_model()
+        else:
+            # Retrieval-only (ingestion and maintenance commands)
+            self.llm = None
+        self.setup_context_packer()
         self.setup_prompts()
+        self.setup_prefix_cache()
+        self.setup_question_cache()
+        # Slots depend on whether the loaded models batch their generations
+        self.setup_scheduler()
         
+    def setup_scheduler(self):
+        """Admit generations by clinical priority (see rag.scheduler)"""
+        config = {**DEFAULT_CONFIG['SCHEDULER'], **(self.config['SCHEDULER'] or {})}
+        slots = config['SLOTS'] or (self.config['BATCH_MAX_SIZE'] if self._batches_generations() else 1)
+        self.scheduler = InferenceScheduler(
+            slots=slots,
+            reserved_crisis_slots=config['RESERVED_CRISIS_SLOTS'],
+            aging_seconds=config['AGING_SECONDS'],
+        )
+        
+        self.deadline_stats = DeadlineStats()
+        self.admission = None
+        if self.config['ADMISSION'] is not None:
+            config = {**DEFAULT_CONFIG['ADMISSION'], **self.config['ADMISSION']}
+            self.admission = AdmissionController(
+                self.scheduler,
+                slo_seconds=config['LATENCY_SLO_SECONDS'],
+                recover_ratio=config['RECOVER_RATIO'],
+                hold_seconds=config['HOLD_SECONDS'],
+                window_seconds=config['WINDOW_SECONDS'],
+            )
+    
+    def _batches_generations(self) -> bool:
+        """
+        Whether concurrent generations reach the micro-batcher. The prefix
+        cache and assisted decoding call the model directly, so concurrent
+        calls would only compete for the same cores
+        """
+        return isinstance(getattr(self, 'pipe', None), BatchingPipeline) and \
+            self.assisted is None and self.prefix_cache is None
+    
+    def _admit(self, priority: str) -> bool:
+        return self.admission is None or self.admission.admit(priority)
+    
+    def setup_router(self):
+        """Setup severity routing between the template engine and the models"""
+        self.router = None
+        if self.config['ROUTING'] is None:
+            return
+        self.routing_config = {**DEFAULT_CONFIG['ROUTING'], **self.config['ROUTING']}
+        self.router = SeverityRouter(self.routing_config['ROUTES'])
+    
+    def _route(self, analysis: Dict[str, Any]) -> str:
+        """Route for an analysis; 'small' falls back to the generation model if not loaded"""
+        if self.router is None:
+            return "large"
+        route = self.router.route(analysis)
+        if route == "small" and self.small_pipe is None:
+            return "large"
+        return route
+    
+    @contextmanager
+    def _routed(self, route: str, analysis: Dict[str, Any]):
+        if self.router is None:
+            yield
+            return
+        with self.router.timed(route, analysis):
+            yield
+    
     def setup_embeddings(self):
         """Setup sentence embeddings for vector store"""
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'}
+        embedding_config = {**DEFAULT_CONFIG['EMBEDDINGS'], **(self.config['EMBEDDINGS'] or {})}
+        self.embeddings = EmbeddingService(
+            backend=embedding_config['BACKEND'],
+            model_path=embedding_config['MODEL_PATH'],
+            batch_size=embedding_config['BATCH_SIZE'],
+            query_cache_size=embedding_config['QUERY_CACHE_SIZE']
         )
+        print(f"🔤 Embeddings: {self.embeddings.spec['model_path']} ({self.embeddings.spec['backend']})")
     
     def setup_vector_store(self):
         """Initialize or load vector store"""
-        if os.path.exists(self.vector_db_path) and os.listdir(self.vector_db_path):
-            self.vector_store = Chroma(
-                persist_directory=self.vector_db_path,
-                embedding_function=self.embeddings
-            )
-            print("Loaded existing vector store")
+        if self.config['VECTOR_BACKEND'] == 'numpy':
+            self.vector_store = NumpyVectorStore(self.numpy_index_path, self.embeddings)
+            # Each backend tracks its own ingested chunks
+            self.manifest_path = os.path.join(self.numpy_index_path, "manifest.json")
+            exists = self.vector_store.count() > 0
         else:
+            exists = os.path.exists(self.vector_db_path) and os.listdir(self.vector_db_path)
             self.vector_store = Chroma(
                 persist_directory=self.vector_db_path,
                 embedding_function=self.embeddings
             )
+        
+        if exists and encoder_changed(read_manifest(self.manifest_path), self.embeddings.spec):
+            print("Vector store was embedded with another encoder; re-encoding the knowledge base")
+            self.load_knowledge_base()
+        elif exists:
+            print(f"Loaded existing vector store ({self.config['VECTOR_BACKEND']})")
+        else:
             self.load_knowledge_base()
-            print("Created new vector store")
+            print(f"Created new vector store ({self.config['VECTOR_BACKEND']})")
+    
+    def vector_count(self) -> int:
+        if isinstance(self.vector_store, NumpyVectorStore):
+            return self.vector_store.count()
+        return self.vector_store._collection.count()
+    
+    def setup_context_table(self):
+        """Load precomputed concern→context lookups, rebuilding them if the vector store changed"""
+        self.context_table = ContextTable(self.context_table_path)
+        version = self.vector_store_version()
+        if self.context_table.load(version):
+            print(f"Loaded context table ({len(self.context_table.entries)} queries)")
+        else:
+            self.build_context_table(version)
+    
+    def vector_store_version(self) -> str:
+        return vector_store_version(self.manifest_path, self.embeddings.spec)
+    
+    def build_context_table(self, version: str = None):
+        """Retrieve context for every query analyze_initial_answers can produce"""
+        version = version or self.vector_store_version()
+        queries = [self._context_query(analysis) for analysis in self.iter_analysis_buckets()]
+        self.context_table.build(queries, self._search_clinical_context, version)
+        print(f"✅ Built context table for {len(self.context_table.entries)} queries")
     
     def setup_meditron_llm(self):
         """Setup a reliable medical LLM - using stable models"""
         try:
             # Primary: Microsoft Phi-3 Mini (stable, good context)
             model_name = "microsoft/Phi-3-mini-4k-instruct"
+            self.model_name = model_name
             
             print(f"🔄 Loading model: {model_name}")
             
             # Load tokenizer and model
             self.tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
-            self.model = AutoModelForCausalLM.from_pretrained(
-                model_name,
-                torch_dtype=torch.float16,
-                device_map="auto",
-                trust_remote_code=True
-            )
+            self.model = self._load_causal_lm(model_name, trust_remote_code=True)
+            
+            # Left padding so concurrent prompts can be batched together
+            self._prepare_tokenizer_for_batching(self.tokenizer)
             
             # Create text generation pipeline
-            self.pipe = pipeline(
+            self.generation_defaults = {
+                "max_new_tokens": 256,
+                "temperature": 0.7,
+                "top_p": 0.9,
+                "do_sample": True,
+                "pad_token_id": self.tokenizer.eos_token_id
+            }
+            self.pipe = self._wrap_pipeline(pipeline(
                 "text-generation",
                 model=self.model,
                 tokenizer=self.tokenizer,
-                max_new_tokens=256,
-                temperature=0.7,
-                top_p=0.9,
-                do_sample=True,
                 return_full_text=False,
-                pad_token_id=self.tokenizer.eos_token_id
-            )
+                **self.generation_defaults
+            ))
             
             # Wrap in LangChain
             self.llm = HuggingFacePipeline(pipeline=self.pipe)
@@ -97,22 +321,27 @@ class MeditronRAGSystem:
         try:
             # Ultra-stable fallback
             model_name = "distilgpt2"
+            self.model_name = model_name
             
             print(f"🔄 Loading fallback model: {model_name}")
             
             self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-            self.model = AutoModelForCausalLM.from_pretrained(model_name)
+            self.model = self._load_causal_lm(model_name, reduced_precision=False)
+            self._prepare_tokenizer_for_batching(self.tokenizer)
             
-            self.pipe = pipeline(
+            self.generation_defaults = {
+                "max_new_tokens": 200,
+                "temperature": 0.7,
+                "top_p": 0.9,
+                "do_sample": True
+            }
+            self.pipe = self._wrap_pipeline(pipeline(
                 "text-generation",
                 model=self.model,
                 tokenizer=self.tokenizer,
-                max_new_tokens=200,
-                temperature=0.7,
-                top_p=0.9,
-                do_sample=True,
-                return_full_text=False
-            )
+                return_full_text=False,
+                **self.generation_defaults
+            ))
             
             self.llm = HuggingFacePipeline(pipeline=self.pipe)
             print(f"✅ {model_name} loaded successfully (fallback mode)")
@@ -122,19 +351,130 @@ class MeditronRAGSystem:
             print("🔄 Proceeding without LLM - using rule-based system")
             self.llm = None
     
+    def setup_draft_model(self):
+        """Load the optional draft model for assisted generation"""
+        draft_name = self.config['DRAFT_MODEL']
+        if not draft_name or not self.llm:
+            return
+        try:
+            draft_tokenizer = AutoTokenizer.from_pretrained(draft_name)
+            if not tokenizers_compatible(draft_tokenizer, self.tokenizer):
+                print(f"⚠️ Draft model {draft_name} does not share {self.model_name}'s tokenizer; "
+                      "assisted decoding disabled")
+                return
+            
+            draft_model = self._load_causal_lm(draft_name, reduced_precision=False)
+            self.assisted = AssistedDecoder(
+                draft_model, self.model, self.tokenizer,
+                num_draft_tokens=self.config['DRAFT_TOKENS']
+            )
+            print(f"✅ Assisted decoding with draft model {draft_name}")
+        except Exception as e:
+            print(f"❌ Failed to load draft model {draft_name}: {e}")
+    
+    def setup_small_model(self):
+        """Load the small model for the tiers routed to 'small'"""
+        if self.router is None or not self.llm or "small" not in self.router.routes.values():
+            return
+        model_name = self.routing_config['SMALL_MODEL']
+        if model_name == self.model_name:
+            # The generation model already is the small one (fallback mode)
+            self.small_model_name = model_name
+            self.small_tokenizer = self.tokenizer
+            self.small_pipe = self.pipe
+            return
+        try:
+            print(f"🔄 Loading small model: {model_name}")
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+            model = self._load_causal_lm(model_name, reduced_precision=False)
+            self._prepare_tokenizer_for_batching(tokenizer)
+            self.small_pipe = self._wrap_pipeline(pipeline(
+                "text-generation",
+                model=model,
+                tokenizer=tokenizer,
+                return_full_text=False,
+                max_new_tokens=200,
+                temperature=0.7,
+                top_p=0.9,
+                do_sample=True,
+                pad_token_id=tokenizer.eos_token_id
+            ))
+            self.small_model_name = model_name
+            self.small_tokenizer = tokenizer
+            print(f"✅ {model_name} loaded for routed tiers")
+        except Exception as e:
+            print(f"❌ Failed to load small model {model_name}: {e}")
+            print(f"🔄 Its tiers will use {self.model_name}")
+    
+    def _resolve_precision(self, reduced_precision: bool = True) -> str:
+        """
+        INFERENCE_PRECISION for this host. Small models pass
+        reduced_precision=False: on CPU bf16 and int8 cost them accuracy
+        for little speed, so they keep fp32 (fp16 still applies on GPU)
+        """
+        precision = self.config['INFERENCE_PRECISION']
+        if precision == 'auto':
+            precision = 'fp16' if torch.cuda.is_available() else 'bf16'
+        if precision not in ('fp16', 'fp32', 'bf16', 'int8'):
+            raise ValueError(f"Unknown INFERENCE_PRECISION: {precision}")
+        if not reduced_precision:
+            return 'fp16' if precision == 'fp16' and torch.cuda.is_available() else 'fp32'
+        return precision
+    
+    @property
+    def precision(self):
+        """Precision the generation model was loaded in"""
+        return self.model_precisions.get(getattr(self, 'model_name', None))
+    
+    def _load_causal_lm(self, model_name: str, reduced_precision: bool = True, **kwargs):
+        """Load a causal LM in the configured precision (see _resolve_precision)"""
+        precision = self._resolve_precision(reduced_precision)
+        
+        if precision == 'fp16':
+            model = AutoModelForCausalLM.from_pretrained(
+                model_name, torch_dtype=torch.float16, device_map="auto", **kwargs
+            )
+        elif precision == 'bf16':
+            model = AutoModelForCausalLM.from_pretrained(
+                model_name, torch_dtype=torch.bfloat16, low_cpu_mem_usage=True, **kwargs
+            )
+        else:
+            model = AutoModelForCausalLM.from_pretrained(
+                model_name, torch_dtype=torch.float32, low_cpu_mem_usage=True, **kwargs
+            )
+            if precision == 'int8':
+                # Weights stored as int8, activations quantised on the fly (CPU only)
+                model = torch.quantization.quantize_dynamic(
+                    model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+        
+        model.eval()
+        self.model_precisions[model_name] = precision
+        print(f"⚙️ {model_name} inference precision: {precision}")
+        return model
+    
+    def _prepare_tokenizer_for_batching(self, tokenizer):
+        """Decoder-only models need left padding and a pad token to batch"""
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+    
+    def _wrap_pipeline(self, pipe):
+        """Put the micro-batching scheduler in front of the pipeline if enabled"""
+        window_ms = self.config['BATCH_WINDOW_MS']
+        if window_ms <= 0:
+            return pipe
+        print(f"📦 Micro-batching generations: {window_ms}ms window, up to {self.config['BATCH_MAX_SIZE']} prompts")
+        return BatchingPipeline(pipe, window_ms=window_ms, max_batch_size=self.config['BATCH_MAX_SIZE'])
+    
     def setup_prompts(self):
         """Setup specialized prompts for mental health assessment"""
         
         # Enhanced prompt for generating follow-up questions
         self.follow_up_prompt = PromptTemplate(
             input_variables=["analysis", "context"],
-            template="""As a clinical psychologist, generate exactly 5 personalized follow-up questions based on this patient's specific symptoms:
-
-PATIENT ASSESSMENT:
-{analysis}
-
-CLINICAL GUIDANCE:
-{context}
+            # Fixed instructions come first so their KV cache can be reused
+            template="""As a clinical psychologist, generate exactly 5 personalized follow-up questions based on the specific symptoms of the patient described below.
 
 Create questions that are:
 1. HIGHLY SPECIFIC to their symptom severity and patterns
@@ -143,17 +483,32 @@ Create questions that are:
 4. CLINICALLY RELEVANT based on their primary concerns
 5. PERSONALIZED to their unique experience
 
-Focus on understanding their specific struggles with {primary_concerns}.
-
 Return ONLY a JSON array of exactly 5 questions. No explanations.
 
+PATIENT ASSESSMENT:
+{analysis}
+
+CLINICAL GUIDANCE:
+{context}
+
+Focus on understanding their specific struggles with {primary_concerns}.
+
 ["question1", "question2", "question3", "question4", "question5"]"""
         )
 
         # Simplified report prompt
         self.report_prompt = PromptTemplate(
             input_variables=["initial_answers", "follow_up_answers", "clinical_context"],
-            template="""As a psychiatrist, create a brief clinical report:
+            template="""As a psychiatrist, create a brief clinical report from the data below.
+
+Generate concise JSON report with:
+- risk_level (low/moderate/high)
+- diagnostic_considerations (list)
+- symptom_severity (object)
+- clinical_insights (list)
+- functional_impact (short text)
+- recommendations (3-4 items)
+- crisis_indicators (list)
 
 ASSESSMENT DATA:
 {initial_answers}
@@ -164,185 +519,348 @@ FOLLOW-UP RESPONSES:
 GUIDELINES:
 {clinical_context}
 
-Generate concise JSON report with:
-- risk_level (low/moderate/high)
-- primary_concerns (list)
-- symptom_severity (object)
-- key_recommendations (3-4 items)
-- crisis_indicators (list)
-
 JSON only:"""
         )
     
-    def load_knowledge_base(self):
-        """Load all medical documents into the vector store"""
-        documents = []
-        
-        # Load symptom patterns
-        symptoms_path = f"{self.knowledge_base_path}/clinical_guidelines/symptom_patterns.json"
-        if os.path.exists(symptoms_path):
-            with open(symptoms_path, 'r') as f:
-                symptom_data = json.load(f)
-                symptom_text = json.dumps(symptom_data, indent=2)
-                documents.append(Document(
-                    page_content=symptom_text,
-                    metadata={"source": "symptom_patterns", "type": "clinical_guidelines"}
-                ))
-        
-        # Load assessment tools
-        assessment_files = [
-            "assessment_tools/phq9_questions.txt",
-            "assessment_tools/gad7_questions.txt", 
-            "diagnostic_criteria/depression_dsm5.txt",
-            "diagnostic_criteria/anxiety_dsm5.txt"
-        ]
+    def setup_context_packer(self):
+        """Setup token-budgeted context assembly"""
+        tokenizer = self.tokenizer if self.llm else None
+        self.context_packer = ContextPacker(self.embeddings, tokenizer)
+        # Budgets for the small route are counted in the small model's tokens
+        self.small_context_packer = self.context_packer
+        if self.small_pipe is not None and self.small_tokenizer is not self.tokenizer:
+            self.small_context_packer = ContextPacker(self.embeddings, self.small_tokenizer)
+        self.context_budgets = {**DEFAULT_CONFIG['CONTEXT_BUDGETS'], **(self.config['CONTEXT_BUDGETS'] or {})}
+    
+    def setup_prefix_cache(self):
+        """Setup KV-cache reuse for the prompt templates' static prefixes"""
+        self.prefix_cache = None
+        if not self.config['PREFIX_CACHE'] or not self.llm:
+            return
+        if isinstance(self.pipe, BatchingPipeline):
+            # Batched concurrent requests beat reusing the prefix one at a time
+            print("⚠️ PREFIX_CACHE is ignored while micro-batching is on (set BATCH_WINDOW_MS to 0)")
+            return
+        self.prefix_cache = PrefixKVCache(self.model, self.tokenizer)
+    
+    def _prompt_templates(self) -> Dict[str, PromptTemplate]:
+        return {"follow_up": self.follow_up_prompt, "report": self.report_prompt}
+    
+    def setup_question_cache(self):
+        """Setup the follow-up question cache"""
+        cache_config = self.config['QUESTION_CACHE']
+        if not cache_config or not self.llm:
+            self.question_cache = None
+            return
         
-        for file_path in assessment_files:
-            full_path = f"{self.knowledge_base_path}/{file_path}"
-            if os.path.exists(full_path):
-                with open(full_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    documents.append(Document(
-                        page_content=content,
-                        metadata={"source": file_path, "type": "assessment_tool"}
-                    ))
-        
-        # Load clinical guidelines
-        guideline_files = [
-            "clinical_guidelines/nice_depression.txt",
-            "clinical_guidelines/who_mhgap.txt"
-        ]
+        self.question_cache = QuestionCache(
+            max_entries=cache_config.get('MAX_ENTRIES', 1024),
+            ttl_seconds=cache_config.get('TTL_SECONDS', 7 * 24 * 3600),
+            disk_path=cache_config.get('DISK_PATH')
+        )
+        # Entries are only valid for the model and prompt that produced them
+        template_hash = hashlib.sha256(self.follow_up_prompt.template.encode('utf-8')).hexdigest()[:12]
+        decoding = "json" if self.config['STRUCTURED_DECODING'] else "free"
+        self.question_cache_namespace = f"{self.model_name}:{template_hash}:{decoding}"
+        if self.small_pipe is not None:
+            self.small_question_cache_namespace = f"{self.small_model_name}:{template_hash}:{decoding}"
+    
+    def question_cache_key(self, analysis: Dict[str, Any], route: str = "large") -> str:
+        if route == "small":
+            return analysis_fingerprint(analysis, namespace=self.small_question_cache_namespace)
+        return analysis_fingerprint(analysis, namespace=self.question_cache_namespace)
+    
+    def _question_generation_kwargs(self, route: str = "large") -> Dict[str, Any]:
+        kwargs = self._structured_kwargs('array', route, item_type='string', min_items=5, max_items=5)
+        if self.config['DETERMINISTIC_QUESTIONS']:
+            kwargs["do_sample"] = False
+        return kwargs
+    
+    def _report_generation_kwargs(self, route: str = "large") -> Dict[str, Any]:
+        return self._structured_kwargs('object', route, required_keys=REPORT_FIELDS)
+    
+    def _structured_kwargs(self, root: str, route: str = "large", **schema) -> Dict[str, Any]:
+        """Logits processor and stopping criterion for one constrained generation"""
+        if not self.config['STRUCTURED_DECODING']:
+            return {}
+        return json_constraints(self._tokenizer_for(route), root, **schema)
+    
+    def _tokenizer_for(self, route: str):
+        return self.small_tokenizer if route == "small" else self.tokenizer
+    
+    def _packer_for(self, route: str) -> ContextPacker:
+        return self.small_context_packer if route == "small" else self.context_packer
+    
+    def _budgets_for(self, route: str) -> Dict[str, int]:
+        if route == "small":
+            return {**self.context_budgets, **(self.routing_config['SMALL_CONTEXT_BUDGETS'] or {})}
+        return self.context_budgets
+    
+    def load_knowledge_base(self, rebuild: bool = False, workers: int = None,
+                            batch_size: int = None) -> Dict[str, Any]:
+        """Incrementally sync every knowledge base file into the vector store"""
+        ingestor = KnowledgeBaseIngestor(
+            self.vector_store,
+            self.knowledge_base_path,
+            self.manifest_path,
+            embeddings=self.embeddings,
+            encoder_spec=self.embeddings.spec,
+            batch_size=batch_size or self.config['INGEST_BATCH_SIZE'],
+            workers=self.config['INGEST_WORKERS'] if workers is None else workers
+        )
+        report = ingestor.ingest(rebuild=rebuild)
         
-        for file_path in guideline_files:
-            full_path = f"{self.knowledge_base_path}/{file_path}"
-            if os.path.exists(full_path):
-                with open(full_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    documents.append(Document(
-                        page_content=content,
-                        metadata={"source": file_path, "type": "clinical_guideline"}
-                    ))
-        
-        # Split documents and add to vector store
-        if documents:
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200
-            )
-            split_docs = text_splitter.split_documents(documents)
-            self.vector_store.add_documents(split_docs)
-            self.vector_store.persist()
-            print(f"✅ Loaded {len(split_docs)} document chunks into vector store")
+        if report["changed"]:
+            print(f"✅ Knowledge base synced: +{report['chunks_added']} / -{report['chunks_removed']} chunks "
+                  f"({report['chunks_per_second']} chunks/sec)")
         else:
-            print("⚠️ No documents found in knowledge base")
+            print("Knowledge base unchanged")
+        return report
     
-    def analyze_initial_answers(self, answers: Dict[int, int]) -> Dict[str, Any]:
-        """Analyze first 10 answers using clinical scoring"""
-        # PHQ-9 based scoring (questions 0-8)
-        depression_score = sum(answers.get(i, 0) for i in range(9))
-        
-        # GAD-7 based scoring (questions 4-6 for anxiety core items)
-        anxiety_score = sum(answers.get(i, 0) for i in [4, 5, 6])
-        
-        # Sleep disturbance
-        sleep_score = answers.get(2, 0)
-        
-        # Suicide risk (question 8)
-        suicide_risk = answers.get(8, 0)
-        
-        analysis = {
-            "depression_severity": self._score_phq9(depression_score),
-            "anxiety_severity": self._score_gad7(anxiety_score),
-            "sleep_disturbance": "significant" if sleep_score >= 2 else "moderate" if sleep_score == 1 else "minimal",
-            "suicide_risk": "high" if suicide_risk >= 2 else "moderate" if suicide_risk == 1 else "low",
-            "primary_concerns": [],
-            "follow_up_focus": []
-        }
-        
-        # Determine primary concerns
-        if depression_score >= 10:
-            analysis["primary_concerns"].append("depression")
-            analysis["follow_up_focus"].extend(["mood_patterns", "anhedonia", "cognitive_symptoms"])
-        
-        if anxiety_score >= 8:
-            analysis["primary_concerns"].append("anxiety") 
-            analysis["follow_up_focus"].extend(["worry_patterns", "physical_symptoms", "avoidance"])
-        
-        if sleep_score >= 2:
-            analysis["primary_concerns"].append("sleep_disturbance")
-            analysis["follow_up_focus"].append("sleep_quality")
-        
-        # If no clear primary concerns, focus on general wellbeing
-        if not analysis["primary_concerns"]:
-            analysis["primary_concerns"].append("general_wellbeing")
-            analysis["follow_up_focus"].extend(["coping_strategies", "support_systems", "life_impact"])
-        
-        return analysis
-    
-    def _score_phq9(self, score: int) -> str:
-        if score >= 20: return "severe"
-        elif score >= 15: return "moderately_severe" 
-        elif score >= 10: return "moderate"
-        elif score >= 5: return "mild"
-        else: return "minimal"
-    
-    def _score_gad7(self, score: int) -> str:
-        if score >= 15: return "severe"
-        elif score >= 10: return "moderate"
-        elif score >= 5: return "mild"
-        else: return "minimal"
-    
-    def retrieve_clinical_context(self, analysis: Dict[str, Any]) -> str:
-        """Retrieve relevant clinical context based on analysis"""
+    def retrieve_clinical_context(self, analysis: Dict[str, Any], budget: int = None,
+                                  documents: List[Dict[str, str]] = None, route: str = "large") -> str:
+        """
+        Retrieve relevant clinical context based on analysis, packed into a
+        token budget of the route's model; `documents` already retrieved for
+        it skip the retrieval
+        """
+        query = self._context_query(analysis)
+        if documents is None:
+            documents = self.retrieve_clinical_documents(analysis)
+        return self._packer_for(route).pack_documents(
+            query, documents, budget or self.context_budgets['FOLLOW_UP_CONTEXT']
+        )
+    
+    def retrieve_clinical_documents(self, analysis: Dict[str, Any]) -> List[Dict[str, str]]:
+        """Retrieved documents for the analysis, from the context table when possible"""
+        query = self._context_query(analysis)
+        documents = self.context_table.get(query)
+        if documents is None:
+            documents = self._search_clinical_context(query)
+        return documents
+    
+    def _context_query(self, analysis: Dict[str, Any]) -> str:
         query_terms = analysis["primary_concerns"] + analysis["follow_up_focus"]
-        query = " ".join(query_terms)
-        
-        # Retrieve most relevant documents (limit to 2 to reduce token usage)
-        docs = self.vector_store.similarity_search(query, k=2)
-        
-        context = "CLINICAL CONTEXT:\n"
-        for i, doc in enumerate(docs):
-            context += f"\n--- {doc.metadata.get('type', 'guideline').upper()} ---\n"
-            context += doc.page_content[:500] + "\n"  # Shorter content
-        
-        return context
+        return " ".join(query_terms)
+    
+    def _search_clinical_context(self, query: str) -> List[Dict[str, str]]:
+        """Live similarity search, used for queries missing from the context table"""
+        docs = self.vector_store.similarity_search(query, k=self.config['RETRIEVAL_K'])
+        return [
+            {"type": doc.metadata.get('type', 'guideline'), "content": doc.page_content}
+            for doc in docs
+        ]
     
-    def generate_follow_up_questions(self, analysis: Dict[str, Any]) -> List[str]:
+    def generate_follow_up_questions(self, analysis: Dict[str, Any], priority: str = None,
+                                     deadline: float = None) -> List[str]:
         """Generate personalized follow-up questions using LLM"""
+        return self.generate_follow_up(analysis, priority, deadline)["questions"]
+    
+    def generate_follow_up(self, analysis: Dict[str, Any], priority: str = None,
+                           deadline: float = None) -> Dict[str, Any]:
+        """
+        Follow-up questions and what produced them: 'llm', 'cache', 'template',
+        'partial' or 'rules'. Generation stops at `deadline` (time.time()
+        seconds) and the questions finished by then are topped up from the
+        fallback bank. When documents were retrieved for the prompt they are
+        returned as `context_documents` for the report step.
+        """
         if not self.llm:
-            return self._get_fallback_questions(analysis)
+            return {"questions": self._get_fallback_questions(analysis), "generated_by": "rules"}
+        
+        route = self._route(analysis)
+        with self._routed(route, analysis):
+            return self._generate_follow_up(analysis, route, priority, GenerationDeadline(deadline))
+    
+    def _generate_follow_up(self, analysis: Dict[str, Any], route: str, priority: str = None,
+                            deadline: GenerationDeadline = None) -> Dict[str, Any]:
+        if route == "template":
+            return {"questions": self._get_enhanced_fallback_questions(analysis), "generated_by": "template"}
         
+        cache_key = None
+        if self.question_cache is not None:
+            cache_key = self.question_cache_key(analysis, route)
+            cached = self.question_cache.get(cache_key)
+            if cached:
+                return {"questions": cached, "generated_by": "cache"}
+        
+        priority = priority or priority_for(analysis)
+        if not self._admit(priority):
+            return {"questions": self._get_enhanced_fallback_questions(analysis), "generated_by": "rules"}
+        
+        documents = None
         try:
-            # Retrieve relevant clinical context
-            context = self.retrieve_clinical_context(analysis)
-            
-            # Generate questions using LLM with shorter context
-            chain = self.follow_up_prompt | self.llm
-            response = chain.invoke({
-                "analysis": json.dumps(analysis, indent=2),
-                "context": context[:1500],  # Limit context length
-                "primary_concerns": ", ".join(analysis["primary_concerns"])
-            })
+            # Generate questions using LLM with shorter context; the retrieved
+            # documents go back to the caller for the report step
+            documents = self.retrieve_clinical_documents(analysis)
+            prompt = self.follow_up_prompt.format(**self._follow_up_inputs(analysis, route, documents))
+            response = self._generate_text(prompt, template="follow_up", priority=priority, route=route,
+                                           deadline=deadline, **self._question_generation_kwargs(route))
+            if deadline is not None and deadline.hit:
+                return {**self._salvage_questions(response, analysis, deadline), "context_documents": documents}
+            if deadline is not None:
+                self.deadline_stats.record("follow_up", deadline)
             
-            # Parse JSON response
-            questions_text = response.strip()
-            if questions_text.startswith('[') and questions_text.endswith(']'):
-                questions = json.loads(questions_text)
-                if len(questions) == 5:
-                    print("🎯 LLM-generated personalized questions")
-                    return questions
-            
-            # If parsing fails, extract questions from text
-            questions = self._extract_questions_from_text(questions_text)
-            if len(questions) >= 3:
-                return questions[:5]
+            questions = self._parse_questions(response)
+            if questions:
+                # A cancelled generation was cut short; its caller is gone anyway
+                if cache_key is not None and not cancelled():
+                    self.question_cache.set(cache_key, questions)
+                return {"questions": questions, "generated_by": "llm", "context_documents": documents}
                 
         except Exception as e:
             print(f"❌ Error generating questions with LLM: {e}")
         
         # Final fallback
         print("🔄 Using enhanced fallback questions")
-        return self._get_enhanced_fallback_questions(analysis)
+        return {"questions": self._get_enhanced_fallback_questions(analysis), "generated_by": "rules",
+                "context_documents": documents}
+    
+    def _generate_text(self, prompt: str, template: str = None, priority: str = 'routine',
+                       route: str = "large", deadline: GenerationDeadline = None, **generate_kwargs) -> str:
+        """Run one prompt through the route's pipeline and return only the new text"""
+        wait = deadline.remaining() if deadline is not None else None
+        with self.scheduler.slot(priority, timeout=wait) as admitted:
+            if not admitted:
+                # The deadline passed while queued for a slot
+                deadline.hit = True
+                return ""
+            with self._timed_generation():
+                return self._run_pipeline(prompt, template, route, **with_deadline(generate_kwargs, deadline))
+    
+    def _run_pipeline(self, prompt: str, template: str, route: str, **generate_kwargs) -> str:
+        if route == "small":
+            return self.small_pipe(prompt, **generate_kwargs)[0]["generated_text"]
+        if self.assisted is not None:
+            return self.assisted.generate(self.pipe, prompt, **generate_kwargs)
+        prepared = self._prefix_cached_inputs(template, prompt)
+        if prepared is not None:
+            return self._generate_from_prefix(prepared, **generate_kwargs)
+        return self.pipe(prompt, **generate_kwargs)[0]["generated_text"]
+    
+    @contextmanager
+    def _timed_generation(self):
+        """Feed generation latency (after the queue) to the admission controller"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            if self.admission is not None:
+                self.admission.record(time.monotonic() - started)
+    
+    def _prefix_cached_inputs(self, template: str, prompt: str):
+        """Prompt ids plus a KV cache holding the template's static prefix, if reusable"""
+        if self.prefix_cache is None or template is None:
+            return None
+        prefix = static_prefix(self._prompt_templates()[template].template)
+        return self.prefix_cache.prepare(template, prefix, prompt)
+    
+    def _generate_from_prefix(self, prepared, **generate_kwargs) -> str:
+        """Generate directly with the model, continuing from a prefilled KV cache"""
+        input_ids, past_key_values = prepared
+        kwargs = {**self.generation_defaults, **generate_kwargs}
+        kwargs.setdefault("pad_token_id", self.tokenizer.pad_token_id)
+        with torch.no_grad():
+            output = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=past_key_values,
+                **kwargs
+            )
+        return self.tokenizer.decode(output[0, input_ids.shape[1]:], skip_special_tokens=True)
+    
+    def _follow_up_inputs(self, analysis: Dict[str, Any], route: str = "large",
+                          documents: List[Dict[str, str]] = None) -> Dict[str, str]:
+        """Prompt variables for follow-up question generation"""
+        # Retrieve relevant clinical context
+        context = self.retrieve_clinical_context(analysis, budget=self._budgets_for(route)['FOLLOW_UP_CONTEXT'],
+                                                 documents=documents, route=route)
+        return {
+            "analysis": json.dumps(analysis, indent=2),
+            "context": context,
+            "primary_concerns": ", ".join(analysis["primary_concerns"])
+        }
+    
+    def _salvage_questions(self, response: str, analysis: Dict[str, Any],
+                           deadline: GenerationDeadline) -> Dict[str, Any]:
+        """Questions completed before the deadline, topped up from the fallback bank"""
+        repaired = repair_json(response.strip(), root='array')
+        if repaired:
+            partial = [q for q in json.loads(repaired) if isinstance(q, str) and q.strip()]
+        else:
+            partial = self._extract_questions_from_text(response.strip())
+        partial = partial[:5]
+        self.deadline_stats.record("follow_up", deadline, salvaged=bool(partial))
+        print(f"⏱️ Question generation hit its deadline; kept {len(partial)} generated questions")
+        
+        bank = [q for q in self._get_enhanced_fallback_questions(analysis) if q not in partial]
+        return {"questions": (partial + bank)[:5], "generated_by": "partial" if partial else "rules"}
+    
+    def _parse_questions(self, response: str) -> List[str]:
+        """Parse the LLM's JSON array, salvaging questions from free text"""
+        questions_text = response.strip()
+        if not questions_text.endswith(']'):
+            # Constrained decoding stops right after the fifth question
+            questions_text = repair_json(questions_text, root='array') or questions_text
+        if questions_text.startswith('[') and questions_text.endswith(']'):
+            questions = json.loads(questions_text)
+            if len(questions) == 5:
+                print("🎯 LLM-generated personalized questions")
+                return questions
+        
+        # If parsing fails, extract questions from text
+        questions = self._extract_questions_from_text(response.strip())
+        if len(questions) >= 3:
+            return questions[:5]
+        return []
+    
+    def warmup(self):
+        """Run a dummy retrieval and generation pass to allocate buffers"""
+        analysis = self.analyze_initial_answers({})
+        self.retrieve_clinical_context(analysis)
+        if self.llm:
+            self.pipe("Warm up the model.", max_new_tokens=4)
+            if self.small_pipe is not None and self.small_pipe is not self.pipe:
+                self.small_pipe("Warm up the model.", max_new_tokens=4)
+            if self.config['STRUCTURED_DECODING']:
+                # Decoded vocabulary used by the JSON logits processor
+                token_texts(self.tokenizer)
+                if self.small_pipe is not None:
+                    token_texts(self.small_tokenizer)
+            if self.prefix_cache is not None:
+                for name, template in self._prompt_templates().items():
+                    self.prefix_cache.warm(name, static_prefix(template.template))
+        print("🔥 RAG system warmed up")
+    
+    def describe(self) -> Dict[str, Any]:
+        """Report loaded components for status endpoints"""
+        info = {
+            'llm_loaded': self.llm is not None,
+            'knowledge_base_items': self.vector_count(),
+            'vector_backend': self.config['VECTOR_BACKEND'],
+            'inference_precision': self.precision,
+            'model_precisions': dict(self.model_precisions),
+        }
+        if isinstance(getattr(self, 'pipe', None), BatchingPipeline):
+            info['batching'] = self.pipe.stats()
+        if self.assisted is not None:
+            info['assisted_decoding'] = self.assisted.stats()
+        if self.prefix_cache is not None:
+            info['prefix_cache'] = self.prefix_cache.stats()
+        if self.question_cache is not None:
+            info['question_cache'] = self.question_cache.stats()
+        info['context_table'] = self.context_table.stats()
+        info['context_packer'] = self.context_packer.stats()
+        if self.small_context_packer is not self.context_packer:
+            info['small_context_packer'] = self.small_context_packer.stats()
+        info['embeddings'] = self.embeddings.stats()
+        info['scheduler'] = self.scheduler.stats()
+        if self.admission is not None:
+            info['admission'] = self.admission.stats()
+        if self.router is not None:
+            info['routing'] = {**self.router.stats(), 'small_model': getattr(self, 'small_model_name', None)}
+        info['deadlines'] = self.deadline_stats.stats()
+        return info
     
     def _extract_questions_from_text(self, text: str) -> List[str]:
         """Extract questions from LLM response text"""
@@ -362,224 +880,295 @@ JSON only:"""
         
         return questions[:5]
     
-    def _get_enhanced_fallback_questions(self, analysis: Dict[str, Any]) -> List[str]:
-        """Provide more personalized fallback questions"""
-        # More specific question banks
-        severe_depression_questions = [
-            "When the weight feels heaviest, what goes through your mind?",
-            "What does a 'better day' look like for you right now, even if it feels far away?",
-            "How has this affected your sense of who you are?",
-            "What keeps you going when everything feels overwhelming?",
-            "If your pain could speak, what would it want me to understand?"
-        ]
-        
-        moderate_depression_questions = [
-            "Can you describe what a typical day looks like for you now compared to before these feelings started?",
-            "What moments, if any, bring you even temporary relief from the heavy feelings?",
-            "How has this affected your relationships with people you care about?",
-            "What would you most want to change about how you're feeling right now?",
-            "When you look ahead, what feels most uncertain or concerning to you?"
-        ]
-        
-        anxiety_focused_questions = [
-            "When anxiety peaks, what physical sensations do you notice in your body?",
-            "Are there specific thoughts that tend to trigger the anxious feelings?",
-            "What situations have you started avoiding because of how they make you feel?",
-            "How does anxiety affect your sleep and morning routine?",
-            "What have you found that provides even brief moments of calm?"
-        ]
-        
-        sleep_focused_questions = [
-            "What's your mind like when you're trying to fall asleep?",
-            "How do you feel when you wake up - rested or something else?",
-            "What happens in the hours before bed that might affect your sleep?",
-            "How does poor sleep impact the following day for you?",
-            "What have you tried that has helped even a little with sleep?"
-        ]
-        
-        # Select questions based on analysis
-        questions = []
-        
-        # Depression severity-based selection
-        if analysis["depression_severity"] in ["severe", "moderately_severe"]:
-            questions.extend(severe_depression_questions[:2])
-        elif analysis["depression_severity"] == "moderate":
-            questions.extend(moderate_depression_questions[:2])
-        
-        # Add anxiety questions if relevant
-        if analysis["anxiety_severity"] in ["moderate", "severe"] and len(questions) < 4:
-            questions.extend(anxiety_focused_questions[:1])
-        
-        # Add sleep questions if relevant
-        if analysis["sleep_disturbance"] in ["moderate", "significant"] and len(questions) < 4:
-            questions.extend(sleep_focused_questions[:1])
-        
-        # Fill remaining slots with general but personalized questions
-        general_fallbacks = [
-            "What would someone who knows you well say has changed most about you?",
-            "If you could wave a magic wand and change one thing, what would it be?",
-            "What small thing still feels meaningful to you?",
-            "How has this experience changed what's important to you?",
-            "What do you wish people understood about what you're going through?"
-        ]
-        
-        while len(questions) < 5:
-            for q in general_fallbacks:
-                if q not in questions and len(questions) < 5:
-                    questions.append(q)
-        
-        return questions[:5]
-    
-    def _get_fallback_questions(self, analysis: Dict[str, Any]) -> List[str]:
-        """Original fallback questions"""
-        question_bank = {
-            "depression": [
-                "How long have you been experiencing these low mood symptoms?",
-                "What activities or interactions still bring you some sense of pleasure or accomplishment?",
-                "How would you describe your energy levels throughout the day?",
-                "Have you noticed changes in your ability to concentrate or make decisions?",
-                "What does your support system look like right now?"
-            ],
-            "anxiety": [
-                "Can you describe what happens in your body when you feel most anxious?",
-                "Are there specific situations or thoughts that trigger these feelings?",
-                "How does anxiety affect your ability to complete daily tasks?",
-                "What techniques have you tried to manage anxious feelings?",
-                "Do you ever experience panic attacks or intense fear episodes?"
-            ],
-            "sleep_disturbance": [
-                "What does your typical sleep routine look like from evening to morning?",
-                "How do you feel when you wake up in the morning?",
-                "Do you find your mind racing when you try to sleep?",
-                "What have you tried to improve your sleep quality?",
-                "How does poor sleep affect your next day?"
-            ],
-            "general_wellbeing": [
-                "How would you describe your overall quality of life right now?",
-                "What aspects of your life are going well despite these challenges?",
-                "What kind of support would be most helpful to you right now?",
-                "How have you coped with difficult times in the past?",
-                "What would you most like to change about how you're feeling?"
-            ]
-        }
-        
-        questions = []
-        for concern in analysis["primary_concerns"]:
-            if concern in question_bank:
-                questions.extend(question_bank[concern][:2])
-        
-        # Fill remaining slots
-        general_questions = question_bank["general_wellbeing"]
-        while len(questions) < 5:
-            for q in general_questions:
-                if q not in questions and len(questions) < 5:
-                    questions.append(q)
-        
-        return questions[:5]
     
     def generate_comprehensive_report(self, initial_answers: Dict[int, int], 
-                                    follow_up_responses: Dict[str, str]) -> Dict[str, Any]:
-        """Generate detailed clinical report using LLM"""
+                                    follow_up_responses: Dict[str, str], priority: str = None,
+                                    admission: bool = True, deadline: float = None,
+                                    analysis: Dict[str, Any] = None,
+                                    context_documents: List[Dict[str, str]] = None) -> Dict[str, Any]:
+        """
+        Generate detailed clinical report using LLM. Queued jobs pass
+        admission=False: they wait for the model instead of being degraded.
+        At `deadline` the fields generated so far are kept and the rest
+        filled from the basic report. `analysis` and `context_documents`
+        from the follow-up step are reused instead of being recomputed.
+        """
         if not self.llm:
             return self._generate_basic_report(initial_answers, follow_up_responses)
         
+        analysis = analysis or self.analyze_initial_answers(initial_answers)
+        route = self._route(analysis)
+        with self._routed(route, analysis):
+            return self._generate_report(initial_answers, follow_up_responses, route,
+                                         priority or priority_for(analysis), admission,
+                                         GenerationDeadline(deadline), analysis, context_documents)
+    
+    def _generate_report(self, initial_answers: Dict[int, int], follow_up_responses: Dict[str, str],
+                         route: str, priority: str, admission: bool = True,
+                         deadline: GenerationDeadline = None, analysis: Dict[str, Any] = None,
+                         documents: List[Dict[str, str]] = None) -> Dict[str, Any]:
+        if route == "template":
+            return self._template_report(initial_answers, follow_up_responses)
+        if admission and not self._admit(priority):
+            return self._generate_basic_report(initial_answers, follow_up_responses)
+        
         try:
-            # Analyze initial answers
-            analysis = self.analyze_initial_answers(initial_answers)
-            clinical_context = self.retrieve_clinical_context(analysis)
-            
-            # Prepare concise data for LLM
-            answers_summary = self._summarize_answers(initial_answers)
-            follow_up_summary = self._summarize_follow_up(follow_up_responses)
-            
             # Generate report with limited context
-            chain = self.report_prompt | self.llm
-            response = chain.invoke({
-                "initial_answers": answers_summary,
-                "follow_up_answers": follow_up_summary,
-                "clinical_context": clinical_context[:800]  # Strict limit
-            })
-            
-            # Parse JSON response
-            report_text = response.strip()
-            try:
-                report = json.loads(report_text)
-                return self._validate_report_structure(report)
-            except json.JSONDecodeError:
-                return self._generate_basic_report(initial_answers, follow_up_responses)
+            prompt = self.report_prompt.format(**self._report_inputs(
+                initial_answers, follow_up_responses, route, analysis, documents
+            ))
+            response = self._generate_text(prompt, template="report", priority=priority, route=route,
+                                           deadline=deadline, **self._report_generation_kwargs(route))
+            if deadline is not None and deadline.hit:
+                return self._salvage_report(response, initial_answers, follow_up_responses, deadline)
+            if deadline is not None:
+                self.deadline_stats.record("report", deadline)
+            return self._parse_report(response, initial_answers, follow_up_responses)
                 
         except Exception as e:
             print(f"❌ Error generating report with LLM: {e}")
             return self._generate_basic_report(initial_answers, follow_up_responses)
     
-    def _summarize_answers(self, answers: Dict[int, int]) -> str:
-        """Create concise summary of initial answers"""
-        depression_score = sum(answers.get(i, 0) for i in range(9))
-        anxiety_score = sum(answers.get(i, 0) for i in [4, 5, 6])
-        return f"Depression: {depression_score}/27, Anxiety: {anxiety_score}/21, Sleep: {answers.get(2,0)}/3"
-    
-    def _summarize_follow_up(self, responses: Dict[str, str]) -> str:
-        """Create concise summary of follow-up responses"""
-        summary = []
-        for q, a in list(responses.items())[:3]:  # Only use first 3
-            summary.append(f"Q: {q[:50]}... A: {a[:30]}...")
-        return " | ".join(summary)
-    
-    def _validate_report_structure(self, report: Dict[str, Any]) -> Dict[str, Any]:
-        """Ensure report has all required fields"""
-        required_fields = [
-            "risk_level", "diagnostic_considerations", "symptom_severity",
-            "clinical_insights", "functional_impact", "recommendations", "crisis_indicators"
-        ]
+    def _report_inputs(self, initial_answers: Dict[int, int], 
+                       follow_up_responses: Dict[str, str], route: str = "large",
+                       analysis: Dict[str, Any] = None,
+                       documents: List[Dict[str, str]] = None) -> Dict[str, str]:
+        """Prompt variables for report generation"""
+        budgets = self._budgets_for(route)
+        # Analyze initial answers
+        analysis = analysis or self.analyze_initial_answers(initial_answers)
+        clinical_context = self.retrieve_clinical_context(analysis, budget=budgets['REPORT_CONTEXT'],
+                                                          documents=documents, route=route)
         
-        for field in required_fields:
-            if field not in report:
-                report[field] = "Not specified"
+        # Prepare concise data for LLM
+        return {
+            "initial_answers": self._summarize_answers(initial_answers),
+            "follow_up_answers": self._pack_follow_up(follow_up_responses, budgets['REPORT_ANSWERS'], route),
+            "clinical_context": clinical_context
+        }
+    
+    def _pack_follow_up(self, responses: Dict[str, str], budget: int = None, route: str = "large") -> str:
+        """Every follow-up answer, sharing the report's answer token budget"""
+        items = [f"Q: {q} A: {a}" for q, a in responses.items()]
+        return self._packer_for(route).pack_items(items, budget or self.context_budgets['REPORT_ANSWERS'])
+    
+    def _template_report(self, initial_answers: Dict[int, int],
+                         follow_up_responses: Dict[str, str]) -> Dict[str, Any]:
+        """The basic report as the routed answer for low tiers (stored, unlike a fallback)"""
+        report = self._generate_basic_report(initial_answers, follow_up_responses)
+        report["generated_by"] = "template"
+        return report
+    
+    def _parse_report(self, response: str, initial_answers: Dict[int, int], 
+                      follow_up_responses: Dict[str, str]) -> Dict[str, Any]:
+        """Parse JSON response, falling back to the basic report"""
+        report_text = response.strip()
+        try:
+            report = json.loads(report_text)
+        except json.JSONDecodeError:
+            # Keep every complete field of a truncated generation
+            repaired = repair_json(report_text, root='object')
+            try:
+                report = json.loads(repaired) if repaired else None
+            except json.JSONDecodeError:
+                report = None
+        if not isinstance(report, dict) or not report:
+            return self._generate_basic_report(initial_answers, follow_up_responses)
+        report = self._validate_report_structure(report)
+        report["generated_by"] = "llm"
+        return report
+    
+    def _salvage_report(self, response: str, initial_answers: Dict[int, int],
+                        follow_up_responses: Dict[str, str], deadline: GenerationDeadline) -> Dict[str, Any]:
+        """Fields completed before the deadline over the basic report"""
+        report = self._generate_basic_report(initial_answers, follow_up_responses)
+        repaired = repair_json(response.strip(), root='object')
+        try:
+            partial = json.loads(repaired) if repaired else {}
+        except json.JSONDecodeError:
+            partial = {}
+        if not isinstance(partial, dict):
+            partial = {}
+        # A field cut off mid-list or mid-object is closed empty; keep the basic one
+        partial = {key: value for key, value in partial.items() if value not in ([], {}, "")}
+        self.deadline_stats.record("report", deadline, salvaged=bool(partial))
+        print(f"⏱️ Report generation hit its deadline; kept {len(partial)} generated fields")
         
+        if partial:
+            report.update(partial)
+            report["generated_by"] = "partial"
         return report
     
-    def _generate_basic_report(self, initial_answers: Dict[int, int], 
-                             follow_up_responses: Dict[str, str]) -> Dict[str, Any]:
-        """Generate basic report without LLM"""
-        analysis = self.analyze_initial_answers(initial_answers)
+    def _stream_generate(self, prompt: str, template: str = None, priority: str = 'routine',
+                         route: str = "large", deadline: GenerationDeadline = None,
+                         **generate_kwargs) -> Iterator[str]:
+        """Run the route's pipeline in a thread and yield decoded text as it is produced"""
+        streamer = TextIteratorStreamer(self._tokenizer_for(route), skip_prompt=True, skip_special_tokens=True)
+        errors = []
+        generate_kwargs = with_deadline(generate_kwargs, deadline)
+        wait = deadline.remaining() if deadline is not None else None
         
-        return {
-            "risk_level": analysis["suicide_risk"],
-            "diagnostic_considerations": [
-                f"Potential {concern.replace('_', ' ')}" for concern in analysis["primary_concerns"]
-            ],
-            "symptom_severity": {
-                "depression": analysis["depression_severity"],
-                "anxiety": analysis["anxiety_severity"], 
-                "sleep": analysis["sleep_disturbance"],
-                "overall": "severe" if analysis["suicide_risk"] == "high" else "moderate"
-            },
-            "clinical_insights": [
-                f"Primary concerns: {', '.join(analysis['primary_concerns'])}",
-                f"Follow-up focus areas: {', '.join(analysis['follow_up_focus'])}"
-            ],
-            "functional_impact": "Assessment indicates significant impact on daily functioning",
-            "recommendations": self._generate_basic_recommendations(analysis),
-            "crisis_indicators": ["Suicide risk present"] if analysis["suicide_risk"] == "high" else []
-        }
+        def run():
+            try:
+                with self.scheduler.slot(priority, timeout=wait) as admitted:
+                    if not admitted:
+                        deadline.hit = True
+                        streamer.end()
+                        return
+                    with self._timed_generation():
+                        if route == "small":
+                            self.small_pipe(prompt, streamer=streamer, **generate_kwargs)
+                            return
+                        prepared = None if self.assisted is not None else self._prefix_cached_inputs(template, prompt)
+                        if self.assisted is not None:
+                            self.assisted.generate(self.pipe, prompt, streamer=streamer, **generate_kwargs)
+                        elif prepared is not None:
+                            self._generate_from_prefix(prepared, streamer=streamer, **generate_kwargs)
+                        else:
+                            self.pipe(prompt, streamer=streamer, **generate_kwargs)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+        
+        thread = threading.Thread(target=run, name="rag-stream", daemon=True)
+        thread.start()
+        for text in streamer:
+            yield text
+        thread.join()
+        if errors:
+            raise errors[0]
     
-    def _generate_basic_recommendations(self, analysis: Dict[str, Any]) -> List[str]:
-        """Generate basic clinical recommendations"""
-        recommendations = []
+    def stream_follow_up_questions(self, analysis: Dict[str, Any], priority: str = None,
+                                   deadline: float = None) -> Iterator[Dict[str, Any]]:
+        """Yield token and question events while follow-up questions are generated"""
+        if not self.llm:
+            questions = self._get_fallback_questions(analysis)
+            for question in questions:
+                yield {"event": "question", "data": question}
+            yield {"event": "done", "data": {"follow_up_questions": questions, "generated_by": "rules"}}
+            return
         
-        if analysis["suicide_risk"] == "high":
-            recommendations.append("🚨 IMMEDIATE: Crisis assessment and safety planning required")
-            recommendations.append("Consider urgent psychiatric evaluation")
+        route = self._route(analysis)
+        with self._routed(route, analysis):
+            yield from self._stream_follow_up(analysis, route, priority, GenerationDeadline(deadline))
+    
+    def _stream_follow_up(self, analysis: Dict[str, Any], route: str, priority: str = None,
+                          deadline: GenerationDeadline = None) -> Iterator[Dict[str, Any]]:
+        if route == "template":
+            questions = self._get_enhanced_fallback_questions(analysis)
+            for question in questions:
+                yield {"event": "question", "data": question}
+            yield {"event": "done", "data": {"follow_up_questions": questions, "generated_by": "template"}}
+            return
+        
+        cache_key = None
+        if self.question_cache is not None:
+            cache_key = self.question_cache_key(analysis, route)
+            cached = self.question_cache.get(cache_key)
+            if cached:
+                for question in cached:
+                    yield {"event": "question", "data": question}
+                yield {"event": "done", "data": {"follow_up_questions": cached, "generated_by": "cache"}}
+                return
+        
+        priority = priority or priority_for(analysis)
+        if not self._admit(priority):
+            questions = self._get_enhanced_fallback_questions(analysis)
+            for question in questions:
+                yield {"event": "question", "data": question}
+            yield {"event": "done", "data": {"follow_up_questions": questions, "generated_by": "rules"}}
+            return
+        
+        parser = QuestionStreamParser()
+        streamed = []
+        text = ""
+        generated_by = "llm"
+        documents = None
+        try:
+            documents = self.retrieve_clinical_documents(analysis)
+            prompt = self.follow_up_prompt.format(**self._follow_up_inputs(analysis, route, documents))
+            for chunk in self._stream_generate(prompt, template="follow_up", priority=priority, route=route,
+                                               deadline=deadline, **self._question_generation_kwargs(route)):
+                text += chunk
+                yield {"event": "token", "data": chunk}
+                for question in parser.feed(chunk):
+                    streamed.append(question)
+                    yield {"event": "question", "data": question}
+            if deadline is not None and deadline.hit:
+                salvaged = self._salvage_questions(text, analysis, deadline)
+                questions, generated_by = salvaged["questions"], salvaged["generated_by"]
+                for question in questions:
+                    if question not in streamed:
+                        yield {"event": "question", "data": question}
+                yield {"event": "done", "data": {"follow_up_questions": questions, "generated_by": generated_by,
+                                                 "context_documents": documents}}
+                return
+            if deadline is not None:
+                self.deadline_stats.record("follow_up", deadline)
+            questions = self._parse_questions(text)
+            if questions and cache_key is not None:
+                self.question_cache.set(cache_key, questions)
+        except Exception as e:
+            print(f"❌ Error streaming questions with LLM: {e}")
+            questions = []
         
-        if analysis["depression_severity"] in ["moderate", "moderately_severe", "severe"]:
-            recommendations.append("Comprehensive depression assessment recommended")
-            recommendations.append("Consider therapy or medication evaluation")
+        if not questions:
+            print("🔄 Using enhanced fallback questions")
+            questions = self._get_enhanced_fallback_questions(analysis)
+            generated_by = "rules"
+            for question in questions:
+                if question not in streamed:
+                    yield {"event": "question", "data": question}
         
-        if analysis["anxiety_severity"] in ["moderate", "severe"]:
-            recommendations.append("Anxiety management strategies indicated")
-            recommendations.append("Consider cognitive-behavioral therapy")
+        yield {"event": "done", "data": {"follow_up_questions": questions, "generated_by": generated_by,
+                                         "context_documents": documents}}
+    
+    def stream_comprehensive_report(self, initial_answers: Dict[int, int], 
+                                    follow_up_responses: Dict[str, str], priority: str = None,
+                                    deadline: float = None, analysis: Dict[str, Any] = None,
+                                    context_documents: List[Dict[str, str]] = None) -> Iterator[Dict[str, Any]]:
+        """Yield token events while the report is generated, then the parsed report"""
+        if not self.llm:
+            report = self._generate_basic_report(initial_answers, follow_up_responses)
+            yield {"event": "done", "data": {"report": report}}
+            return
+        
+        analysis = analysis or self.analyze_initial_answers(initial_answers)
+        route = self._route(analysis)
+        with self._routed(route, analysis):
+            yield from self._stream_report(initial_answers, follow_up_responses, route,
+                                           priority or priority_for(analysis), GenerationDeadline(deadline),
+                                           analysis, context_documents)
+    
+    def _stream_report(self, initial_answers: Dict[int, int], follow_up_responses: Dict[str, str],
+                       route: str, priority: str, deadline: GenerationDeadline = None,
+                       analysis: Dict[str, Any] = None,
+                       documents: List[Dict[str, str]] = None) -> Iterator[Dict[str, Any]]:
+        if route == "template":
+            yield {"event": "done", "data": {"report": self._template_report(initial_answers, follow_up_responses)}}
+            return
+        if not self._admit(priority):
+            report = self._generate_basic_report(initial_answers, follow_up_responses)
+            yield {"event": "done", "data": {"report": report}}
+            return
         
-        recommendations.append("Review social support systems and coping strategies")
-        recommendations.append("Schedule follow-up within 1-2 weeks")
+        text = ""
+        try:
+            prompt = self.report_prompt.format(**self._report_inputs(
+                initial_answers, follow_up_responses, route, analysis, documents
+            ))
+            for chunk in self._stream_generate(prompt, template="report", priority=priority, route=route,
+                                               deadline=deadline, **self._report_generation_kwargs(route)):
+                text += chunk
+                yield {"event": "token", "data": chunk}
+            if deadline is not None and deadline.hit:
+                report = self._salvage_report(text, initial_answers, follow_up_responses, deadline)
+            else:
+                if deadline is not None:
+                    self.deadline_stats.record("report", deadline)
+                report = self._parse_report(text, initial_answers, follow_up_responses)
+        except Exception as e:
+            print(f"❌ Error streaming report with LLM: {e}")
+            report = self._generate_basic_report(initial_answers, follow_up_responses)
         
-        return recommendations
\ No newline at end of file
+        yield {"event": "done", "data": {"report": report}}
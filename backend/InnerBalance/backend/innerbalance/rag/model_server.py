@@ -0,0 +1,267 @@
+"""
+Local inference daemon shared by all Django workers on a host.
+
+The daemon owns the tokenizer, model, embeddings and vector store; workers
+talk to it over a Unix domain socket. Every message is a 4-byte big-endian
+length followed by a UTF-8 JSON body:
+
+    request:  {"method": "generate_follow_up_questions", "params": {...}}
+    response: {"ok": true, "result": ...} or {"ok": false, "error": "..."}
+
+Streaming methods answer with one {"ok": true, "event": ...} frame per event
+followed by {"ok": true, "end": true}.
+"""
+import os
+import json
+import inspect
+import struct
+import socket
+import threading
+import socketserver
+from typing import List, Dict, Any, Iterator
+
+from rag.clinical_rules import ClinicalRules
+
+HEADER = struct.Struct('>I')
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+
+class ModelServerError(Exception):
+    """Raised when the model server is unreachable or reports a failure"""
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("Connection closed by peer")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_message(sock: socket.socket, message: Dict[str, Any]):
+    body = json.dumps(message).encode('utf-8')
+    sock.sendall(HEADER.pack(len(body)) + body)
+
+
+def recv_message(sock: socket.socket) -> Dict[str, Any]:
+    (size,) = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+    if size > MAX_MESSAGE_BYTES:
+        raise ModelServerError(f"Message of {size} bytes exceeds limit")
+    return json.loads(_recv_exactly(sock, size).decode('utf-8'))
+
+
+def _int_keys(answers: Dict[Any, Any]) -> Dict[int, int]:
+    """JSON turns integer keys into strings; restore them"""
+    return {int(k): int(v) for k, v in answers.items()}
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            response = self.server.dispatch(request)
+            try:
+                if response['ok'] and inspect.isgenerator(response['result']):
+                    self._send_stream(response['result'])
+                else:
+                    send_message(self.request, response)
+            except (ConnectionError, OSError):
+                return
+
+    def _send_stream(self, events):
+        try:
+            for event in events:
+                send_message(self.request, {'ok': True, 'event': event})
+        except (ConnectionError, OSError):
+            events.close()
+            raise
+        except Exception as e:
+            send_message(self.request, {'ok': False, 'error': str(e)})
+            return
+        send_message(self.request, {'ok': True, 'end': True})
+
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve a single MeditronRAGSystem to many worker processes"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, system):
+        self.socket_path = socket_path
+        self.system = system
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _RequestHandler)
+        os.chmod(socket_path, 0o660)
+
+    def dispatch(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        method = request.get('method')
+        params = request.get('params') or {}
+        handler = getattr(self, f"rpc_{method}", None)
+        if handler is None:
+            return {'ok': False, 'error': f"Unknown method: {method}"}
+        try:
+            return {'ok': True, 'result': handler(**params)}
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+
+    def rpc_ping(self):
+        return 'pong'
+
+    def rpc_describe(self):
+        return self.system.describe()
+
+    def rpc_retrieve_clinical_context(self, analysis):
+        return self.system.retrieve_clinical_context(analysis)
+
+    def rpc_generate_follow_up_questions(self, analysis, priority=None, deadline=None):
+        return self.system.generate_follow_up_questions(analysis, priority=priority, deadline=deadline)
+
+    def rpc_generate_follow_up(self, analysis, priority=None, deadline=None):
+        return self.system.generate_follow_up(analysis, priority=priority, deadline=deadline)
+
+    def rpc_generate_comprehensive_report(self, initial_answers, follow_up_responses, priority=None,
+                                          admission=True, deadline=None, analysis=None,
+                                          context_documents=None):
+        return self.system.generate_comprehensive_report(
+            _int_keys(initial_answers), follow_up_responses, priority=priority, admission=admission,
+            deadline=deadline, analysis=analysis, context_documents=context_documents
+        )
+
+    def rpc_stream_follow_up_questions(self, analysis, priority=None, deadline=None):
+        return self.system.stream_follow_up_questions(analysis, priority=priority, deadline=deadline)
+
+    def rpc_stream_comprehensive_report(self, initial_answers, follow_up_responses, priority=None,
+                                        deadline=None, analysis=None, context_documents=None):
+        return self.system.stream_comprehensive_report(
+            _int_keys(initial_answers), follow_up_responses, priority=priority, deadline=deadline,
+            analysis=analysis, context_documents=context_documents
+        )
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class RemoteRAGSystem(ClinicalRules):
+    """Drop-in client for MeditronRAGSystem backed by the model server"""
+
+    def __init__(self, socket_path: str, timeout: float = 120.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        return sock
+
+    def _drop_connection(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+        self._local.sock = None
+
+    def call(self, method: str, **params) -> Any:
+        """Send one request, reconnecting once if a pooled connection went stale"""
+        for attempt in range(2):
+            sock = getattr(self._local, 'sock', None)
+            try:
+                if sock is None:
+                    sock = self._local.sock = self._connect()
+                send_message(sock, {'method': method, 'params': params})
+                response = recv_message(sock)
+                break
+            except (ConnectionError, OSError) as e:
+                self._drop_connection()
+                if attempt:
+                    raise ModelServerError(f"Model server unavailable at {self.socket_path}: {e}")
+
+        if not response.get('ok'):
+            raise ModelServerError(response.get('error', 'Unknown model server error'))
+        return response['result']
+
+    def stream(self, method: str, **params) -> Iterator[Dict[str, Any]]:
+        """Send one streaming request and yield its events as they arrive"""
+        sock = getattr(self._local, 'sock', None)
+        finished = False
+        try:
+            if sock is None:
+                sock = self._local.sock = self._connect()
+            send_message(sock, {'method': method, 'params': params})
+            while True:
+                message = recv_message(sock)
+                if not message.get('ok'):
+                    finished = True
+                    raise ModelServerError(message.get('error', 'Unknown model server error'))
+                if message.get('end'):
+                    finished = True
+                    return
+                yield message['event']
+        except (ConnectionError, OSError) as e:
+            raise ModelServerError(f"Model server unavailable at {self.socket_path}: {e}")
+        finally:
+            # A half-read stream leaves the connection out of sync
+            if not finished:
+                self._drop_connection()
+
+    def warmup(self):
+        self.call('ping')
+
+    def describe(self) -> Dict[str, Any]:
+        info = self.call('describe')
+        info['model_server'] = self.socket_path
+        return info
+
+    def retrieve_clinical_context(self, analysis: Dict[str, Any]) -> str:
+        return self.call('retrieve_clinical_context', analysis=analysis)
+
+    def generate_follow_up_questions(self, analysis: Dict[str, Any], priority: str = None,
+                                     deadline: float = None) -> List[str]:
+        return self.call('generate_follow_up_questions', analysis=analysis, priority=priority, deadline=deadline)
+
+    def generate_follow_up(self, analysis: Dict[str, Any], priority: str = None,
+                           deadline: float = None) -> Dict[str, Any]:
+        return self.call('generate_follow_up', analysis=analysis, priority=priority, deadline=deadline)
+
+    def generate_comprehensive_report(self, initial_answers: Dict[int, int],
+                                      follow_up_responses: Dict[str, str], priority: str = None,
+                                      admission: bool = True, deadline: float = None,
+                                      analysis: Dict[str, Any] = None,
+                                      context_documents: List[Dict[str, str]] = None) -> Dict[str, Any]:
+        return self.call(
+            'generate_comprehensive_report',
+            initial_answers=initial_answers,
+            follow_up_responses=follow_up_responses,
+            priority=priority,
+            admission=admission,
+            deadline=deadline,
+            analysis=analysis,
+            context_documents=context_documents,
+        )
+
+    def stream_follow_up_questions(self, analysis: Dict[str, Any], priority: str = None,
+                                   deadline: float = None) -> Iterator[Dict[str, Any]]:
+        return self.stream('stream_follow_up_questions', analysis=analysis, priority=priority, deadline=deadline)
+
+    def stream_comprehensive_report(self, initial_answers: Dict[int, int],
+                                    follow_up_responses: Dict[str, str], priority: str = None,
+                                    deadline: float = None, analysis: Dict[str, Any] = None,
+                                    context_documents: List[Dict[str, str]] = None) -> Iterator[Dict[str, Any]]:
+        return self.stream(
+            'stream_comprehensive_report',
+            initial_answers=initial_answers,
+            follow_up_responses=follow_up_responses,
+            priority=priority,
+            deadline=deadline,
+            analysis=analysis,
+            context_documents=context_documents,
+        )
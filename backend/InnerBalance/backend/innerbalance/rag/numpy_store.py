@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import uuid
+from typing import List, Dict, Any, Optional, Sequence
+
+import numpy as np
+from langchain.schema import Document
+
+
+class NumpyVectorStore:
+    """
+    In-process vector index for small and medium corpora.
+
+    L2-normalised float32 embeddings live in ``vectors-<generation>.npy`` next
+    to a ``metadata-<generation>.json`` sidecar (ids, texts, metadata), and
+    ``current.json`` names the generation to read. A writer saves a new pair
+    and then swaps the pointer, so readers never see the matrix of one write
+    with the sidecar of another. The matrix is opened with ``mmap_mode='r'``
+    so every worker process on a host shares the same pages through the OS
+    page cache. Search is a brute-force matrix multiply with ``argpartition``
+    top-k, which at this scale beats Chroma's SQLite and HNSW overhead and
+    supports batches of queries in one call.
+    """
+
+    # Seconds between checks for an index rewritten by another process
+    RELOAD_INTERVAL = 30.0
+    # Reads of the pointer before giving up on a consistent generation
+    LOAD_ATTEMPTS = 3
+
+    def __init__(self, directory: str, embedding_function=None):
+        self.directory = directory
+        self.embedding_function = embedding_function
+        self.pointer_path = os.path.join(directory, "current.json")
+        # Single-pair layout written before generations; read if there is no pointer
+        self.vectors_path = os.path.join(directory, "vectors.npy")
+        self.metadata_path = os.path.join(directory, "metadata.json")
+        self._pending_vectors: List[np.ndarray] = []
+        self._deleted = set()
+        self._dirty = False
+        self._generation = None
+        self._vectors = None
+        self._set_rows([], [], [])
+        self._load()
+
+    def _set_rows(self, ids, documents, metadatas):
+        self._ids = ids
+        self._documents = documents
+        self._metadatas = metadatas
+        self._index = {doc_id: row for row, doc_id in enumerate(self._ids)}
+
+    def _read_pointer(self) -> Optional[str]:
+        try:
+            with open(self.pointer_path, "r", encoding="utf-8") as f:
+                return json.load(f)["generation"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _paths(self, generation: Optional[str]):
+        if generation is None:
+            return self.vectors_path, self.metadata_path
+        return (os.path.join(self.directory, f"vectors-{generation}.npy"),
+                os.path.join(self.directory, f"metadata-{generation}.json"))
+
+    def _load(self) -> bool:
+        """Open the generation the pointer names; False (nothing changed) if none reads consistently"""
+        self._checked_at = time.monotonic()
+        for _ in range(self.LOAD_ATTEMPTS):
+            generation = self._read_pointer()
+            vectors_path, metadata_path = self._paths(generation)
+            try:
+                with open(metadata_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                vectors = np.load(vectors_path, mmap_mode="r")
+            except (OSError, ValueError):
+                # Pruned between reading the pointer and the files; re-read it
+                continue
+            if len(vectors) != len(meta["ids"]):
+                continue
+            self._vectors = vectors
+            self._generation = generation
+            self._set_rows(meta["ids"], meta["documents"], meta["metadatas"])
+            return True
+        return False
+
+    def _maybe_reload(self):
+        """Pick up an index rewritten by `manage.py ingest_knowledge_base`"""
+        now = time.monotonic()
+        if self._dirty or now - self._checked_at < self.RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+        generation = self._read_pointer()
+        if generation is not None and generation != self._generation:
+            self._load()
+
+    def _prune(self, keep: Sequence[Optional[str]]):
+        """Remove generations other than `keep` (open memory maps stay valid)"""
+        keep_names = {os.path.basename(path) for generation in keep if generation is not None
+                      for path in self._paths(generation)}
+        for name in os.listdir(self.directory):
+            if name.startswith(("vectors-", "metadata-")) and name not in keep_names:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _normalise(vectors) -> np.ndarray:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _consolidate(self):
+        """Fold pending appends and deletions into one in-memory matrix"""
+        if not self._pending_vectors and not self._deleted:
+            return
+        parts = [] if self._vectors is None else [np.asarray(self._vectors)]
+        parts.extend(self._pending_vectors)
+        matrix = np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+
+        if self._deleted:
+            keep = [row for row, doc_id in enumerate(self._ids) if doc_id not in self._deleted]
+            matrix = matrix[keep]
+            self._ids = [self._ids[row] for row in keep]
+            self._documents = [self._documents[row] for row in keep]
+            self._metadatas = [self._metadatas[row] for row in keep]
+            self._index = {doc_id: row for row, doc_id in enumerate(self._ids)}
+
+        self._vectors = matrix
+        self._pending_vectors = []
+        self._deleted = set()
+
+    # --- writes -----------------------------------------------------------
+
+    def upsert_embeddings(self, ids: Sequence[str], embeddings, documents: Sequence[str],
+                          metadatas: Sequence[Dict[str, Any]]):
+        """Insert or replace rows with pre-computed embeddings (call persist() to save)"""
+        vectors = self._normalise(embeddings)
+        self._deleted.difference_update(ids)
+        if any(doc_id in self._index for doc_id in ids):
+            # Row numbers are only stable once pending changes are folded in
+            self._consolidate()
+            if not self._vectors.flags.writeable:
+                self._vectors = np.array(self._vectors)
+
+        new_rows = []
+        for doc_id, vector, text, metadata in zip(ids, vectors, documents, metadatas):
+            row = self._index.get(doc_id)
+            if row is not None:
+                self._vectors[row] = vector
+                self._documents[row] = text
+                self._metadatas[row] = metadata
+                continue
+            self._index[doc_id] = len(self._ids)
+            self._ids.append(doc_id)
+            self._documents.append(text)
+            self._metadatas.append(metadata)
+            new_rows.append(vector)
+        if new_rows:
+            self._pending_vectors.append(np.stack(new_rows))
+        self._dirty = True
+
+    def add_documents(self, documents: List[Document], ids: Optional[List[str]] = None) -> List[str]:
+        ids = ids or [f"doc-{len(self._ids) + i}" for i in range(len(documents))]
+        texts = [doc.page_content for doc in documents]
+        self.upsert_embeddings(ids, self.embedding_function.embed_documents(texts),
+                               texts, [doc.metadata for doc in documents])
+        return ids
+
+    def delete(self, ids: Sequence[str]):
+        for doc_id in ids:
+            if doc_id in self._index:
+                self._deleted.add(doc_id)
+        self._dirty = True
+
+    def clear(self):
+        """Drop every row (call persist() to save)"""
+        self._vectors = None
+        self._pending_vectors = []
+        self._deleted = set()
+        self._set_rows([], [], [])
+        self._dirty = True
+
+    def persist(self):
+        """Write a new generation, swap the pointer to it, then re-open the matrix read-only"""
+        if not self._dirty:
+            return
+        self._consolidate()
+        os.makedirs(self.directory, exist_ok=True)
+        matrix = self._vectors if self._vectors is not None else np.zeros((0, 0), dtype=np.float32)
+
+        previous = self._generation
+        generation = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+        vectors_path, metadata_path = self._paths(generation)
+        np.save(vectors_path, np.ascontiguousarray(matrix, dtype=np.float32))
+        with open(metadata_path, "w", encoding="utf-8") as f:
+            json.dump({"ids": self._ids, "documents": self._documents, "metadatas": self._metadatas}, f)
+
+        tmp_pointer = f"{self.pointer_path}.{os.getpid()}.tmp"
+        with open(tmp_pointer, "w", encoding="utf-8") as f:
+            json.dump({"generation": generation, "rows": len(self._ids)}, f)
+        os.replace(tmp_pointer, self.pointer_path)
+
+        # The previous generation stays for readers that just read the old pointer
+        self._prune(keep=[previous, generation])
+        self._dirty = False
+        self._load()
+
+    # --- reads ------------------------------------------------------------
+
+    def count(self) -> int:
+        return len(self._ids) - len(self._deleted)
+
+    def get(self, include=None) -> Dict[str, Any]:
+        return {"ids": [doc_id for doc_id in self._ids if doc_id not in self._deleted]}
+
+    def batch_similarity_search_by_vector(self, embeddings, k: int = 4) -> List[List[Document]]:
+        """Top-k documents for each query vector, computed in one matrix multiply"""
+        self._maybe_reload()
+        self._consolidate()
+        queries = self._normalise(embeddings)
+        if self._vectors is None or len(self._ids) == 0:
+            return [[] for _ in range(len(queries))]
+
+        scores = queries @ np.asarray(self._vectors).T
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in enumerate(top):
+            ranked = candidates[np.argsort(-scores[row, candidates])]
+            results.append([
+                Document(page_content=self._documents[i], metadata=self._metadatas[i])
+                for i in ranked
+            ])
+        return results
+
+    def batch_similarity_search(self, queries: List[str], k: int = 4) -> List[List[Document]]:
+        return self.batch_similarity_search_by_vector(self.embedding_function.embed_documents(queries), k)
+
+    def similarity_search_by_vector(self, embedding, k: int = 4) -> List[Document]:
+        return self.batch_similarity_search_by_vector([embedding], k)[0]
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k)
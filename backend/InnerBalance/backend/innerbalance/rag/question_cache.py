@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+# The parts of analyze_initial_answers' output that shape the prompt
+FINGERPRINT_FIELDS = (
+    "depression_severity", "anxiety_severity", "sleep_disturbance",
+    "suicide_risk", "primary_concerns", "follow_up_focus",
+)
+
+
+def analysis_fingerprint(analysis: Dict[str, Any], namespace: str = "") -> str:
+    """Canonical hash of an analysis bucket (plus model/prompt namespace)"""
+    canonical = json.dumps(
+        {field: analysis.get(field) for field in FINGERPRINT_FIELDS},
+        sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(f"{namespace}|{canonical}".encode("utf-8")).hexdigest()
+
+
+class QuestionCache:
+    """
+    LRU + TTL cache of generated follow-up questions keyed by analysis
+    fingerprint, with an optional on-disk tier that survives restarts and is
+    shared by every process pointing at the same directory.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 7 * 24 * 3600,
+                 disk_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if disk_path:
+            os.makedirs(disk_path, exist_ok=True)
+
+    def _expired(self, created_at: float) -> bool:
+        return bool(self.ttl_seconds) and time.time() - created_at > self.ttl_seconds
+
+    def _disk_file(self, fingerprint: str) -> str:
+        return os.path.join(self.disk_path, f"{fingerprint}.json")
+
+    def _read_disk(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._disk_file(fingerprint), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, fingerprint: str, entry: Dict[str, Any]):
+        path = self._disk_file(fingerprint)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def _remember(self, fingerprint: str, entry: Dict[str, Any]):
+        self._entries[fingerprint] = entry
+        self._entries.move_to_end(fingerprint)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, fingerprint: str) -> Optional[List[str]]:
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is not None and self._expired(entry["created_at"]):
+                del self._entries[fingerprint]
+                entry = None
+            if entry is None and self.disk_path:
+                entry = self._read_disk(fingerprint)
+                if entry is not None and self._expired(entry["created_at"]):
+                    entry = None
+                if entry is not None:
+                    self._remember(fingerprint, entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(fingerprint)
+            self.hits += 1
+            return list(entry["questions"])
+
+    def set(self, fingerprint: str, questions: List[str]):
+        entry = {"created_at": time.time(), "questions": list(questions)}
+        with self._lock:
+            self._remember(fingerprint, entry)
+        if self.disk_path:
+            self._write_disk(fingerprint, entry)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_path": self.disk_path,
+        }
@@ -0,0 +1,93 @@
+"""
+Severity-based routing of generations between engines.
+
+Each analysis is banded into a severity tier, and a configurable table maps
+the tier to one of three routes:
+
+    template  ClinicalRules question banks and basic report (no model)
+    small     a small causal LM (distilgpt2 by default)
+    large     the generation model (Phi-3)
+
+Anything flagged for suicidality always goes to the large model.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+ROUTES = ('template', 'small', 'large')
+TIERS = ('minimal', 'mild', 'moderate', 'severe', 'suicidality')
+
+DEFAULT_ROUTES = {
+    'minimal': 'template',
+    'mild': 'template',
+    'moderate': 'small',
+    'severe': 'large',
+    'suicidality': 'large',
+}
+
+
+def severity_tier(analysis: Dict[str, Any]) -> str:
+    """Tier of an analysis from ClinicalRules.analyze_initial_answers"""
+    if analysis.get('suicide_risk', 'low') != 'low':
+        return 'suicidality'
+    levels = (analysis.get('depression_severity'), analysis.get('anxiety_severity'))
+    if 'severe' in levels or 'moderately_severe' in levels:
+        return 'severe'
+    if 'moderate' in levels:
+        return 'moderate'
+    if 'mild' in levels or analysis.get('sleep_disturbance', 'minimal') != 'minimal':
+        return 'mild'
+    return 'minimal'
+
+
+class SeverityRouter:
+    """Route lookup plus per-route request counts and latency"""
+
+    def __init__(self, routes: Optional[Dict[str, str]] = None, window: int = 512):
+        self.routes = {**DEFAULT_ROUTES, **(routes or {})}
+        for tier, route in self.routes.items():
+            if tier not in TIERS or route not in ROUTES:
+                raise ValueError(f"Unknown routing entry: {tier} -> {route}")
+        if self.routes['suicidality'] != 'large':
+            raise ValueError("The suicidality tier must be routed to the large model")
+
+        self._lock = threading.Lock()
+        self._latencies = {route: deque(maxlen=window) for route in ROUTES}
+        self._requests = {route: 0 for route in ROUTES}
+        self._tiers = {tier: 0 for tier in TIERS}
+
+    def route(self, analysis: Dict[str, Any]) -> str:
+        return self.routes[severity_tier(analysis)]
+
+    @contextmanager
+    def timed(self, route: str, analysis: Dict[str, Any]):
+        """Count one request on `route` and record how long it took"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._requests[route] += 1
+                self._tiers[severity_tier(analysis)] += 1
+                self._latencies[route].append(time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = {}
+            for route in ROUTES:
+                latencies = np.array(self._latencies[route])
+                routes[route] = {
+                    'requests': self._requests[route],
+                    'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 1) if len(latencies) else None,
+                    'p95_ms': round(float(np.percentile(latencies, 95)) * 1000, 1) if len(latencies) else None,
+                    'mean_ms': round(float(latencies.mean()) * 1000, 1) if len(latencies) else None,
+                }
+            return {
+                'table': dict(self.routes),
+                'tiers': dict(self._tiers),
+                'routes': routes,
+            }
@@ -0,0 +1,153 @@
+"""
+Priority admission to the models.
+
+Every generation takes a slot from the InferenceScheduler first. Waiting
+calls are admitted in order of clinical priority (crisis > high > moderate >
+routine), with ageing so that routine work is never starved: each
+`aging_seconds` spent waiting counts as one priority class. Crisis work also
+has slots of its own that the other classes can never occupy.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+PRIORITIES = ('crisis', 'high', 'moderate', 'routine')
+RANKS = {name: rank for rank, name in enumerate(PRIORITIES)}
+
+
+def priority_for(analysis: Dict[str, Any]) -> str:
+    """Priority class of an analysis from ClinicalRules.analyze_initial_answers"""
+    if analysis.get('suicide_risk') == 'high':
+        return 'crisis'
+    if analysis.get('suicide_risk') == 'moderate' or \
+            analysis.get('depression_severity') in ('moderately_severe', 'severe'):
+        return 'high'
+    if [c for c in analysis.get('primary_concerns', []) if c != 'general_wellbeing']:
+        return 'moderate'
+    return 'routine'
+
+
+class _Waiter:
+    __slots__ = ('priority', 'rank', 'enqueued')
+
+    def __init__(self, priority: str):
+        self.priority = priority
+        self.rank = RANKS[priority]
+        self.enqueued = time.monotonic()
+
+
+class InferenceScheduler:
+    """Counting semaphore that admits waiters by aged priority"""
+
+    def __init__(self, slots: int = 1, reserved_crisis_slots: int = 1,
+                 aging_seconds: float = 10.0, window: int = 512):
+        self.slots = max(1, slots)
+        self.reserved_crisis_slots = max(0, reserved_crisis_slots)
+        self.aging_seconds = aging_seconds
+        self._cond = threading.Condition()
+        self._waiters: List[_Waiter] = []
+        self._running = 0
+        self._running_reserved = 0
+        self._waits = {name: deque(maxlen=window) for name in PRIORITIES}
+        self._admitted = {name: 0 for name in PRIORITIES}
+        self._timed_out = {name: 0 for name in PRIORITIES}
+
+    def _effective(self, waiter: _Waiter, now: float) -> float:
+        return waiter.rank - (now - waiter.enqueued) / self.aging_seconds
+
+    def _admit(self, waiter: _Waiter) -> Optional[bool]:
+        """Slot kind `waiter` may take now (True = reserved), or None"""
+        if waiter.priority == 'crisis' and self._running_reserved < self.reserved_crisis_slots:
+            crisis = [w for w in self._waiters if w.priority == 'crisis']
+            if waiter is min(crisis, key=lambda w: w.enqueued):
+                return True
+        if self._running < self.slots:
+            now = time.monotonic()
+            best = min(self._waiters, key=lambda w: (self._effective(w, now), w.enqueued))
+            if waiter is best:
+                return False
+        return None
+
+    def acquire(self, priority: str = 'routine', timeout: Optional[float] = None) -> Optional[bool]:
+        """
+        Wait for a slot. Returns the slot kind to pass to release(), or None
+        if `timeout` passed first
+        """
+        waiter = _Waiter(priority if priority in RANKS else 'routine')
+        deadline = None if timeout is None else waiter.enqueued + timeout
+        with self._cond:
+            self._waiters.append(waiter)
+            try:
+                while True:
+                    reserved = self._admit(waiter)
+                    if reserved is not None:
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self._timed_out[waiter.priority] += 1
+                        return None
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters.remove(waiter)
+                # Whoever is next in line may differ now
+                self._cond.notify_all()
+
+            if reserved:
+                self._running_reserved += 1
+            else:
+                self._running += 1
+            self._admitted[waiter.priority] += 1
+            self._waits[waiter.priority].append(time.monotonic() - waiter.enqueued)
+            return reserved
+
+    def release(self, reserved: bool):
+        with self._cond:
+            if reserved:
+                self._running_reserved -= 1
+            else:
+                self._running -= 1
+            self._cond.notify_all()
+
+    def waiting(self) -> int:
+        with self._cond:
+            return len(self._waiters)
+
+    @contextmanager
+    def slot(self, priority: str = 'routine', timeout: Optional[float] = None):
+        """Hold a slot; yields False (holding nothing) if `timeout` passed first"""
+        reserved = self.acquire(priority, timeout)
+        try:
+            yield reserved is not None
+        finally:
+            if reserved is not None:
+                self.release(reserved)
+
+    def stats(self) -> Dict[str, Any]:
+        """Occupancy and queue wait per priority class"""
+        with self._cond:
+            waiting = {name: 0 for name in PRIORITIES}
+            for waiter in self._waiters:
+                waiting[waiter.priority] += 1
+            queue_wait = {}
+            for name in PRIORITIES:
+                waits = np.array(self._waits[name])
+                queue_wait[name] = {
+                    'admitted': self._admitted[name],
+                    'waiting': waiting[name],
+                    'timed_out': self._timed_out[name],
+                    'p50_ms': round(float(np.percentile(waits, 50)) * 1000, 1) if len(waits) else None,
+                    'p95_ms': round(float(np.percentile(waits, 95)) * 1000, 1) if len(waits) else None,
+                    'max_ms': round(float(waits.max()) * 1000, 1) if len(waits) else None,
+                }
+            return {
+                'slots': self.slots,
+                'reserved_crisis_slots': self.reserved_crisis_slots,
+                'running': self._running,
+                'running_reserved': self._running_reserved,
+                'aging_seconds': self.aging_seconds,
+                'queue_wait': queue_wait,
+            }
@@ -0,0 +1,125 @@
+"""
+Declarative questionnaire scoring.
+
+Each instrument is declared once: the answer indices it sums (index =
+``Question.order - 1``) and its severity bands. The declarations compile
+into a weight matrix and per-instrument threshold arrays, so any number of
+answer vectors is scored with one matrix product and banded with
+``searchsorted``.
+"""
+from typing import List, Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Scale questions in the initial assessment, each answered 0-MAX_ITEM_SCORE
+NUM_ITEMS = 10
+MAX_ITEM_SCORE = 3
+
+
+class Instrument:
+    """A scored sum of answer items with ordered severity bands"""
+
+    def __init__(self, name: str, items: Iterable[int], bands: Sequence[Tuple[int, str]],
+                 concern_at: Optional[int] = None, crisis_at: Optional[int] = None):
+        self.name = name
+        self.items = list(items)
+        # (lower bound, label) pairs in ascending order of score
+        self.bands = sorted(bands)
+        # Total from which the instrument counts as a primary concern
+        self.concern_at = concern_at
+        # Total that escalates the assessment to the crisis protocol immediately
+        self.crisis_at = crisis_at
+        self.max_score = MAX_ITEM_SCORE * len(self.items)
+
+
+INSTRUMENTS = (
+    # PHQ-9 (orders 1-9)
+    Instrument("depression", range(9), [
+        (0, "minimal"), (5, "mild"), (10, "moderate"), (15, "moderately_severe"), (20, "severe"),
+    ], concern_at=10),
+    # Core anxiety items, banded with GAD-7 cut-offs
+    Instrument("anxiety", [4, 5, 6], [
+        (0, "minimal"), (5, "mild"), (10, "moderate"), (15, "severe"),
+    ], concern_at=8),
+    Instrument("sleep", [2], [
+        (0, "minimal"), (1, "moderate"), (2, "significant"),
+    ], concern_at=2),
+    # PHQ-9 item 9 (the risk_trigger question)
+    Instrument("suicide_risk", [8], [
+        (0, "low"), (1, "moderate"), (2, "high"),
+    ], crisis_at=2),
+    Instrument("overall", range(NUM_ITEMS), [
+        (0, "minimal"),
+    ]),
+)
+
+
+class ScoringEngine:
+    """Instruments compiled into NumPy weights and thresholds"""
+
+    def __init__(self, instruments: Sequence[Instrument] = INSTRUMENTS, num_items: int = NUM_ITEMS):
+        self.instruments = list(instruments)
+        self.num_items = num_items
+        self.index = {instrument.name: column for column, instrument in enumerate(self.instruments)}
+
+        self.weights = np.zeros((num_items, len(self.instruments)), dtype=np.int32)
+        for column, instrument in enumerate(self.instruments):
+            self.weights[instrument.items, column] = 1
+
+        self.thresholds = [np.array([low for low, _ in i.bands]) for i in self.instruments]
+        self.labels = [np.array([label for _, label in i.bands]) for i in self.instruments]
+
+    def items(self, name: str) -> List[int]:
+        return list(self.instruments[self.index[name]].items)
+
+    def answer_matrix(self, answer_sets: Iterable[Dict[int, int]]) -> np.ndarray:
+        """One row per answer dict; unanswered items score 0"""
+        rows = list(answer_sets)
+        matrix = np.zeros((len(rows), self.num_items), dtype=np.int32)
+        for row, answers in enumerate(rows):
+            for item, value in answers.items():
+                if 0 <= item < self.num_items and value is not None:
+                    matrix[row, item] = value
+        return matrix
+
+    def score(self, matrix: np.ndarray) -> np.ndarray:
+        """(n, items) answers -> (n, instruments) totals in one matrix product"""
+        return np.asarray(matrix, dtype=np.int32) @ self.weights
+
+    def band(self, name: str, scores) -> np.ndarray:
+        """Severity labels for an array of one instrument's totals"""
+        column = self.index[name]
+        positions = np.searchsorted(self.thresholds[column], scores, side="right") - 1
+        return self.labels[column][np.clip(positions, 0, None)]
+
+    def score_answers(self, answers: Dict[int, int]) -> Dict[str, int]:
+        totals = self.score(self.answer_matrix([answers]))[0]
+        return {instrument.name: int(totals[column]) for column, instrument in enumerate(self.instruments)}
+
+    def severity(self, name: str, score: int) -> str:
+        return str(self.band(name, [score])[0])
+
+    def max_score(self, name: str) -> int:
+        return self.instruments[self.index[name]].max_score
+
+    def is_concern(self, name: str, score: int) -> bool:
+        concern_at = self.instruments[self.index[name]].concern_at
+        return concern_at is not None and score >= concern_at
+
+    def item_deltas(self, item: int, delta: int) -> Dict[str, int]:
+        """Change in every instrument total when one item's answer changes by `delta`"""
+        return {
+            instrument.name: int(self.weights[item, column]) * delta
+            for column, instrument in enumerate(self.instruments)
+            if self.weights[item, column]
+        }
+
+    def crises(self, scores: Dict[str, int]) -> List[str]:
+        """Instruments whose totals have reached their crisis threshold"""
+        return [
+            instrument.name for instrument in self.instruments
+            if instrument.crisis_at is not None and scores.get(instrument.name, 0) >= instrument.crisis_at
+        ]
+
+
+SCORING = ScoringEngine()
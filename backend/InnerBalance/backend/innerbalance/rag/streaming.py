@@ -0,0 +1,40 @@
+import re
+import json
+from typing import List
+
+# A complete JSON string literal, honouring backslash escapes
+_STRING_LITERAL = re.compile(r'"((?:[^"\\\n]|\\.)*)"')
+
+
+class QuestionStreamParser:
+    """
+    Pick complete questions out of a JSON array while it is still being
+    generated, so each one can be sent to the client as soon as its closing
+    quote arrives.
+    """
+
+    def __init__(self, min_length: int = 15):
+        self.min_length = min_length
+        self.buffer = ""
+        self.position = 0
+        self.started = False
+
+    def feed(self, chunk: str) -> List[str]:
+        self.buffer += chunk
+        if not self.started:
+            start = self.buffer.find('[')
+            if start < 0:
+                return []
+            self.started = True
+            self.position = start + 1
+
+        questions = []
+        for match in _STRING_LITERAL.finditer(self.buffer, self.position):
+            self.position = match.end()
+            try:
+                question = json.loads(match.group(0)).strip()
+            except json.JSONDecodeError:
+                continue
+            if len(question) > self.min_length:
+                questions.append(question)
+        return questions
@@ -0,0 +1,410 @@
+"""
+Constrained JSON decoding for the follow-up question array and the report.
+
+A character-level JSON prefix validator is kept in step with the generated
+tokens. A logits processor masks every candidate token that would make the
+output invalid for the schema, and a stopping criterion ends generation as
+soon as the top-level value is closed (or the last allowed array item is
+emitted), so no tokens are spent after the answer is complete.
+"""
+import copy
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import torch
+from transformers import LogitsProcessor, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+
+WHITESPACE = ' \t\n\r'
+HEX_DIGITS = '0123456789abcdefABCDEF'
+NUMBER_CHARS = '0123456789+-.eE'
+LITERALS = {'t': 'rue', 'f': 'alse', 'n': 'ull'}
+
+
+class JsonPrefixValidator:
+    """
+    Incremental validator accepting exactly the prefixes of JSON documents
+    that match a small schema: the root container type, optionally string-only
+    items for a root array, min/max item counts for that array, and for a
+    root object the exact set of keys it must have (each once, any order).
+    """
+
+    def __init__(self, root: str = 'array', item_type: Optional[str] = None,
+                 min_items: int = 0, max_items: Optional[int] = None,
+                 required_keys: Sequence[str] = ()):
+        self.root = root
+        self.item_type = item_type
+        self.min_items = min_items
+        self.max_items = max_items
+        self.required_keys = tuple(required_keys)
+        self.keys_seen = frozenset()
+        self.key = ''  # root key read so far
+        self.stack: List[List[Any]] = []  # [kind, item count] per open container
+        self.state = 'VALUE'
+        self.escape = False
+        self.hex_left = 0
+        self.literal = ''
+        self.text = ''
+        self.length = 0
+        self.safe_length = 0
+        self.safe_stack = ()
+
+    def clone(self) -> 'JsonPrefixValidator':
+        other = copy.copy(self)
+        other.stack = [list(entry) for entry in self.stack]
+        return other
+
+    @property
+    def done(self) -> bool:
+        return self.state == 'DONE'
+
+    @property
+    def finished(self) -> bool:
+        """True once nothing useful can follow: root closed, or last array item written"""
+        if self.done:
+            return True
+        return (
+            self.max_items is not None and self.state == 'AFTER_VALUE'
+            and len(self.stack) == 1 and self.stack[0][0] == 'array'
+            and self.stack[0][1] >= self.max_items
+        )
+
+    def _root_array(self) -> bool:
+        return len(self.stack) == 1 and self.stack[0][0] == 'array'
+
+    def _keyed_root(self) -> bool:
+        """Inside a root object whose keys are fixed"""
+        return bool(self.required_keys) and len(self.stack) == 1 and self.stack[0][0] == 'object'
+
+    def _missing_keys(self) -> List[str]:
+        return [key for key in self.required_keys if key not in self.keys_seen]
+
+    def _key_step(self, ch: str) -> bool:
+        """A root key must spell out one of the keys still missing"""
+        missing = self._missing_keys()
+        if ch == '"':
+            if self.key not in missing:
+                return False
+            self.keys_seen = self.keys_seen | {self.key}
+            self.key = ''
+            self.state = 'COLON'
+            return True
+        key = self.key + ch
+        if not any(name.startswith(key) for name in missing):
+            return False
+        self.key = key
+        return True
+
+    def _end_value(self):
+        if not self.stack:
+            self.state = 'DONE'
+            return
+        self.stack[-1][1] += 1
+        self.state = 'AFTER_VALUE'
+
+    def _close(self, kind: str) -> bool:
+        if not self.stack or self.stack[-1][0] != kind:
+            return False
+        if kind == 'array' and self._root_array() and self.stack[0][1] < self.min_items:
+            return False
+        if kind == 'object' and self._keyed_root() and self._missing_keys():
+            return False
+        self.stack.pop()
+        self._end_value()
+        return True
+
+    def _step(self, ch: str) -> bool:
+        state = self.state
+
+        if state == 'DONE':
+            return ch in WHITESPACE
+
+        if state == 'KEY' and self._keyed_root():
+            return self._key_step(ch)
+
+        if state in ('STRING', 'KEY'):
+            if self.hex_left:
+                if ch not in HEX_DIGITS:
+                    return False
+                self.hex_left -= 1
+                return True
+            if self.escape:
+                if ch == 'u':
+                    self.hex_left = 4
+                elif ch not in '"\\/bfnrt':
+                    return False
+                self.escape = False
+                return True
+            if ch == '\\':
+                self.escape = True
+                return True
+            if ch == '"':
+                if state == 'KEY':
+                    self.state = 'COLON'
+                else:
+                    self._end_value()
+                return True
+            return ord(ch) >= 0x20
+
+        if state == 'NUMBER':
+            if ch in NUMBER_CHARS:
+                return True
+            self._end_value()
+            return self._step(ch)
+
+        if state == 'LITERAL':
+            if not self.literal or ch != self.literal[0]:
+                return False
+            self.literal = self.literal[1:]
+            if not self.literal:
+                self._end_value()
+            return True
+
+        if ch in WHITESPACE:
+            return True
+
+        if state == 'FIRST_ITEM':
+            if ch == ']':
+                return self._close('array')
+            self.state = 'VALUE'
+            return self._step(ch)
+
+        if state == 'VALUE':
+            if not self.stack:
+                opener = '[' if self.root == 'array' else '{'
+                if ch != opener:
+                    return False
+            elif self.item_type == 'string' and self._root_array() and ch != '"':
+                return False
+            if ch == '[':
+                self.stack.append(['array', 0])
+                self.state = 'FIRST_ITEM'
+            elif ch == '{':
+                self.stack.append(['object', 0])
+                self.state = 'FIRST_KEY'
+            elif ch == '"':
+                self.state = 'STRING'
+            elif ch in '-0123456789':
+                self.state = 'NUMBER'
+            elif ch in LITERALS:
+                self.state = 'LITERAL'
+                self.literal = LITERALS[ch]
+            else:
+                return False
+            return True
+
+        if state == 'AFTER_VALUE':
+            kind = self.stack[-1][0]
+            if ch == ',':
+                if kind == 'array':
+                    if self._root_array() and self.max_items is not None and self.stack[0][1] >= self.max_items:
+                        return False
+                    self.state = 'VALUE'
+                else:
+                    if self._keyed_root() and not self._missing_keys():
+                        return False
+                    self.state = 'OBJECT_KEY'
+                return True
+            if ch == ']':
+                return self._close('array')
+            if ch == '}':
+                return self._close('object')
+            return False
+
+        if state == 'FIRST_KEY':
+            if ch == '}':
+                return self._close('object')
+            if ch == '"':
+                self.state = 'KEY'
+                return True
+            return False
+
+        if state == 'OBJECT_KEY':
+            if ch == '"':
+                self.state = 'KEY'
+                return True
+            return False
+
+        if state == 'COLON':
+            if ch == ':':
+                self.state = 'VALUE'
+                return True
+            return False
+
+        return False
+
+    def accepts(self, text: str) -> bool:
+        """Whether `text` could be appended without leaving the schema"""
+        probe = self.clone()
+        return all(probe._step(ch) for ch in text)
+
+    def commit(self, text: str) -> bool:
+        """Consume `text`; returns False (state undefined) if it was invalid"""
+        for ch in text:
+            if not self._step(ch):
+                return False
+            self.length += 1
+            if self.state in ('AFTER_VALUE', 'FIRST_ITEM', 'FIRST_KEY', 'DONE'):
+                self.safe_length = self.length
+                self.safe_stack = tuple(kind for kind, _ in self.stack)
+        self.text += text
+        return True
+
+    def repaired(self) -> Optional[str]:
+        """Close the output at the last complete value so it parses as JSON"""
+        if not self.safe_length:
+            return None
+        closers = ''.join(']' if kind == 'array' else '}' for kind in reversed(self.safe_stack))
+        return self.text[:self.safe_length] + closers
+
+
+def repair_json(text: str, root: str = 'object') -> Optional[str]:
+    """Best-effort repair of truncated JSON: keep every complete value, close the rest"""
+    start = text.find('[' if root == 'array' else '{')
+    if start < 0:
+        return None
+    validator = JsonPrefixValidator(root)
+    for ch in text[start:]:
+        if not validator.commit(ch):
+            break
+    return validator.repaired()
+
+
+_token_text_cache: Dict[Any, List[Optional[str]]] = {}
+
+
+def token_texts(tokenizer) -> List[Optional[str]]:
+    """
+    Decoded text of every vocabulary entry (None for special tokens).
+
+    Tokens are decoded after an anchor so that SentencePiece word-boundary
+    spaces are kept; the table is built once per tokenizer.
+    """
+    key = (tokenizer.name_or_path, len(tokenizer))
+    if key in _token_text_cache:
+        return _token_text_cache[key]
+
+    anchor = tokenizer.encode("a", add_special_tokens=False)
+    base = tokenizer.decode(anchor)
+    special = set(tokenizer.all_special_ids)
+    texts = []
+    for token_id in range(len(tokenizer)):
+        if token_id in special:
+            texts.append(None)
+            continue
+        full = tokenizer.decode(anchor + [token_id])
+        texts.append(full[len(base):] if full.startswith(base) else tokenizer.decode([token_id]))
+
+    _token_text_cache[key] = texts
+    return texts
+
+
+class JsonConstraintState:
+    """
+    Per-row validators kept in step with the tokens generated so far.
+
+    Assisted decoding runs the logits processor over draft tokens that may
+    then be rejected, so the ids seen on a later call can diverge from the
+    ones already consumed. A row is then replayed from its common prefix.
+    """
+
+    def __init__(self, texts: List[Optional[str]], factory: Callable[[], JsonPrefixValidator]):
+        self.texts = texts
+        self.factory = factory
+        self.validators: Optional[List[JsonPrefixValidator]] = None
+        self.broken: List[bool] = []
+        self.history: List[List[int]] = []
+        self.prompt_length = 0
+        self.rewinds = 0
+
+    def sync(self, input_ids: torch.LongTensor):
+        if self.validators is None:
+            # First call sees only the prompt
+            rows = input_ids.shape[0]
+            self.validators = [self.factory() for _ in range(rows)]
+            self.broken = [False] * rows
+            self.history = [[] for _ in range(rows)]
+            self.prompt_length = input_ids.shape[1]
+            return
+        generated = input_ids[:, self.prompt_length:].tolist()
+        for row, tokens in enumerate(generated):
+            history = self.history[row]
+            common = 0
+            limit = min(len(tokens), len(history))
+            while common < limit and tokens[common] == history[common]:
+                common += 1
+            if common < len(history):
+                self._rewind(row, common)
+            for token_id in tokens[common:]:
+                self._advance(row, token_id)
+
+    def _advance(self, row: int, token_id: int):
+        self.history[row].append(token_id)
+        validator = self.validators[row]
+        if self.broken[row] or validator.finished:
+            return
+        text = self.texts[token_id]
+        if text is None or not validator.commit(text):
+            self.broken[row] = True
+
+    def _rewind(self, row: int, length: int):
+        """Rebuild a row's validator from its first `length` generated tokens"""
+        kept = self.history[row][:length]
+        self.validators[row] = self.factory()
+        self.broken[row] = False
+        self.history[row] = []
+        self.rewinds += 1
+        for token_id in kept:
+            self._advance(row, token_id)
+
+    def row_finished(self, row: int) -> bool:
+        return self.broken[row] or self.validators[row].finished
+
+
+class JsonSchemaLogitsProcessor(LogitsProcessor):
+    """Mask every token that would take the output outside the JSON schema"""
+
+    def __init__(self, state: JsonConstraintState, eos_token_id: int, top_k: int = 64):
+        self.state = state
+        self.eos_token_id = eos_token_id
+        self.top_k = top_k
+
+    def _allowed(self, validator: JsonPrefixValidator, row_scores: torch.FloatTensor) -> List[int]:
+        ranked = torch.argsort(row_scores, descending=True).tolist()
+        allowed = []
+        for position, token_id in enumerate(ranked):
+            if position >= self.top_k and allowed:
+                break
+            text = self.state.texts[token_id]
+            if text and validator.accepts(text):
+                allowed.append(token_id)
+        return allowed or [self.eos_token_id]
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        self.state.sync(input_ids)
+        masked = torch.full_like(scores, float('-inf'))
+        for row, validator in enumerate(self.state.validators):
+            if self.state.broken[row]:
+                masked[row] = scores[row]
+                continue
+            allowed = [self.eos_token_id] if validator.finished else self._allowed(validator, scores[row])
+            masked[row, allowed] = scores[row, allowed]
+        return masked
+
+
+class JsonCompleteCriteria(StoppingCriteria):
+    """Stop as soon as every row has produced a complete answer"""
+
+    def __init__(self, state: JsonConstraintState):
+        self.state = state
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        self.state.sync(input_ids)
+        return all(self.state.row_finished(row) for row in range(len(self.state.validators)))
+
+
+def json_constraints(tokenizer, root: str, **schema) -> Dict[str, Any]:
+    """generate() kwargs that constrain one call to the given JSON schema"""
+    state = JsonConstraintState(token_texts(tokenizer), lambda: JsonPrefixValidator(root, **schema))
+    return {
+        'logits_processor': LogitsProcessorList([JsonSchemaLogitsProcessor(state, tokenizer.eos_token_id)]),
+        'stopping_criteria': StoppingCriteriaList([JsonCompleteCriteria(state)]),
+    }